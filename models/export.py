@@ -0,0 +1,206 @@
+import numpy as np
+import tensorflow as tf
+
+from utils import data_pipeline, utils
+
+# Supported TFLite quantization modes
+TFLITE_QUANTIZATION = ("none", "dynamic", "int8")
+
+
+def export_saved_model(inference_model, output_dir):
+    """
+    Saves a model as a SavedModel with a single `serving_default`
+    signature. The signature receives a float32 `images` batch of any size
+    and returns the class `scores`.
+
+    Parameters
+    ----------
+    inference_model : keras.Model
+        Model without training-only layers, see
+        `models.resnet_50.create_inference_model()`.
+
+    output_dir : str
+        Full path to the SavedModel folder.
+    """
+    input_spec = tf.TensorSpec(
+        shape=[None] + list(inference_model.input_shape[1:]),
+        dtype=tf.float32,
+        name="images",
+    )
+
+    @tf.function(input_signature=[input_spec])
+    def serve(images):
+        return {"scores": inference_model(images, training=False)}
+
+    tf.saved_model.save(
+        inference_model, output_dir, signatures={"serving_default": serve}
+    )
+
+
+def representative_dataset(config, num_samples=100):
+    """
+    Creates a generator of calibration samples for int8 quantization,
+    drawn from the training split of `data.directory`, image folders or
+    TFRecord shards.
+
+    Parameters
+    ----------
+    config : dict
+        Experiment settings as Python dict.
+
+    num_samples : int
+        Number of images used for calibration.
+
+    Returns
+    -------
+    generator : callable
+        Function yielding lists with a single image batch of size 1.
+    """
+    data_config = dict(config["data"])
+    data_config.pop("pipeline", None)
+    class_names = utils.get_class_names(config)
+    if data_pipeline.get_data_format(data_config) == "tfrecord":
+        # Images come shuffled from the training shards
+        dataset = data_pipeline.build_dataset(
+            dict(config, data=dict(data_config, batch_size=1)),
+            "training",
+            class_names,
+        ).take(num_samples)
+
+        def generator():
+            for img, _ in dataset:
+                yield [img]
+
+        return generator
+
+    file_paths, _ = data_pipeline.list_image_files(
+        data_config, "training", class_names, config["seed"]
+    )
+    rng = np.random.default_rng(config["seed"])
+    sample_paths = rng.choice(
+        file_paths, size=min(num_samples, len(file_paths)), replace=False
+    )
+    image_size = tuple(data_config["image_size"])
+
+    def generator():
+        for path in sample_paths:
+            img = data_pipeline.load_image(path, image_size)
+            yield [tf.expand_dims(img, 0)]
+
+    return generator
+
+
+def convert_to_tflite(
+    saved_model_dir, output_path, quantization="none", representative_data=None
+):
+    """
+    Converts a SavedModel to TFLite.
+
+    Parameters
+    ----------
+    saved_model_dir : str
+        Full path to the SavedModel folder.
+
+    output_path : str
+        Full path to the resulting `.tflite` file.
+
+    quantization : str
+        One of "none", "dynamic" (int8 weights, float activations) or
+        "int8" (int8 weights and activations, needs calibration data).
+        Model inputs and outputs stay in float32 in all cases.
+
+    representative_data : callable
+        Calibration data generator, see `representative_dataset()`.
+        Only needed when quantization="int8".
+    """
+    if quantization not in TFLITE_QUANTIZATION:
+        raise ValueError("Unknown quantization mode {}".format(quantization))
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "int8":
+        if representative_data is None:
+            raise ValueError("int8 quantization needs calibration data")
+        converter.representative_dataset = representative_data
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, "wb") as tflite_f:
+        tflite_f.write(converter.convert())
+
+
+def convert_to_onnx(inference_model, output_path):
+    """
+    Converts a model to ONNX, needs the optional `tf2onnx` package.
+
+    Parameters
+    ----------
+    inference_model : keras.Model
+        Model without training-only layers.
+
+    output_path : str
+        Full path to the resulting `.onnx` file.
+    """
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("ONNX export needs tf2onnx, run `pip install tf2onnx`")
+
+    input_signature = [
+        tf.TensorSpec(
+            shape=[None] + list(inference_model.input_shape[1:]),
+            dtype=tf.float32,
+            name="images",
+        )
+    ]
+    tf2onnx.convert.from_keras(
+        inference_model, input_signature=input_signature, output_path=output_path
+    )
+
+
+class TFLiteModel:
+    """
+    Runs a TFLite model on image batches, so it can be used in place of a
+    Keras model by `utils.predict_from_folder()`.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        """
+        Parameters
+        ----------
+        model_path : str
+            Full path to the `.tflite` file.
+
+        num_threads : int
+            Number of threads used by the interpreter.
+        """
+        self.interpreter = tf.lite.Interpreter(
+            model_path=model_path, num_threads=num_threads
+        )
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple([None] + list(self._input["shape"][1:]))
+
+    def __call__(self, img_batch):
+        """
+        Parameters
+        ----------
+        img_batch : numpy.ndarray
+            Images batch as float32 with shape (batch, height, width, 3).
+
+        Returns
+        -------
+        scores : numpy.ndarray
+            Model scores for each image.
+        """
+        img_batch = np.asarray(img_batch, dtype=np.float32)
+        if tuple(self._input["shape"]) != img_batch.shape:
+            self.interpreter.resize_tensor_input(self._input["index"], img_batch.shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+
+        self.interpreter.set_tensor(self._input["index"], img_batch)
+        self.interpreter.invoke()
+
+        return self.interpreter.get_tensor(self._output["index"])
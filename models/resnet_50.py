@@ -1,6 +1,8 @@
+import contextlib
+
 from utils.data_aug import create_data_aug_layer
 from tensorflow import keras, float32
-from tensorflow.keras import layers, models, regularizers
+from tensorflow.keras import layers, mixed_precision, models, regularizers
 
 
 def create_model(
@@ -10,6 +12,9 @@ def create_model(
     data_aug_layer: dict = None,
     classes: int = None,
     regulizer: float = 0.001,
+    dtype_policy: str = None,
+    trainable_from: str = None,
+    freeze_batch_norm: bool = True,
 ):
     """
     Parameters
@@ -43,6 +48,20 @@ def create_model(
         already has the output classes number defined and we shouldn't change
         it.
 
+    dtype_policy : str
+        Keras mixed precision policy used to build the model, e.g.
+        'mixed_float16' or 'mixed_bfloat16'. The output layer always runs in
+        float32 to keep softmax numerically stable.
+        Only needed when weights='imagenet'.
+
+    trainable_from : str
+        Freezes the Resnet50 base layers before this one, see
+        `set_trainable_from()`. None trains the whole model.
+
+    freeze_batch_norm : bool
+        Keep all the BatchNormalization layers of the base frozen when
+        `trainable_from` is used.
+
     Returns
     -------
     model : keras.Model
@@ -52,57 +71,251 @@ def create_model(
 
     # Create the model to be used for finetuning here!
     if weights == "imagenet":
-        # Define the Input layer
-        # Assign it to `input` variable
-        # Use keras.layers.Input(), following this requirements:
-        #   1. layer dtype must be tensorflow.float32
-        input = layers.Input(shape=input_shape, dtype=float32)
-
-        # Create the data augmentation layers here and add to the model next
-        # to the input layer
-        # If no data augmentation was used, skip this
-        if data_aug_layer is not None:
-            data_augmentation = create_data_aug_layer(data_aug_layer)
-            x = data_augmentation(input)
-        else:
-            x = input
-
-        # Add a layer for preprocessing the input images values
-        # E.g. change pixels interval from [0, 255] to [0, 1]
-        # Resnet50 already has a preprocessing function you must use here
-        # See keras.applications.resnet50.preprocess_input()
-        x = keras.applications.resnet50.preprocess_input(x)
-
-        # Create the corresponding core model using
-        # keras.applications.ResNet50()
-        # The model created here must follow this requirements:
-        #   1. Use imagenet weights
-        #   2. Drop top layer (imagenet classification layer)
-        #   3. Use Global average pooling as model output
-        base_model = keras.applications.ResNet50(
-            include_top=False, pooling="avg", weights="imagenet"
+        with dtype_policy_scope(dtype_policy):
+            model = build_model(
+                input_shape, dropout_rate, data_aug_layer, classes, regulizer
+            )
+
+    else:
+
+        model = models.load_model(weights)
+
+    if trainable_from is not None:
+        set_trainable_from(model, trainable_from, freeze_batch_norm)
+
+    return model
+
+
+def set_trainable_from(model, trainable_from=None, freeze_batch_norm=True):
+    """
+    Freezes the Resnet50 base layers before `trainable_from`, the rest of
+    the model stays trainable. Frozen layers skip gradient computation and
+    their weights get no optimizer updates. The model must be compiled
+    again for the change to take effect.
+
+    Parameters
+    ----------
+    model : keras.Model
+        Model created with `create_model()`.
+
+    trainable_from : str
+        Name, or name prefix, of the first base layer to train. E.g.
+        "conv5_block1" only trains the last Resnet50 stage. "head" freezes
+        the whole base, None or "all" trains all of it.
+
+    freeze_batch_norm : bool
+        Keep the BatchNormalization layers frozen, also in the trained part
+        of the base. Frozen BatchNormalization layers run in inference mode
+        using the ImageNet moving statistics, small finetuning batches
+        would otherwise make them drift.
+    """
+    base_model = model.get_layer("resnet50")
+    if trainable_from in (None, "all"):
+        first_layer = 0
+    elif trainable_from == "head":
+        first_layer = len(base_model.layers)
+    else:
+        names = [layer.name for layer in base_model.layers]
+        first_layer = next(
+            (i for i, name in enumerate(names) if name.startswith(trainable_from)),
+            None,
         )
+        if first_layer is None:
+            raise ValueError("No Resnet50 layer named like `{}`".format(trainable_from))
 
-        x = base_model(x)
+    base_model.trainable = True
+    for i, layer in enumerate(base_model.layers):
+        is_batch_norm = isinstance(layer, layers.BatchNormalization)
+        layer.trainable = i >= first_layer and not (freeze_batch_norm and is_batch_norm)
 
-        # Add a single dropout layer for regularization, use
-        # keras.layers.Dropout()
-        x = layers.Dropout(dropout_rate)(x)
 
-        # Add the classification layer here, use keras.layers.Dense() and
-        # `classes` parameter
-        # Assign it to `outputs` variable
-        outputs = layers.Dense(
-            classes, activation="softmax", kernel_regularizer=regularizers.L2(regulizer)
-        )(x)
+@contextlib.contextmanager
+def dtype_policy_scope(dtype_policy=None):
+    """
+    Sets the Keras global mixed precision policy while building a model and
+    restores the previous one afterwards. Layers keep the policy they were
+    created with.
 
-        # Now you have all the layers in place, create a new model
-        # Use keras.Model()
-        # Assign it to `model` variable
-        model = keras.Model(input, outputs)
+    Parameters
+    ----------
+    dtype_policy : str
+        Policy name, e.g. 'mixed_float16'. None keeps the current one.
+    """
+    if dtype_policy is None:
+        yield
+        return
+
+    previous_policy = mixed_precision.global_policy()
+    mixed_precision.set_global_policy(dtype_policy)
+    try:
+        yield
+    finally:
+        mixed_precision.set_global_policy(previous_policy)
+
+
+def build_model(input_shape, dropout_rate, data_aug_layer, classes, regulizer):
+    """
+    Creates the layers of the model for finetuning, see `create_model()`.
+    """
+    # Define the Input layer
+    # Assign it to `input` variable
+    # Use keras.layers.Input(), following this requirements:
+    #   1. layer dtype must be tensorflow.float32
+    input = layers.Input(shape=input_shape, dtype=float32)
 
+    # Create the data augmentation layers here and add to the model next
+    # to the input layer
+    # If no data augmentation was used, skip this
+    if data_aug_layer is not None:
+        data_augmentation = create_data_aug_layer(data_aug_layer)
+        x = data_augmentation(input)
     else:
+        x = input
 
-        model = models.load_model(weights)
+    # Add a layer for preprocessing the input images values
+    # E.g. change pixels interval from [0, 255] to [0, 1]
+    # Resnet50 already has a preprocessing function you must use here
+    # See keras.applications.resnet50.preprocess_input()
+    x = keras.applications.resnet50.preprocess_input(x)
+
+    # Create the corresponding core model using
+    # keras.applications.ResNet50()
+    # The model created here must follow this requirements:
+    #   1. Use imagenet weights
+    #   2. Drop top layer (imagenet classification layer)
+    #   3. Use Global average pooling as model output
+    base_model = keras.applications.ResNet50(
+        include_top=False, pooling="avg", weights="imagenet"
+    )
+
+    x = base_model(x)
+
+    # Add a single dropout layer for regularization, use
+    # keras.layers.Dropout()
+    x = layers.Dropout(dropout_rate)(x)
+
+    # Add the classification layer here, use keras.layers.Dense() and
+    # `classes` parameter
+    # Assign it to `outputs` variable
+    outputs = layers.Dense(
+        classes,
+        activation="softmax",
+        kernel_regularizer=regularizers.L2(regulizer),
+        dtype="float32",
+    )(x)
+
+    # Now you have all the layers in place, create a new model
+    # Use keras.Model()
+    # Assign it to `model` variable
+    model = keras.Model(input, outputs)
 
     return model
+
+
+def create_feature_extractor(input_shape: tuple = (224, 224, 3)):
+    """
+    Creates the frozen part of the model, the same Resnet50 base used by
+    `create_model()` with its input preprocessing. Its outputs are the
+    2048-d pooled embeddings the classification head receives.
+
+    Parameters
+    ----------
+    input_shape : tuple
+        Model input image shape as (height, width, channels).
+
+    Returns
+    -------
+    model : keras.Model
+        Model mapping images to embeddings.
+    """
+    input = layers.Input(shape=input_shape, dtype=float32)
+    x = keras.applications.resnet50.preprocess_input(input)
+    base_model = keras.applications.ResNet50(
+        include_top=False, pooling="avg", weights="imagenet"
+    )
+    outputs = base_model(x)
+
+    return keras.Model(input, outputs)
+
+
+def create_head(
+    classes: int,
+    dropout_rate: float = 0.0,
+    regulizer: float = 0.001,
+    features_dim: int = 2048,
+):
+    """
+    Creates the classification head alone, same layers `create_model()`
+    puts after the Resnet50 base, so it can be trained from precomputed
+    embeddings.
+
+    Parameters
+    ----------
+    classes : int
+        Model output classes.
+
+    dropout_rate : float
+        Value used for the Dropout layer.
+
+    regulizer : float
+        L2 regularization factor for the output layer.
+
+    features_dim : int
+        Size of the input embeddings.
+
+    Returns
+    -------
+    model : keras.Model
+        Model mapping embeddings to class scores.
+    """
+    input = layers.Input(shape=(features_dim,), dtype=float32)
+    x = layers.Dropout(dropout_rate)(input)
+    outputs = layers.Dense(
+        classes, activation="softmax", kernel_regularizer=regularizers.L2(regulizer)
+    )(x)
+
+    return keras.Model(input, outputs)
+
+
+def load_head_weights(model, head):
+    """
+    Copies the weights of a head trained with `create_head()` into a full
+    model created with `create_model()`.
+
+    Parameters
+    ----------
+    model : keras.Model
+        Full model, its last layer is the classification layer.
+
+    head : keras.Model
+        Trained classification head.
+    """
+    model.layers[-1].set_weights(head.layers[-1].get_weights())
+
+
+def create_inference_model(model):
+    """
+    Rebuilds a trained model without the training-only layers. Data
+    augmentation and Dropout layers are dropped, the input preprocessing,
+    Resnet50 base and classification layer are kept with their weights.
+    The result accepts raw images with pixel values in [0, 255].
+
+    Parameters
+    ----------
+    model : keras.Model
+        Model created with `create_model()`.
+
+    Returns
+    -------
+    inference_model : keras.Model
+        Model ready for serving.
+    """
+    base_model = model.get_layer("resnet50")
+    output_layer = model.layers[-1]
+
+    input = layers.Input(shape=model.input_shape[1:], dtype=float32)
+    x = keras.applications.resnet50.preprocess_input(input)
+    x = base_model(x, training=False)
+    outputs = output_layer(x)
+
+    return keras.Model(input, outputs, name="resnet50_inference")
@@ -0,0 +1,601 @@
+"""
+This script will be used to measure the performance of the project main
+steps and catch regressions between code changes. It runs offline and
+without a GPU, using synthetic images:
+
+    - `data_pipeline`: images/sec of the training dataset built by
+      `scripts/train.py`.
+    - `detection`: per image latency of `detection.get_vehicle_coordinates()`.
+      The detector is created with random weights and a small input size,
+      so no checkpoint is downloaded. When Detectron2 is not installed, or
+      with `--detector stub`, a small stand-in detector is measured
+      instead, see `create_stub_detector()`.
+    - `train_step`: time of a training step of a model built like
+      `resnet_50.create_model()` does.
+    - `predict_from_folder`: images/sec of `utils.predict_from_folder()`.
+
+By default a tiny backbone stands in for Resnet50, use `--backbone resnet50`
+to measure the real model (it needs the imagenet weights).
+
+Results are stored as JSON. When a baseline JSON is given, every metric is
+compared against it and the script exits with an error if any of them got
+worse by more than `--tolerance`. The baseline must have been run with the
+same settings, see `COMPARED_SETTINGS`.
+
+E.g.:
+    $ python3 scripts/benchmark.py benchmarks/current.json \
+        --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tensorflow import keras
+from tensorflow.keras import layers
+
+from models import resnet_50
+from utils import data_pipeline, utils
+from utils.data_aug import create_data_aug_layer
+
+# Available benchmarks, in the order they run
+BENCHMARKS = ("data_pipeline", "detection", "train_step", "predict_from_folder")
+
+# Detectors the detection benchmark can measure, "auto" picks Detectron2
+# when it's installed
+DETECTORS = ("auto", "detectron2", "stub")
+
+# Settings that must match the baseline for the results to be comparable
+COMPARED_SETTINGS = (
+    "backbone",
+    "detector",
+    "num_images",
+    "num_classes",
+    "image_size",
+    "batch_size",
+    "device",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the project.")
+    parser.add_argument(
+        "output_file",
+        type=str,
+        help="Full path to the JSON file in which we will store the results.",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Full path to a previous results JSON file to compare against.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Max relative slowdown accepted when comparing, e.g. 0.1 is 10%%.",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        nargs="+",
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help="Benchmarks to run, all of them by default.",
+    )
+    parser.add_argument(
+        "--backbone",
+        type=str,
+        choices=("tiny", "resnet50"),
+        default="tiny",
+        help="Model used for the train step and predict benchmarks.",
+    )
+    parser.add_argument(
+        "--detector",
+        type=str,
+        choices=DETECTORS,
+        default="auto",
+        help="Detector used for the detection benchmark.",
+    )
+    parser.add_argument("--num_images", type=int, default=256)
+    parser.add_argument("--num_classes", type=int, default=4)
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Times each measure is repeated, the median is reported.",
+    )
+    parser.add_argument("--seed", type=int, default=123)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def make_synthetic_dataset(folder, num_images, num_classes, seed=123):
+    """
+    Writes random JPEG images with different sizes in the same folder
+    structure used for training, one subfolder per class.
+
+    Returns
+    -------
+    class_names : list
+        List of classes as string.
+    """
+    rng = np.random.default_rng(seed)
+    class_names = ["class_{:02d}".format(i) for i in range(num_classes)]
+    for class_name in class_names:
+        os.makedirs(os.path.join(folder, class_name), exist_ok=True)
+
+    for i in range(num_images):
+        height, width = rng.integers(240, 480), rng.integers(320, 640)
+        pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(
+            os.path.join(folder, class_names[i % num_classes], "{:05d}.jpg".format(i))
+        )
+
+    return class_names
+
+
+def create_tiny_model(input_shape, classes, data_aug_layer=None):
+    """
+    Stand-in for `resnet_50.create_model()` with the same layers around a
+    tiny convolutional backbone, so it runs fast on CPU without
+    downloading weights.
+    """
+    input = layers.Input(shape=input_shape, dtype=tf.float32)
+    x = input
+    if data_aug_layer is not None:
+        x = create_data_aug_layer(data_aug_layer)(x)
+    x = keras.applications.resnet50.preprocess_input(x)
+    for filters in (16, 32, 64):
+        x = layers.Conv2D(filters, 3, strides=2, padding="same", activation="relu")(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x)
+    outputs = layers.Dense(classes, activation="softmax", dtype="float32")(x)
+
+    return keras.Model(input, outputs)
+
+
+def create_benchmark_model(backbone, input_shape, classes, data_aug_layer=None):
+    if backbone == "resnet50":
+        return resnet_50.create_model(
+            input_shape=input_shape, classes=classes, data_aug_layer=data_aug_layer
+        )
+
+    return create_tiny_model(input_shape, classes, data_aug_layer)
+
+
+def measure(fn, repeats):
+    """
+    Runs `fn` once for warm up and then `repeats` times.
+
+    Returns
+    -------
+    elapsed : float
+        Median run time in seconds.
+    """
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def latency_stats(latencies):
+    latencies_ms = np.array(latencies) * 1000
+
+    return {
+        "latency_ms_mean": float(latencies_ms.mean()),
+        "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+        "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def benchmark_data_pipeline(config, class_names, repeats):
+    """
+    Measures a full epoch over the training dataset, without a model.
+    """
+    dataset = data_pipeline.build_dataset(config, "training", class_names)
+    num_images = [0]
+
+    def run_epoch():
+        num_images[0] = sum(int(images.shape[0]) for images, _ in dataset)
+
+    elapsed = measure(run_epoch, repeats)
+
+    return {"images_per_sec": num_images[0] / elapsed}
+
+
+def get_detector_name(detector="auto"):
+    """
+    Resolves the detector measured by the detection benchmark, "auto" is
+    Detectron2 if installed and the stub detector otherwise.
+    """
+    if detector != "auto":
+        return detector
+    try:
+        import detectron2  # noqa: F401
+    except ImportError:
+        return "stub"
+
+    return "detectron2"
+
+
+def create_stub_detector(min_size=320, max_size=512):
+    """
+    Small stand-in for the Detectron2 model, so the detection benchmark
+    runs without it. Images are resized to the same input resolution, go
+    through a few strided convolutions and a box is predicted. Its results
+    are only comparable with other stub runs.
+
+    Returns
+    -------
+    detect : callable
+        Receives a BGR image and returns a box as (x1, y1, x2, y2).
+    """
+    input = layers.Input(shape=(None, None, 3))
+    x = input
+    for filters in (16, 32, 64, 128):
+        x = layers.Conv2D(filters, 3, strides=2, padding="same", activation="relu")(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    outputs = layers.Dense(4, activation="sigmoid")(x)
+    model = keras.Model(input, outputs)
+
+    def detect(img):
+        height, width = img.shape[:2]
+        scale = min(min_size / min(height, width), max_size / max(height, width))
+        size = (int(round(width * scale)), int(round(height * scale)))
+        resized = cv2.resize(img, size).astype(np.float32)
+        box = model(resized[None], training=False)[0].numpy()
+        x1, x2 = sorted(box[[0, 2]] * width)
+        y1, y2 = sorted(box[[1, 3]] * height)
+
+        return int(x1), int(y1), int(x2), int(y2)
+
+    return detect
+
+
+def benchmark_detection(folder, num_images, repeats, detector="auto"):
+    """
+    Measures `get_vehicle_coordinates()` latency per image, on a randomly
+    initialized detector with a small input size. See `get_detector_name()`
+    for the `detector` values.
+    """
+    if get_detector_name(detector) == "detectron2":
+        from utils import detection
+
+        # Empty weights keep the random initialization, nothing is downloaded
+        detection.configure_detector(weights="", min_size=320, max_size=512)
+        detect = detection.get_vehicle_coordinates
+    else:
+        detect = create_stub_detector(min_size=320, max_size=512)
+
+    imgs = [
+        cv2.imread(os.path.join(dirpath, filename))
+        for dirpath, filename in sorted(utils.walkdir(folder))
+    ][: min(num_images, 32)]
+
+    # Warm up
+    detect(imgs[0])
+
+    latencies = []
+    for _ in range(repeats):
+        for img in imgs:
+            start = time.perf_counter()
+            detect(img)
+            latencies.append(time.perf_counter() - start)
+
+    return latency_stats(latencies)
+
+
+def benchmark_train_step(config, backbone, class_names, repeats, num_steps=10):
+    """
+    Measures the training step time on a fixed batch, so only the model
+    is timed and not the input pipeline.
+    """
+    image_size = tuple(config["data"]["image_size"])
+    batch_size = config["data"]["batch_size"]
+    model = create_benchmark_model(
+        backbone,
+        image_size + (3,),
+        len(class_names),
+        data_aug_layer={"random_flip": {"mode": "horizontal"}},
+    )
+    model.compile(
+        optimizer=keras.optimizers.Adam(),
+        loss="categorical_crossentropy",
+        metrics=["accuracy"],
+    )
+
+    rng = np.random.default_rng(config["seed"])
+    images = rng.uniform(0, 255, size=(batch_size,) + image_size + (3,))
+    labels = keras.utils.to_categorical(
+        rng.integers(0, len(class_names), size=batch_size), len(class_names)
+    )
+    images = tf.constant(images, dtype=tf.float32)
+    labels = tf.constant(labels, dtype=tf.float32)
+
+    def run_steps():
+        for _ in range(num_steps):
+            model.train_on_batch(images, labels)
+
+    elapsed = measure(run_steps, repeats) / num_steps
+
+    return {
+        "step_time_ms": elapsed * 1000,
+        "images_per_sec": batch_size / elapsed,
+    }
+
+
+def benchmark_predict_from_folder(config, backbone, folder, class_names, repeats):
+    image_size = tuple(config["data"]["image_size"])
+    model = create_benchmark_model(backbone, image_size + (3,), len(class_names))
+    num_images = [0]
+
+    def run_predict():
+        predictions, _ = utils.predict_from_folder(
+            folder,
+            model,
+            image_size,
+            class_names,
+            batch_size=config["data"]["batch_size"],
+        )
+        num_images[0] = len(predictions)
+
+    elapsed = measure(run_predict, repeats)
+
+    return {"images_per_sec": num_images[0] / elapsed}
+
+
+def is_higher_better(metric):
+    """
+    Throughput metrics end with "_per_sec", the others are times.
+    """
+    return metric.endswith("_per_sec")
+
+
+def check_settings(results, baseline):
+    """
+    Raises a ValueError if the baseline was run with other settings, see
+    `COMPARED_SETTINGS`, its metrics can't be compared then.
+    """
+    mismatches = [
+        "{}: {} != {}".format(
+            name, results["settings"].get(name), baseline["settings"].get(name)
+        )
+        for name in COMPARED_SETTINGS
+        if results["settings"].get(name) != baseline["settings"].get(name)
+    ]
+    if mismatches:
+        raise ValueError(
+            "The baseline was run with different settings ({})".format(
+                ", ".join(mismatches)
+            )
+        )
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Compares every metric against the baseline, it must have the same
+    settings, see `check_settings()`.
+
+    Parameters
+    ----------
+    results, baseline : dict
+        Benchmark results, see `main()`.
+
+    tolerance : float
+        Max relative slowdown accepted, e.g. 0.1 is 10%.
+
+    Returns
+    -------
+    comparison : list
+        For each metric present in both results, a dict with the
+        `benchmark`, `metric`, `baseline` and `current` values, the relative
+        `change` (positive means faster) and if it's a `regression`.
+    """
+    check_settings(results, baseline)
+
+    comparison = []
+    for name, metrics in results["benchmarks"].items():
+        baseline_metrics = baseline["benchmarks"].get(name, {})
+        for metric, value in metrics.items():
+            baseline_value = baseline_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not baseline_value:
+                continue
+
+            change = value / baseline_value - 1
+            if not is_higher_better(metric):
+                change = baseline_value / value - 1
+            comparison.append(
+                {
+                    "benchmark": name,
+                    "metric": metric,
+                    "baseline": baseline_value,
+                    "current": value,
+                    "change": change,
+                    "regression": change < -tolerance,
+                }
+            )
+
+    return comparison
+
+
+def get_environment():
+    return {
+        "python": platform.python_version(),
+        "tensorflow": tf.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "gpus": len(tf.config.list_physical_devices("GPU")),
+    }
+
+
+def main(
+    output_file,
+    baseline=None,
+    tolerance=0.1,
+    only=BENCHMARKS,
+    backbone="tiny",
+    detector="auto",
+    num_images=256,
+    num_classes=4,
+    image_size=224,
+    batch_size=32,
+    repeats=3,
+    seed=123,
+):
+    """
+    Parameters
+    ----------
+    output_file : str
+        Full path to the JSON file in which we will store the results.
+
+    baseline : str
+        Full path to a previous results JSON file to compare against.
+
+    tolerance : float
+        Max relative slowdown accepted when comparing.
+
+    only : list
+        Benchmarks to run.
+
+    backbone : str
+        One of "tiny" or "resnet50".
+
+    detector : str
+        Detector used for the detection benchmark, one of `DETECTORS`.
+
+    num_images, num_classes : int
+        Size of the synthetic dataset.
+
+    image_size, batch_size : int
+        Model input size and batch size.
+
+    repeats : int
+        Times each measure is repeated, the median is reported.
+
+    seed : int
+        Seed used to generate the synthetic data.
+
+    Returns
+    -------
+    regressions : list
+        Metrics that got worse than the baseline by more than `tolerance`.
+    """
+    environment = get_environment()
+    settings = {
+        "backbone": backbone,
+        "detector": get_detector_name(detector),
+        "num_images": num_images,
+        "num_classes": num_classes,
+        "image_size": image_size,
+        "batch_size": batch_size,
+        "repeats": repeats,
+        "device": "gpu" if environment["gpus"] else "cpu",
+    }
+    # Fail before running anything if the results can't be compared
+    baseline_results = None
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+        check_settings({"settings": settings}, baseline_results)
+
+    folder = tempfile.mkdtemp()
+    try:
+        class_names = make_synthetic_dataset(folder, num_images, num_classes, seed)
+        config = {
+            "seed": seed,
+            "data": {
+                "directory": folder,
+                "label_mode": "categorical",
+                "validation_split": 0.2,
+                "image_size": [image_size, image_size],
+                "batch_size": batch_size,
+            },
+        }
+
+        results = {
+            "environment": environment,
+            "settings": settings,
+            "benchmarks": {},
+        }
+        for name in BENCHMARKS:
+            if name not in only:
+                continue
+            print("Running {}...".format(name))
+            if name == "data_pipeline":
+                result = benchmark_data_pipeline(config, class_names, repeats)
+            elif name == "detection":
+                result = benchmark_detection(
+                    folder, num_images, repeats, settings["detector"]
+                )
+            elif name == "train_step":
+                result = benchmark_train_step(config, backbone, class_names, repeats)
+            else:
+                result = benchmark_predict_from_folder(
+                    config, backbone, folder, class_names, repeats
+                )
+            results["benchmarks"][name] = result
+            print("    {}".format(result))
+    finally:
+        shutil.rmtree(folder)
+
+    regressions = []
+    if baseline_results is not None:
+        comparison = compare_results(results, baseline_results, tolerance)
+        results["comparison"] = comparison
+        regressions = [c for c in comparison if c["regression"]]
+
+        print("{:<40}{:>12}{:>12}{:>10}".format("", "baseline", "current", "change"))
+        for c in comparison:
+            print(
+                "{:<40}{:>12.2f}{:>12.2f}{:>+10.1%}{}".format(
+                    "{}.{}".format(c["benchmark"], c["metric"]),
+                    c["baseline"],
+                    c["current"],
+                    c["change"],
+                    "  REGRESSION" if c["regression"] else "",
+                )
+            )
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(results, f, indent=4)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    regressions = main(
+        args.output_file,
+        baseline=args.baseline,
+        tolerance=args.tolerance,
+        only=args.only,
+        backbone=args.backbone,
+        detector=args.detector,
+        num_images=args.num_images,
+        num_classes=args.num_classes,
+        image_size=args.image_size,
+        batch_size=args.batch_size,
+        repeats=args.repeats,
+        seed=args.seed,
+    )
+    if regressions:
+        sys.exit(1)
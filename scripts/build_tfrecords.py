@@ -0,0 +1,262 @@
+"""
+This script will be used to pack the images coming from `car_ims.tgz`
+(extract the .tgz content first) into sharded TFRecord files, one set of
+shards per value of the column `subset` from `car_dataset_labels.csv`.
+
+Reading a few big files sequentially is much faster than opening thousands
+of small ones every epoch, specially on network filesystems. Images are
+stored with their integer label, either with the original JPEG bytes or
+already resized with `--image_size`. Each subset folder also gets a
+`classes.json` file with the class names in label order.
+
+The resulting directory structure should look like this:
+    data/
+    ├── car_tfrecords
+    │   ├── test
+    │   │   ├── classes.json
+    │   │   ├── test-00000-of-00008.tfrecord
+    │   │   ├── ...
+    │   ├── train
+    │   │   ├── classes.json
+    │   │   ├── train-00000-of-00009.tfrecord
+    │   │   ├── ...
+
+Then set `data.directory` to the `train` folder and `data.format` to
+"tfrecord" in the experiment config.
+"""
+import argparse
+import csv
+import glob
+import io
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from utils import tfrecords
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build TFRecord shards.")
+    parser.add_argument(
+        "data_folder",
+        type=str,
+        help=(
+            "Full path to the directory having all the cars images. E.g. "
+            "`/home/app/src/data/car_ims/`."
+        ),
+    )
+    parser.add_argument(
+        "labels",
+        type=str,
+        help=(
+            "Full path to the CSV file with data labels. E.g. "
+            "`/home/app/src/data/car_dataset_labels.csv`."
+        ),
+    )
+    parser.add_argument(
+        "output_data_folder",
+        type=str,
+        help=(
+            "Full path to the directory in which we will store the resulting "
+            "shards. E.g. `/home/app/src/data/car_tfrecords/`."
+        ),
+    )
+    parser.add_argument(
+        "--images_per_shard",
+        type=int,
+        default=512,
+        help="Number of images in each TFRecord file.",
+    )
+    parser.add_argument(
+        "--image_size",
+        type=int,
+        nargs=2,
+        default=None,
+        help="Resize images to (height, width) before storing them.",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=95,
+        help="JPEG quality used when images are resized.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of shards written at the same time.",
+    )
+    parser.add_argument("--seed", type=int, default=123)
+
+    args = parser.parse_args()
+
+    return args
+
+
+def read_labels(labels):
+    """
+    Reads the CSV file with data annotations.
+
+    Returns
+    -------
+    rows : list
+        Tuples having the image name, class name and subset.
+    """
+    with open(labels, "r") as lab_f:
+        csvreader = csv.reader(lab_f, delimiter=",")
+        # we avoid the first row
+        next(csvreader)
+        return [(row[0], row[1], row[2]) for row in csvreader]
+
+
+def encode_image(image_path, image_size=None, quality=95):
+    """
+    Returns the bytes stored for an image: the original file content, or
+    the image resized to (height, width) and encoded as JPEG.
+    """
+    if image_size is None:
+        with open(image_path, "rb") as f:
+            return f.read()
+
+    img = Image.open(image_path).convert("RGB")
+    img = img.resize((image_size[1], image_size[0]), Image.BILINEAR)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+
+    return buffer.getvalue()
+
+
+def write_subset_shards(
+    data_folder,
+    rows,
+    class_names,
+    subset_folder,
+    subset,
+    images_per_shard=512,
+    image_size=None,
+    quality=95,
+    workers=None,
+):
+    """
+    Writes the images of a subset into fixed-size shards, in parallel.
+    Shards left in `subset_folder` by an earlier build are removed first.
+
+    Returns
+    -------
+    num_examples : dict
+        Number of examples in each shard, keyed by the shard file name.
+    """
+    os.makedirs(subset_folder, exist_ok=True)
+    for path in glob.glob(os.path.join(subset_folder, "*.tfrecord")):
+        os.remove(path)
+
+    chunks = [
+        rows[start : start + images_per_shard]
+        for start in range(0, len(rows), images_per_shard)
+    ]
+
+    def write(index, chunk):
+        filename = tfrecords.SHARD_PATTERN.format(
+            subset=subset, index=index, total=len(chunks)
+        )
+        examples = (
+            (
+                encode_image(
+                    os.path.join(data_folder, image_name), image_size, quality
+                ),
+                class_names.index(class_name),
+                image_name,
+            )
+            for image_name, class_name, _ in chunk
+        )
+        return filename, tfrecords.write_shard(
+            os.path.join(subset_folder, filename), examples
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(write, range(len(chunks)), chunks)
+
+        return dict(results)
+
+
+def main(
+    data_folder,
+    labels,
+    output_data_folder,
+    images_per_shard=512,
+    image_size=None,
+    quality=95,
+    workers=None,
+    seed=123,
+):
+    """
+    Parameters
+    ----------
+    data_folder : str
+        Full path to raw images folder.
+
+    labels : str
+        Full path to CSV file with data annotations.
+
+    output_data_folder : str
+        Full path to the directory in which we will store the resulting
+        shards.
+
+    images_per_shard : int
+        Number of images in each TFRecord file.
+
+    image_size : tuple
+        If given, images are resized to (height, width) before storing them.
+
+    quality : int
+        JPEG quality used when images are resized.
+
+    workers : int
+        Number of shards written at the same time.
+
+    seed : int
+        Seed used to shuffle the images between shards.
+    """
+    rows = read_labels(labels)
+    # Labels follow the sorted class names, same for every subset
+    class_names = sorted({class_name for _, class_name, _ in rows})
+
+    for subset in sorted({subset for _, _, subset in rows}):
+        subset_rows = [row for row in rows if row[2] == subset]
+        # Mix classes between shards, so each shard is a random sample
+        random.Random(seed).shuffle(subset_rows)
+
+        subset_folder = os.path.join(output_data_folder, subset)
+        num_examples = write_subset_shards(
+            data_folder,
+            subset_rows,
+            class_names,
+            subset_folder,
+            subset,
+            images_per_shard=images_per_shard,
+            image_size=image_size,
+            quality=quality,
+            workers=workers,
+        )
+        tfrecords.save_class_index(subset_folder, class_names, num_examples)
+        print(
+            "{}: {} images in {} shards".format(
+                subset, sum(num_examples.values()), len(num_examples)
+            )
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(
+        args.data_folder,
+        args.labels,
+        args.output_data_folder,
+        images_per_shard=args.images_per_shard,
+        image_size=args.image_size,
+        quality=args.quality,
+        workers=args.workers,
+        seed=args.seed,
+    )
@@ -0,0 +1,144 @@
+"""
+This script will be used to export a trained model for serving. Training
+only layers (data augmentation and Dropout) are removed and the result is
+saved as a SavedModel with a single `serving_default` signature receiving
+raw images. Optionally, TFLite and ONNX versions of the model are created
+next to it.
+"""
+import argparse
+import os
+
+from models import export, resnet_50
+from utils import utils
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export your model.")
+    parser.add_argument(
+        "weights",
+        type=str,
+        help=(
+            "Full path to the trained model. E.g. "
+            "`/home/app/src/experiments/exp_001/model.06-2.0449.h5`."
+        ),
+    )
+    parser.add_argument(
+        "output_folder",
+        type=str,
+        help=(
+            "Full path to the directory in which we will store the exported "
+            "models. E.g. `/home/app/src/experiments/exp_001/export/`."
+        ),
+    )
+    parser.add_argument(
+        "--tflite",
+        type=str,
+        choices=export.TFLITE_QUANTIZATION,
+        default=None,
+        help="Also create a TFLite model using this quantization mode.",
+    )
+    parser.add_argument(
+        "--onnx",
+        action="store_true",
+        help="Also create an ONNX model, needs tf2onnx installed.",
+    )
+    parser.add_argument(
+        "--config_file",
+        type=str,
+        default=None,
+        help=(
+            "Full path to the experiment configuration file, its training "
+            "data is used for int8 calibration."
+        ),
+    )
+    parser.add_argument(
+        "--calibration_samples",
+        type=int,
+        default=100,
+        help="Number of training images used for int8 calibration.",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main(
+    weights,
+    output_folder,
+    tflite=None,
+    onnx=False,
+    config_file=None,
+    calibration_samples=100,
+):
+    """
+    Parameters
+    ----------
+    weights : str
+        Full path to the trained model.
+
+    output_folder : str
+        Full path to the directory in which we will store the exported
+        models.
+
+    tflite : str
+        TFLite quantization mode, None to skip TFLite export.
+
+    onnx : bool
+        Whether to create an ONNX model.
+
+    config_file : str
+        Full path to experiment configuration file, only needed for int8
+        quantization.
+
+    calibration_samples : int
+        Number of training images used for int8 calibration.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    cnn_model = resnet_50.create_model(weights=weights)
+    inference_model = resnet_50.create_inference_model(cnn_model)
+    print(inference_model.summary())
+
+    saved_model_dir = os.path.join(output_folder, "saved_model")
+    export.export_saved_model(inference_model, saved_model_dir)
+
+    # Exported models keep the class index of the trained model
+    config = utils.load_config(config_file) if config_file is not None else None
+    try:
+        utils.copy_class_index(weights, [output_folder, saved_model_dir], config)
+    except FileNotFoundError:
+        print("No class index found for {}, skipping it".format(weights))
+
+    if tflite is not None:
+        representative_data = None
+        if tflite == "int8":
+            if config is None:
+                raise ValueError("int8 quantization needs --config_file")
+            representative_data = export.representative_dataset(
+                config, calibration_samples
+            )
+
+        export.convert_to_tflite(
+            saved_model_dir,
+            os.path.join(output_folder, "model_{}.tflite".format(tflite)),
+            quantization=tflite,
+            representative_data=representative_data,
+        )
+
+    if onnx:
+        export.convert_to_onnx(
+            inference_model, os.path.join(output_folder, "model.onnx")
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(
+        args.weights,
+        args.output_folder,
+        tflite=args.tflite,
+        onnx=args.onnx,
+        config_file=args.config_file,
+        calibration_samples=args.calibration_samples,
+    )
@@ -0,0 +1,113 @@
+"""
+This script will be used to run a multi-worker training on a single host,
+e.g. to test a `distribute.strategy: multi_worker_mirrored` experiment
+before moving it to many machines. It starts one `scripts/train.py` process
+per worker with the corresponding TF_CONFIG and waits for all of them.
+
+E.g.:
+    $ python3 scripts/launch_workers.py experiments/exp_001/config.yml \
+        --num_workers 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Launch local training workers.")
+    parser.add_argument(
+        "config_file",
+        type=str,
+        help="Full path to experiment configuration file.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Number of worker processes to start.",
+    )
+    parser.add_argument(
+        "--base_port",
+        type=int,
+        default=23456,
+        help="Worker i listens on `base_port + i`.",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def get_tf_config(num_workers, task_id, base_port=23456):
+    """
+    Returns the TF_CONFIG value for a worker of a local cluster.
+    """
+    return json.dumps(
+        {
+            "cluster": {
+                "worker": [
+                    "localhost:{}".format(base_port + i) for i in range(num_workers)
+                ]
+            },
+            "task": {"type": "worker", "index": task_id},
+        }
+    )
+
+
+def main(config_file, num_workers=2, base_port=23456):
+    """
+    Parameters
+    ----------
+    config_file : str
+        Full path to experiment configuration file.
+
+    num_workers : int
+        Number of worker processes to start.
+
+    base_port : int
+        Worker i listens on `base_port + i`.
+
+    Returns
+    -------
+    returncode : int
+        Zero if all the workers finished successfully.
+    """
+    train_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+    workers = []
+    for task_id in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=get_tf_config(num_workers, task_id, base_port))
+        workers.append(
+            subprocess.Popen([sys.executable, train_script, config_file], env=env)
+        )
+
+    # If a worker fails the others would wait for it forever
+    returncode = 0
+    try:
+        while workers:
+            for worker in list(workers):
+                if worker.poll() is None:
+                    continue
+                workers.remove(worker)
+                if worker.returncode != 0:
+                    returncode = worker.returncode
+                    raise RuntimeError(
+                        "Worker failed with exit code {}".format(worker.returncode)
+                    )
+            time.sleep(1)
+    except (RuntimeError, KeyboardInterrupt) as e:
+        print(e)
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+        returncode = returncode or 1
+
+    return returncode
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(main(args.config_file, args.num_workers, args.base_port))
@@ -31,10 +31,27 @@ The resulting directory structure should look like this:
     │   │   │   ├── 000405.jpg
     │   │   │   ├── 000406.jpg
     │   │   │   ├── ...
+
+The CSV is read once to plan all the work: the needed folders are created
+up front and the images are then linked or copied on a thread pool. Use
+`--mode` to choose between hard links (default), symbolic links, copies or
+reflinks (copy-on-write clones, falling back to a copy when the filesystem
+doesn't support them), and `--dry_run` to only print what would be done.
 """
 import argparse
+import collections
 import csv
+import errno
+import fcntl
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Ways of placing each image in the output folders
+MODES = ("link", "symlink", "copy", "reflink")
+
+# ioctl request to clone a file on copy-on-write filesystems (Btrfs, XFS)
+FICLONE = 0x40049409
 
 
 def parse_args():
@@ -63,14 +80,82 @@ def parse_args():
             "train/test splits. E.g. `/home/app/src/data/car_ims_v1/`."
         ),
     )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=MODES,
+        default="link",
+        help="How images are placed in the output folders.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of files linked or copied at the same time.",
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only print a summary of what would be done.",
+    )
 
     args = parser.parse_args()
 
     return args
 
 
-def main(data_folder, labels, output_data_folder):
+def reflink(src, dst):
     """
+    Clones `src` into `dst` sharing the same data blocks. Falls back to a
+    regular copy if the filesystem doesn't support it.
+
+    Returns
+    -------
+    cloned : bool
+        False if the file had to be copied.
+    """
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        try:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (
+                errno.EOPNOTSUPP,
+                errno.EXDEV,
+                errno.EINVAL,
+                errno.ENOTTY,
+            ):
+                raise
+            shutil.copyfileobj(src_f, dst_f)
+            return False
+
+
+def place_file(src, dst, mode):
+    """
+    Links or copies a single image, see `MODES`.
+
+    Returns
+    -------
+    fallback : bool
+        True if a reflink had to be done as a regular copy.
+    """
+    if mode == "link":
+        os.link(src, dst)
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    elif mode == "copy":
+        shutil.copyfile(src, dst)
+    else:
+        return not reflink(src, dst)
+
+    return False
+
+
+def plan(data_folder, labels, output_data_folder):
+    """
+    Reads the CSV once and works out what has to be done, touching the
+    filesystem only once per folder. Repeated CSV rows are planned once.
+
     Parameters
     ----------
     data_folder : str
@@ -82,40 +167,148 @@ def main(data_folder, labels, output_data_folder):
     output_data_folder : str
         Full path to the directory in which we will store the resulting
         train/test splits.
-    """
 
-    if not os.path.isdir(output_data_folder):
-        os.mkdir(output_data_folder)
+    Returns
+    -------
+    work : dict
+        - `folders`: folders to create.
+        - `files`: list of (source, destination) paths to link or copy.
+        - `existing`: number of images already in place, they are skipped.
+        - `missing`: image names not found in `data_folder`.
+        - `subsets`: number of images per subset.
+    """
+    available = set(os.listdir(data_folder))
+    rows_by_folder = collections.defaultdict(list)
+    planned = set()
+    subsets = collections.Counter()
+    missing = []
 
     with open(labels, "r") as lab_f:
-        rowRount = 0
         csvreader = csv.reader(lab_f, delimiter=",")
+        # we avoid the first row
+        next(csvreader)
         for row in csvreader:
-            rowRount += 1
-            # we avoid the first row
-            if rowRount == 1:
+            image_name, label_folder, sub_folder = row[0], row[1], row[2]
+            if image_name not in available:
+                missing.append(image_name)
+                continue
+            folder = os.path.join(sub_folder, label_folder)
+            if (folder, image_name) in planned:
+                continue
+            planned.add((folder, image_name))
+            subsets[sub_folder] += 1
+            rows_by_folder[folder].append(image_name)
+
+    folders = []
+    files = []
+    existing = 0
+    for folder, image_names in sorted(rows_by_folder.items()):
+        folder_path = os.path.join(output_data_folder, folder)
+        in_place = set()
+        if os.path.isdir(folder_path):
+            in_place = set(os.listdir(folder_path))
+        else:
+            folders.append(folder_path)
+
+        for image_name in image_names:
+            if image_name in in_place:
+                existing += 1
                 continue
+            files.append(
+                (
+                    os.path.join(data_folder, image_name),
+                    os.path.join(folder_path, image_name),
+                )
+            )
 
-            sub_folder = row[2]
-            if not os.path.isdir(os.path.join(output_data_folder, sub_folder)):
-                os.mkdir(os.path.join(output_data_folder, sub_folder))
+    return {
+        "folders": folders,
+        "files": files,
+        "existing": existing,
+        "missing": missing,
+        "subsets": dict(subsets),
+    }
 
-            label_folder = row[1]
-            label_folder_path = os.path.join(
-                output_data_folder, sub_folder, label_folder
+
+def print_summary(work, mode, dry_run=False):
+    print(
+        "{}Preparing dataset with mode `{}`".format(
+            "[dry run] " if dry_run else "", mode
+        )
+    )
+    for subset, count in sorted(work["subsets"].items()):
+        print("    {}: {} images".format(subset, count))
+    print("    Folders to create: {}".format(len(work["folders"])))
+    print("    Images to {}: {}".format(mode, len(work["files"])))
+    print("    Images already in place: {}".format(work["existing"]))
+    if work["missing"]:
+        print(
+            "    Images missing from the data folder: {} (e.g. {})".format(
+                len(work["missing"]), ", ".join(work["missing"][:5])
             )
-            if not os.path.isdir(label_folder_path):
-                os.mkdir(label_folder_path)
+        )
+
+
+def main(
+    data_folder, labels, output_data_folder, mode="link", workers=16, dry_run=False
+):
+    """
+    Parameters
+    ----------
+    data_folder : str
+        Full path to raw images folder.
+
+    labels : str
+        Full path to CSV file with data annotations.
 
-            image_name = row[0]
-            image_link_path = os.path.join(
-                output_data_folder, sub_folder, label_folder, image_name
+    output_data_folder : str
+        Full path to the directory in which we will store the resulting
+        train/test splits.
+
+    mode : str
+        How images are placed in the output folders, see `MODES`.
+
+    workers : int
+        Number of files linked or copied at the same time.
+
+    dry_run : bool
+        If True, nothing is written.
+
+    Returns
+    -------
+    work : dict
+        The planned work, see `plan()`.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown mode: {}".format(mode))
+
+    work = plan(data_folder, labels, output_data_folder)
+    print_summary(work, mode, dry_run)
+    if dry_run:
+        return work
+
+    for folder in work["folders"]:
+        os.makedirs(folder, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fallbacks = sum(
+            executor.map(
+                lambda paths: place_file(paths[0], paths[1], mode), work["files"]
             )
-            image_path = os.path.join(data_folder, image_name)
-            if not os.path.exists(image_link_path):
-                os.link(image_path, image_link_path)
+        )
+    if fallbacks:
+        print("    Reflinks not supported, {} images were copied".format(fallbacks))
+
+    return work
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args.data_folder, args.labels, args.output_data_folder)
+    main(
+        args.data_folder,
+        args.labels,
+        args.output_data_folder,
+        mode=args.mode,
+        workers=args.workers,
+        dry_run=args.dry_run,
+    )
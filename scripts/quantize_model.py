@@ -0,0 +1,222 @@
+"""
+This script will be used to quantize a trained model to int8 and check
+what we gain and what we lose before deploying it.
+The model is calibrated with images from the experiment training data,
+then float32 and int8 TFLite conversions of it are evaluated on the test
+data using `utils.predict_from_folder()`. Both run through the same TFLite
+interpreter, so the report only shows the effect of quantization: top-1
+accuracy, per class accuracy, model file size and images/sec side by side.
+"""
+import argparse
+import collections
+import json
+import os
+import time
+
+from models import export, resnet_50
+from utils import utils
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Quantize your model.")
+    parser.add_argument(
+        "config_file",
+        type=str,
+        help=(
+            "Full path to experiment configuration file, its training data is "
+            "used for calibration."
+        ),
+    )
+    parser.add_argument(
+        "weights",
+        type=str,
+        help=(
+            "Full path to the trained model. E.g. "
+            "`/home/app/src/experiments/exp_001/model.06-2.0449.h5`."
+        ),
+    )
+    parser.add_argument(
+        "test_folder",
+        type=str,
+        help=(
+            "Full path to the test images folder. E.g. "
+            "`/home/app/src/data/car_ims_v1/test/`."
+        ),
+    )
+    parser.add_argument(
+        "output_folder",
+        type=str,
+        help=(
+            "Full path to the directory in which we will store the int8 model "
+            "and the report. E.g. `/home/app/src/experiments/exp_001/int8/`."
+        ),
+    )
+    parser.add_argument(
+        "--calibration_samples",
+        type=int,
+        default=100,
+        help="Number of training images used for calibration.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="Number of images sent to the models on each predict step.",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def get_size(path):
+    """
+    Returns the size in bytes of a file, or of all the files in a folder.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, filename in utils.walkdir(path)
+    )
+
+
+def evaluate(folder, model, input_size, class_names, batch_size):
+    """
+    Runs `utils.predict_from_folder()` and measures accuracy and speed.
+
+    Returns
+    -------
+    results : dict
+        Top-1 `accuracy`, `per_class_accuracy` dict and `images_per_sec`.
+    """
+    start = time.time()
+    predictions, labels = utils.predict_from_folder(
+        folder, model, input_size, class_names, batch_size=batch_size
+    )
+    elapsed = time.time() - start
+
+    hits = collections.Counter()
+    totals = collections.Counter(labels)
+    for prediction, label in zip(predictions, labels):
+        hits[label] += prediction == label
+
+    return {
+        "accuracy": sum(hits.values()) / len(labels),
+        "per_class_accuracy": {
+            class_name: hits[class_name] / totals[class_name]
+            for class_name in sorted(totals)
+        },
+        "images_per_sec": len(labels) / elapsed,
+    }
+
+
+def main(
+    config_file,
+    weights,
+    test_folder,
+    output_folder,
+    calibration_samples=100,
+    batch_size=32,
+):
+    """
+    Parameters
+    ----------
+    config_file : str
+        Full path to experiment configuration file.
+
+    weights : str
+        Full path to the trained model.
+
+    test_folder : str
+        Full path to the test images folder.
+
+    output_folder : str
+        Full path to the directory in which we will store the float32 and
+        int8 TFLite models and the report.
+
+    calibration_samples : int
+        Number of training images used for calibration.
+
+    batch_size : int
+        Number of images sent to the models on each predict step.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    config = utils.load_config(config_file)
+    class_names = utils.copy_class_index(weights, [output_folder], config)
+    input_size = tuple(config["data"]["image_size"])
+
+    # Float model, without training-only layers
+    cnn_model = resnet_50.create_model(weights=weights)
+    inference_model = resnet_50.create_inference_model(cnn_model)
+    saved_model_dir = os.path.join(output_folder, "saved_model")
+    export.export_saved_model(inference_model, saved_model_dir)
+
+    # Float baseline, and the int8 model calibrated and quantized
+    tflite_paths = {}
+    for name, quantization in [("float32", "none"), ("int8", "int8")]:
+        tflite_paths[name] = os.path.join(output_folder, "model_{}.tflite".format(name))
+        representative_data = None
+        if quantization == "int8":
+            representative_data = export.representative_dataset(
+                config, calibration_samples
+            )
+        export.convert_to_tflite(
+            saved_model_dir,
+            tflite_paths[name],
+            quantization=quantization,
+            representative_data=representative_data,
+        )
+
+    report = {}
+    for name, tflite_path in tflite_paths.items():
+        model = export.TFLiteModel(tflite_path, num_threads=os.cpu_count())
+        report[name] = evaluate(test_folder, model, input_size, class_names, batch_size)
+        report[name]["size_mb"] = get_size(tflite_path) / 2**20
+
+    report["accuracy_delta"] = (
+        report["int8"]["accuracy"] - report["float32"]["accuracy"]
+    )
+    report["per_class_accuracy_delta"] = {
+        class_name: report["int8"]["per_class_accuracy"][class_name] - accuracy
+        for class_name, accuracy in report["float32"]["per_class_accuracy"].items()
+    }
+    report["speedup"] = (
+        report["int8"]["images_per_sec"] / report["float32"]["images_per_sec"]
+    )
+
+    with open(os.path.join(output_folder, "quantization_report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+
+    print("{:<12}{:>12}{:>12}{:>12}".format("", "accuracy", "size (MB)", "img/s"))
+    for name in ("float32", "int8"):
+        print(
+            "{:<12}{:>12.4f}{:>12.1f}{:>12.1f}".format(
+                name,
+                report[name]["accuracy"],
+                report[name]["size_mb"],
+                report[name]["images_per_sec"],
+            )
+        )
+    print(
+        "Accuracy delta: {:+.4f}, speedup: {:.2f}x".format(
+            report["accuracy_delta"], report["speedup"]
+        )
+    )
+    worst = sorted(report["per_class_accuracy_delta"].items(), key=lambda x: x[1])
+    print("Classes with the largest accuracy drop:")
+    for class_name, delta in worst[:5]:
+        print("    {:+.4f} {}".format(delta, class_name))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(
+        args.config_file,
+        args.weights,
+        args.test_folder,
+        args.output_folder,
+        calibration_samples=args.calibration_samples,
+        batch_size=args.batch_size,
+    )
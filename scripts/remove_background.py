@@ -9,8 +9,23 @@ same directory structure with its subfolders but with new images.
 """
 
 import argparse
-import os, cv2
-from utils import utils as u, detection
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from tqdm import tqdm
+
+from utils import utils as u
+
+# File inside the output folder listing the images already processed, one
+# relative path per line
+MANIFEST_FILENAME = ".manifest"
+
+# Marks the end of the work on the pipeline queues
+STOP = None
 
 
 def parse_args():
@@ -32,13 +47,201 @@ def parse_args():
             "cropped pictures. E.g. `/home/app/src/data/car_ims_v2/`."
         ),
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of detector processes, each one loads its own model.",
+    )
+    parser.add_argument(
+        "--readers",
+        type=int,
+        default=2,
+        help="Number of threads reading and decoding images.",
+    )
+    parser.add_argument(
+        "--writers",
+        type=int,
+        default=2,
+        help="Number of threads encoding and saving cropped images.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=4,
+        help="Number of images sent to a detector process at once.",
+    )
+    parser.add_argument(
+        "--detection_cache",
+        type=str,
+        default=None,
+        help=(
+            "Full path to a detection cache file. Images already seen by the "
+            "detector are not processed again, even for a new output folder."
+        ),
+    )
+    parser.add_argument(
+        "--vehicle_classes",
+        type=str,
+        nargs="+",
+        default=None,
+        help=(
+            "Detector classes considered vehicles. E.g. `car truck bus`. "
+            "Defaults to cars and trucks."
+        ),
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=32,
+        help="Max number of images waiting between two pipeline stages.",
+    )
 
     args = parser.parse_args()
 
     return args
 
 
-def main(data_folder, output_data_folder):
+def load_manifest(output_data_folder):
+    """
+    Loads the set of images already processed in a previous run.
+
+    Parameters
+    ----------
+    output_data_folder : str
+        Full path to the folder having the cropped images.
+
+    Returns
+    -------
+    done : set
+        Relative paths (subset/class/filename) of the processed images.
+    """
+    manifest_path = os.path.join(output_data_folder, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return set()
+
+    with open(manifest_path, "r") as manifest_f:
+        return set(line.rstrip("\n") for line in manifest_f if line.strip())
+
+
+def init_detector(detection_cache=None, vehicle_classes=None):
+    """
+    Detector processes initializer, the model is loaded only once per
+    process. Detector settings are taken from the DETECTOR_* environment
+    variables, see `utils.detection.configure_detector()`.
+    """
+    global detection
+    from utils import detection
+
+    if vehicle_classes is not None:
+        detection.set_vehicle_classes(vehicle_classes)
+    detection.set_detection_cache(detection_cache)
+    detection.get_detector()
+
+
+def detect_batch(imgs):
+    """
+    Runs the vehicle detector inside a worker process.
+    """
+    return detection.get_vehicle_coordinates_batch(imgs, batch_size=len(imgs))
+
+
+def get_item(q, stop_event):
+    """
+    Gets the next item of a pipeline queue, or STOP if the pipeline is
+    stopping after an error.
+    """
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    return STOP
+
+
+def put_item(q, item, stop_event):
+    """
+    Puts an item in a pipeline queue, unless the pipeline is stopping after
+    an error.
+    """
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def run_stage(stage, args, stop_event, errors):
+    """
+    Runs a pipeline stage in its thread. If it fails, the error is kept
+    for the main thread and every other stage is stopped, so none of them
+    waits forever on a queue nobody reads.
+    """
+    try:
+        stage(*args)
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+
+
+def read_images(data_folder, paths_q, decoded_q, stop_event):
+    """
+    Reader stage, loads images from disk.
+    """
+    while not stop_event.is_set():
+        rel_path = paths_q.get()
+        if rel_path is STOP:
+            put_item(decoded_q, STOP, stop_event)
+            return
+
+        img_array = cv2.imread(os.path.join(data_folder, rel_path))
+        if img_array is None:
+            print("Couldn't read image {}, skipping it".format(rel_path))
+            continue
+
+        put_item(decoded_q, (rel_path, img_array), stop_event)
+
+
+def write_images(output_data_folder, write_q, manifest_f, lock, progress, stop_event):
+    """
+    Writer stage, crops and saves the images then records them as done.
+    """
+    while True:
+        item = get_item(write_q, stop_event)
+        if item is STOP:
+            return
+
+        rel_path, img_array, box_coordinates = item
+
+        # generate the new image from box coordinates
+        new_img_array = img_array[
+            box_coordinates[1] : box_coordinates[3],
+            box_coordinates[0] : box_coordinates[2],
+            :,
+        ]
+        if not cv2.imwrite(os.path.join(output_data_folder, rel_path), new_img_array):
+            print("Couldn't write image {}, skipping it".format(rel_path))
+            continue
+
+        with lock:
+            manifest_f.write(rel_path + "\n")
+            manifest_f.flush()
+            progress.update(1)
+
+
+def main(
+    data_folder,
+    output_data_folder,
+    workers=1,
+    readers=2,
+    writers=2,
+    batch_size=4,
+    queue_size=32,
+    detection_cache=None,
+    vehicle_classes=None,
+):
     """
     Parameters
     ----------
@@ -48,45 +251,172 @@ def main(data_folder, output_data_folder):
     output_data_folder : str
         Full path to the directory in which we will store the resulting
         cropped images.
+
+    workers : int
+        Number of detector processes.
+
+    readers : int
+        Number of threads reading images.
+
+    writers : int
+        Number of threads saving cropped images.
+
+    batch_size : int
+        Number of images sent to a detector process at once.
+
+    queue_size : int
+        Max number of images waiting between two pipeline stages.
+
+    detection_cache : str
+        Full path to the detection cache file, None to disable it.
+
+    vehicle_classes : list
+        Detector classes considered vehicles, None to use cars and trucks.
     """
     os.makedirs(output_data_folder, exist_ok=True)
 
+    # Skip the images already processed in previous runs
+    done = load_manifest(output_data_folder)
+    pending = []
     for dirpath, filename in u.walkdir(data_folder):
         # get subset name
         subset_name = os.path.basename(os.path.dirname(dirpath))
         # get class name
-        class_name = os.path.basename(os.path.dirname(os.path.join(dirpath, filename)))
+        class_name = os.path.basename(dirpath)
+        rel_path = os.path.join(subset_name, class_name, filename)
+        if rel_path not in done:
+            pending.append(rel_path)
 
-        # create the subset and class folder
-        os.makedirs(os.path.join(output_data_folder, subset_name), exist_ok=True)
-        os.makedirs(
-            os.path.join(output_data_folder, subset_name, class_name), exist_ok=True
-        )
+    # create the subset and class folders
+    for output_dir in set(os.path.dirname(rel_path) for rel_path in pending):
+        os.makedirs(os.path.join(output_data_folder, output_dir), exist_ok=True)
 
-        if os.path.exists(
-            os.path.join(output_data_folder, subset_name, class_name, filename)
-        ):
-            continue
+    print("{} images already processed, {} pending".format(len(done), len(pending)))
+    if not pending:
+        return
 
-        # create the image from array
-        img_array = cv2.imread(os.path.join(dirpath, filename))
+    paths_q = queue.Queue()
+    decoded_q = queue.Queue(maxsize=queue_size)
+    write_q = queue.Queue(maxsize=queue_size)
+    for rel_path in pending:
+        paths_q.put(rel_path)
 
-        # get the box coordinates
-        box_coordinates = detection.get_vehicle_coordinates(img_array)
+    lock = threading.Lock()
+    progress = tqdm(total=len(pending), unit="img")
+    start = time.time()
 
-        # generate the new image from box coordinates
-        new_img_array = img_array[
-            box_coordinates[1] : box_coordinates[3],
-            box_coordinates[0] : box_coordinates[2],
-            :,
-        ]
+    # Set when any stage fails, the others stop as soon as possible
+    stop_event = threading.Event()
+    errors = []
+
+    with open(
+        os.path.join(output_data_folder, MANIFEST_FILENAME), "a"
+    ) as manifest_f, ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_detector,
+        initargs=(detection_cache, vehicle_classes),
+    ) as executor:
+        threads = []
+        for _ in range(readers):
+            paths_q.put(STOP)
+            threads.append(
+                threading.Thread(
+                    target=run_stage,
+                    args=(
+                        read_images,
+                        (data_folder, paths_q, decoded_q, stop_event),
+                        stop_event,
+                        errors,
+                    ),
+                    daemon=True,
+                )
+            )
+        for _ in range(writers):
+            threads.append(
+                threading.Thread(
+                    target=run_stage,
+                    args=(
+                        write_images,
+                        (
+                            output_data_folder,
+                            write_q,
+                            manifest_f,
+                            lock,
+                            progress,
+                            stop_event,
+                        ),
+                        stop_event,
+                        errors,
+                    ),
+                    daemon=True,
+                )
+            )
+        for thread in threads:
+            thread.start()
+
+        # Detection stage, keep a bounded number of batches in flight and
+        # hand results to the writers in order
+        in_flight = []
+        batch = []
+        readers_left = readers
+        try:
+            while (readers_left or batch or in_flight) and not stop_event.is_set():
+                if readers_left and len(batch) < batch_size:
+                    item = get_item(decoded_q, stop_event)
+                    if item is STOP:
+                        readers_left -= 1
+                    else:
+                        batch.append(item)
+                    if readers_left and len(batch) < batch_size:
+                        continue
 
-        cv2.imwrite(
-            os.path.join(output_data_folder, subset_name, class_name, filename),
-            new_img_array,
+                if batch:
+                    imgs = [img_array for _, img_array in batch]
+                    in_flight.append((batch, executor.submit(detect_batch, imgs)))
+                    batch = []
+                    if readers_left and len(in_flight) < workers * 2:
+                        continue
+
+                if not in_flight:
+                    continue
+                done_batch, future = in_flight.pop(0)
+                for (rel_path, img_array), box in zip(done_batch, future.result()):
+                    put_item(write_q, (rel_path, img_array, box), stop_event)
+
+            for _ in range(writers):
+                put_item(write_q, STOP, stop_event)
+        except BaseException:
+            stop_event.set()
+            raise
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+            for thread in threads:
+                thread.join()
+
+    if errors:
+        progress.close()
+        raise errors[0]
+
+    progress.close()
+    elapsed = time.time() - start
+    print(
+        "Processed {} images in {:.1f}s ({:.2f} img/s)".format(
+            len(pending), elapsed, len(pending) / elapsed
         )
+    )
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args.data_folder, args.output_data_folder)
+    main(
+        args.data_folder,
+        args.output_data_folder,
+        workers=args.workers,
+        readers=args.readers,
+        writers=args.writers,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        detection_cache=args.detection_cache,
+        vehicle_classes=args.vehicle_classes,
+    )
@@ -0,0 +1,345 @@
+"""
+This script will be used to serve our trained model over HTTP on a single
+machine. Incoming images are queued and sent to the model in dynamic
+micro-batches, which gives much better throughput under concurrent traffic
+than predicting one image per request.
+
+Routes:
+    - `POST /predict`: request body is the raw image file (JPEG, PNG, ...).
+      Returns the top-k class names and scores as JSON. Use the `top_k`
+      query parameter to change how many classes are returned.
+    - `POST /predict_crop`: same as `/predict` but the vehicle is cropped
+      with `utils.detection` before classification.
+    - `GET /health`: returns 200 when the server is up.
+
+E.g.:
+    $ curl --data-binary @car.jpg "http://localhost:8000/predict?top_k=3"
+"""
+import argparse
+import asyncio
+import io
+import json
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from models import resnet_50
+from utils import utils
+from utils.batching import MicroBatcher
+
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve your model.")
+    parser.add_argument(
+        "config_file",
+        type=str,
+        help="Full path to experiment configuration file.",
+    )
+    parser.add_argument(
+        "weights",
+        type=str,
+        help=(
+            "Full path to the trained model. E.g. "
+            "`/home/app/src/experiments/exp_001/model.06-2.0449.h5`."
+        ),
+    )
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=32,
+        help="Max number of images sent to the model at once.",
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=5.0,
+        help="Max time an image waits for others to fill a batch.",
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=5,
+        help="Default number of classes returned for each image.",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def decode_image(data, input_size, box_coordinates=None):
+    """
+    Decodes an image file and resizes it the same way
+    `utils.load_image_array()` does.
+
+    Parameters
+    ----------
+    data : bytes
+        Image file content.
+
+    input_size : tuple
+        Model input size as (height, width).
+
+    box_coordinates : tuple
+        If given, the image is cropped to (x1, y1, x2, y2) before resizing.
+
+    Returns
+    -------
+    img_array : numpy.ndarray
+        float32 RGB image.
+    """
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    if box_coordinates is not None:
+        img = img.crop(tuple(box_coordinates))
+    img = img.resize((input_size[1], input_size[0]), Image.NEAREST)
+
+    return np.asarray(img, dtype=np.float32)
+
+
+def decode_bgr_image(data):
+    """
+    Decodes an image file to the BGR array expected by the detector.
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Invalid image")
+
+    return img
+
+
+class InferenceServer:
+    """
+    HTTP server answering classification requests with dynamic
+    micro-batching.
+    """
+
+    def __init__(
+        self,
+        model,
+        class_names,
+        input_size,
+        max_batch_size=32,
+        max_wait_ms=5.0,
+        top_k=5,
+    ):
+        """
+        Parameters
+        ----------
+        model : keras.Model
+            Loaded keras model.
+
+        class_names : list
+            List of classes as string, same order used for training.
+
+        input_size : tuple
+            Model input size as (height, width).
+
+        max_batch_size : int
+            Max number of images sent to the model at once.
+
+        max_wait_ms : float
+            Max time an image waits for others to fill a batch.
+
+        top_k : int
+            Default number of classes returned for each image.
+        """
+        if model.output_shape[-1] != len(class_names):
+            raise ValueError(
+                "The model has {} outputs but {} class names".format(
+                    model.output_shape[-1], len(class_names)
+                )
+            )
+        self.class_names = class_names
+        self.input_size = input_size
+        self.top_k = top_k
+        self.predict_step = utils.make_predict_step(model)
+        self.classifier = MicroBatcher(self.classify_batch, max_batch_size, max_wait_ms)
+        self.detector = MicroBatcher(self.detect_batch, max_batch_size, max_wait_ms)
+
+    def classify_batch(self, imgs):
+        return list(self.predict_step(np.stack(imgs)).numpy())
+
+    def detect_batch(self, imgs):
+        from utils import detection
+
+        return detection.get_vehicle_coordinates_batch(imgs, batch_size=len(imgs))
+
+    async def predict(self, data, crop=False, top_k=None):
+        """
+        Classifies an image file.
+
+        Returns
+        -------
+        predictions : list
+            Top-k dicts with `class_name` and `score`, best first.
+        """
+        loop = asyncio.get_running_loop()
+        box_coordinates = None
+        if crop:
+            bgr_img = await loop.run_in_executor(None, decode_bgr_image, data)
+            box_coordinates = await self.detector.submit(bgr_img)
+
+        img = await loop.run_in_executor(
+            None, decode_image, data, self.input_size, box_coordinates
+        )
+        scores = await self.classifier.submit(img)
+
+        top_idxs = np.argsort(scores)[::-1][: top_k or self.top_k]
+        predictions = [
+            {"class_name": self.class_names[i], "score": float(scores[i])}
+            for i in top_idxs
+        ]
+        if box_coordinates is not None:
+            return {
+                "box": [int(c) for c in box_coordinates],
+                "predictions": predictions,
+            }
+
+        return {"predictions": predictions}
+
+    async def route(self, method, target, body):
+        """
+        Dispatches a request, returns the HTTP status and the JSON payload.
+        """
+        url = urlparse(target)
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path not in ("/predict", "/predict_crop"):
+            return 404, {"error": "Not found"}
+        if method != "POST":
+            return 405, {"error": "Use POST with the image as request body"}
+
+        query = parse_qs(url.query)
+        try:
+            top_k = int(query["top_k"][0]) if "top_k" in query else None
+            return 200, await self.predict(
+                body, crop=url.path == "/predict_crop", top_k=top_k
+            )
+        except (ValueError, OSError) as e:
+            return 400, {"error": str(e)}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Minimal HTTP/1.1 handling, with keep-alive support.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                try:
+                    status, payload = await self.route(method, target, body)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+                response = json.dumps(payload).encode()
+                writer.write(
+                    (
+                        "HTTP/1.1 {} {}\r\n"
+                        "Content-Type: application/json\r\n"
+                        "Content-Length: {}\r\n\r\n"
+                    )
+                    .format(status, HTTP_STATUS[status], len(response))
+                    .encode()
+                    + response
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.classifier.start()
+        self.detector.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print("Serving on http://{}:{}".format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.classifier.stop()
+            await self.detector.stop()
+
+
+def main(
+    config_file,
+    weights,
+    host="0.0.0.0",
+    port=8000,
+    max_batch_size=32,
+    max_wait_ms=5.0,
+    top_k=5,
+):
+    """
+    Parameters
+    ----------
+    config_file : str
+        Full path to experiment configuration file.
+
+    weights : str
+        Full path to the trained model.
+
+    host, port : str, int
+        Address the server listens on.
+
+    max_batch_size : int
+        Max number of images sent to the model at once.
+
+    max_wait_ms : float
+        Max time an image waits for others to fill a batch.
+
+    top_k : int
+        Default number of classes returned for each image.
+    """
+    config = utils.load_config(config_file)
+    class_names = utils.get_model_class_names(weights, config)
+    model = resnet_50.create_model(weights=weights)
+    server = InferenceServer(
+        model,
+        class_names,
+        tuple(config["data"]["image_size"]),
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        top_k=top_k,
+    )
+    asyncio.run(server.serve(host, port))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(
+        args.config_file,
+        args.weights,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        top_k=args.top_k,
+    )
@@ -0,0 +1,312 @@
+"""
+This script will be used to search for good hyperparameters. It takes the
+experiment config shared by all the trials and a sweep config with the
+search space, and trains many trials in parallel, each one in its own
+`scripts/train.py` process with a limited number of CPU threads.
+
+Bad trials are stopped early with asynchronous successive halving: trials
+train for a few epochs first and only the best ones continue, resuming
+from their checkpoint. See `utils.sweep.AsyncSuccessiveHalving`.
+
+E.g. a sweep config:
+    metric: "val_accuracy"
+    mode: "max"
+    num_trials: 20
+    min_epochs: 1
+    reduction_factor: 3
+    space:
+        compile.optimizer.adam.learning_rate: {loguniform: [0.00001, 0.01]}
+        model.dropout_rate: {uniform: [0.0, 0.5]}
+        model.regulizer: {choice: [0.0, 0.001, 0.01]}
+
+    $ python3 scripts/sweep.py experiments/exp_001/config.yml \
+        experiments/exp_001/sweep.yml experiments/exp_001/sweep \
+        --parallel_trials 4
+
+Each trial gets a folder in the output directory with its config, logs,
+checkpoints and `history.csv`. The trials ranked by their metric are
+written to `leaderboard.csv`. The output directory must be new or empty,
+trials of a previous sweep would be resumed otherwise.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+import yaml
+
+from utils import sweep, utils
+
+# Script started for each trial, it gets the trial config and `--resume`
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep.")
+    parser.add_argument(
+        "config_file",
+        type=str,
+        help="Full path to the experiment configuration file shared by trials.",
+    )
+    parser.add_argument(
+        "sweep_file",
+        type=str,
+        help="Full path to the sweep configuration file.",
+    )
+    parser.add_argument(
+        "output_dir",
+        type=str,
+        help="Full path to the directory in which we will store the trials.",
+    )
+    parser.add_argument(
+        "--parallel_trials",
+        type=int,
+        default=2,
+        help="Number of trials trained at the same time.",
+    )
+    parser.add_argument(
+        "--threads_per_trial",
+        type=int,
+        default=None,
+        help="CPU threads of each trial, all cores split between trials by default.",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def get_available_cpus():
+    """
+    Returns the number of CPU cores this process can run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def get_trial_cpus(slot, threads_per_trial):
+    """
+    Returns the CPU cores a trial running in `slot` is pinned to, or None if
+    there are not enough cores to give each slot its own.
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    start = slot * threads_per_trial
+    if start + threads_per_trial > len(cpus):
+        return None
+
+    return cpus[start : start + threads_per_trial]
+
+
+def start_trial(trial, config, threads_per_trial, cpus=None):
+    """
+    Writes the trial config and starts training it in a new process. The
+    trial continues from its checkpoint if it has one.
+
+    Returns
+    -------
+    process : subprocess.Popen
+        Training process, its output goes to `train.log` in the trial folder.
+    """
+    config_file = os.path.join(trial["dir"], "config.yml")
+    with open(config_file, "w") as f:
+        yaml.safe_dump(config, f)
+
+    # Keep trials from oversubscribing the CPU
+    threads = str(threads_per_trial)
+    env = dict(
+        os.environ,
+        TF_NUM_INTRAOP_THREADS=threads,
+        TF_NUM_INTEROP_THREADS=str(min(2, threads_per_trial)),
+        OMP_NUM_THREADS=threads,
+    )
+
+    def pin_cpus():
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+
+    with open(os.path.join(trial["dir"], "train.log"), "a") as log_f:
+        return subprocess.Popen(
+            [sys.executable, TRAIN_SCRIPT, config_file, "--resume"],
+            env=env,
+            stdout=log_f,
+            stderr=subprocess.STDOUT,
+            preexec_fn=pin_cpus,
+        )
+
+
+def main(
+    config_file, sweep_file, output_dir, parallel_trials=2, threads_per_trial=None
+):
+    """
+    Parameters
+    ----------
+    config_file : str
+        Full path to the experiment configuration file shared by trials.
+        `fit.epochs` is the maximum number of epochs of a trial.
+
+    sweep_file : str
+        Full path to the sweep configuration file, see
+        `utils.sweep.parse_sweep_config()`.
+
+    output_dir : str
+        Full path to the directory in which we will store the trials. It
+        must be new or empty.
+
+    parallel_trials : int
+        Number of trials trained at the same time.
+
+    threads_per_trial : int
+        CPU threads of each trial. If there are enough cores, each trial
+        is also pinned to its own ones.
+
+    Returns
+    -------
+    leaderboard : list
+        Trials ranked by their metric, see `utils.sweep.write_leaderboard()`.
+    """
+    base_config = utils.load_config(config_file)
+    with open(sweep_file) as f:
+        sweep_config = sweep.parse_sweep_config(yaml.safe_load(f))
+    if os.path.isdir(output_dir) and os.listdir(output_dir):
+        raise ValueError("The output directory {} is not empty".format(output_dir))
+    if threads_per_trial is None:
+        threads_per_trial = max(1, get_available_cpus() // parallel_trials)
+
+    rungs = sweep.get_rungs(
+        sweep_config["min_epochs"],
+        base_config["fit"]["epochs"],
+        sweep_config["reduction_factor"],
+    )
+    scheduler = sweep.AsyncSuccessiveHalving(
+        rungs, sweep_config["reduction_factor"], sweep_config["mode"]
+    )
+
+    rng = random.Random(sweep_config["seed"])
+    trials = []
+    for i in range(sweep_config["num_trials"]):
+        trial_dir = os.path.join(output_dir, "trial_{:03d}".format(i))
+        os.makedirs(trial_dir)
+        trials.append(
+            {
+                "trial": i,
+                "dir": trial_dir,
+                "params": sweep.sample_params(sweep_config["space"], rng),
+                "status": "pending",
+                "epochs": 0,
+                "metric": None,
+            }
+        )
+    leaderboard_path = os.path.join(output_dir, "leaderboard.csv")
+
+    def next_job():
+        promotion = scheduler.get_promotion()
+        if promotion is not None:
+            return trials[promotion[0]], promotion[1]
+        for trial in trials:
+            if trial["status"] == "pending":
+                return trial, 0
+        return None
+
+    # Maps each busy slot to its trial, rung and process
+    running = {}
+    try:
+        while True:
+            for slot in range(parallel_trials):
+                if slot in running:
+                    continue
+                job = next_job()
+                if job is None:
+                    break
+                trial, rung = job
+                config = sweep.create_trial_config(
+                    base_config, trial["params"], trial["dir"], rungs[rung]
+                )
+                trial["status"] = "running"
+                print(
+                    "Trial {}: training to epoch {}".format(trial["trial"], rungs[rung])
+                )
+                running[slot] = (
+                    trial,
+                    rung,
+                    start_trial(
+                        trial,
+                        config,
+                        threads_per_trial,
+                        get_trial_cpus(slot, threads_per_trial),
+                    ),
+                )
+
+            if not running:
+                break
+
+            time.sleep(1)
+            for slot, (trial, rung, process) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                del running[slot]
+                try:
+                    if process.returncode != 0:
+                        raise RuntimeError(
+                            "exit code {}, see {}".format(
+                                process.returncode,
+                                os.path.join(trial["dir"], "train.log"),
+                            )
+                        )
+                    trial["metric"] = sweep.read_metric(
+                        os.path.join(trial["dir"], "history.csv"),
+                        sweep_config["metric"],
+                    )
+                except (RuntimeError, ValueError, OSError) as e:
+                    print("Trial {} failed: {}".format(trial["trial"], e))
+                    trial["status"] = "failed"
+                    trial["metric"] = None
+                    continue
+
+                trial["epochs"] = rungs[rung]
+                last_rung = rung == len(rungs) - 1
+                trial["status"] = "completed" if last_rung else "stopped"
+                scheduler.report(trial["trial"], rung, trial["metric"])
+                print(
+                    "Trial {}: {} = {:.4f} after {} epochs".format(
+                        trial["trial"],
+                        sweep_config["metric"],
+                        trial["metric"],
+                        trial["epochs"],
+                    )
+                )
+                sweep.write_leaderboard(leaderboard_path, trials, sweep_config["mode"])
+    finally:
+        for _, _, process in running.values():
+            process.terminate()
+        for _, _, process in running.values():
+            process.wait()
+
+    leaderboard = sweep.write_leaderboard(
+        leaderboard_path, trials, sweep_config["mode"]
+    )
+    print("Best trials:")
+    for row in leaderboard[:5]:
+        print(
+            "  {rank}. trial {trial} ({status}, {epochs} epochs): {metric}".format(
+                **row
+            )
+        )
+
+    return leaderboard
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(
+        args.config_file,
+        args.sweep_file,
+        args.output_dir,
+        parallel_trials=args.parallel_trials,
+        threads_per_trial=args.threads_per_trial,
+    )
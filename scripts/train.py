@@ -5,12 +5,16 @@ the experiment settings like dataset, model output folder, epochs,
 learning rate, data augmentation, etc.
 """
 import argparse
+import os
+import signal
+import sys
 
 import tensorflow as tf
 from tensorflow import keras
 
 from models import resnet_50
-from utils import utils
+from utils import class_index, data_pipeline, distribute, embeddings, schedule, utils
+from utils.callbacks import TrainingCheckpoint, TrainingProfiler
 
 # Prevent tensorflow to allocate the entire GPU
 # https://www.tensorflow.org/api_docs/python/tf/config/experimental/set_memory_growth
@@ -31,6 +35,19 @@ OPTIMIZERS = {
 CALLBACKS = {
     "model_checkpoint": keras.callbacks.ModelCheckpoint,
     "tensor_board": keras.callbacks.TensorBoard,
+    "profiler": TrainingProfiler,
+    "training_checkpoint": TrainingCheckpoint,
+    "csv_logger": keras.callbacks.CSVLogger,
+    "backup_and_restore": keras.callbacks.BackupAndRestore,
+}
+
+# Callback attribute with the path each one writes to, and whether it's a
+# folder or a file, see `set_worker_dirs()`
+WORKER_PATHS = {
+    keras.callbacks.ModelCheckpoint: ("filepath", False),
+    keras.callbacks.TensorBoard: ("log_dir", True),
+    keras.callbacks.CSVLogger: ("filename", False),
+    TrainingProfiler: ("log_dir", True),
 }
 
 
@@ -44,6 +61,14 @@ def parse_args():
         type=str,
         help="Full path to experiment configuration file.",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Continue from the latest checkpoint of the `training_checkpoint` "
+            "callback, if any."
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -86,7 +111,208 @@ def parse_callbacks(config):
     return callbacks
 
 
-def main(config_file):
+def get_model_dir(config):
+    """
+    Returns the folder in which the model checkpoints are saved, creating
+    it if needed, or None if the experiment doesn't save them.
+    """
+    callbacks = config["fit"].get("callbacks") or {}
+    if "model_checkpoint" not in callbacks:
+        return None
+
+    model_dir = os.path.dirname(callbacks["model_checkpoint"]["filepath"]) or "."
+    os.makedirs(model_dir, exist_ok=True)
+
+    return model_dir
+
+
+def get_model_config(config):
+    """
+    Returns the arguments for `resnet_50.create_model()`. When data
+    augmentation runs in the input pipeline, it's left out of the model.
+    When the image size changes between schedule stages, the model input
+    accepts any height and width.
+    """
+    model_config = dict(config["model"])
+    pipeline_config = data_pipeline.parse_pipeline_config(
+        config["data"].get("pipeline")
+    )
+    if pipeline_config["augment"]:
+        model_config.pop("data_aug_layer", None)
+
+    stages = schedule.parse_schedule(config["fit"])
+    image_size = config["data"].get("image_size", (256, 256))
+    if schedule.has_variable_image_size(stages, image_size):
+        input_shape = model_config.get("input_shape", (224, 224, 3))
+        model_config["input_shape"] = (None, None, input_shape[-1])
+
+    return model_config
+
+
+def build_optimizer(optimizer, model, stages, freeze_batch_norm=True):
+    """
+    Creates the optimizer state for every weight some schedule stage
+    trains. Keras optimizers can't take new weights once they are built, so
+    this is needed before the first stage when later ones unfreeze layers,
+    see `resnet_50.set_trainable_from()`. The layers are left trainable or
+    frozen as they were.
+    """
+    base_model = model.get_layer("resnet50")
+    trainable = [layer.trainable for layer in base_model.layers]
+
+    variables = {v.ref(): v for v in model.trainable_variables}
+    for stage in stages:
+        if "trainable_from" in stage:
+            resnet_50.set_trainable_from(
+                model, stage["trainable_from"], freeze_batch_norm
+            )
+            variables.update((v.ref(), v) for v in model.trainable_variables)
+
+    for layer, layer_trainable in zip(base_model.layers, trainable):
+        layer.trainable = layer_trainable
+    optimizer.build(list(variables.values()))
+
+
+def load_datasets(config, class_names, strategy, distribute_config, epoch=None):
+    """
+    Builds the training and validation datasets. In a distributed run each
+    worker reads its own shard of the files. `epoch` keeps the training
+    order of each epoch the same across restarts, see
+    `data_pipeline.build_dataset()`.
+
+    Returns
+    -------
+    train_ds, val_ds, batch_size, steps : tuple
+        Datasets, the global batch size and, for distributed runs, the
+        `steps_per_epoch` and `validation_steps` to pass to `fit()`.
+    """
+    batch_size = config["data"].get("batch_size", 32)
+    if distribute_config["strategy"] == "default":
+        train_ds = data_pipeline.build_dataset(
+            config, "training", class_names, epoch=epoch
+        )
+        val_ds = data_pipeline.build_dataset(config, "validation", class_names)
+        return train_ds, val_ds, batch_size, {}
+
+    batch_size = distribute.get_global_batch_size(
+        batch_size, strategy, distribute_config["scale_batch_size"]
+    )
+    train_ds, train_steps = distribute.distribute_dataset(
+        strategy, config, "training", class_names, batch_size
+    )
+    val_ds, val_steps = distribute.distribute_dataset(
+        strategy, config, "validation", class_names, batch_size
+    )
+    steps = {"steps_per_epoch": train_steps, "validation_steps": val_steps}
+
+    return train_ds, val_ds, batch_size, steps
+
+
+def set_worker_dirs(callbacks):
+    """
+    Workers other than the chief write their checkpoints, logs and profile
+    to a subfolder, see `WORKER_PATHS`, so they never overwrite the files of
+    the chief.
+    """
+    if distribute.is_chief():
+        return
+
+    for callback in callbacks:
+        for callback_class, (attr, is_dir) in WORKER_PATHS.items():
+            if not isinstance(callback, callback_class):
+                continue
+            path = getattr(callback, attr)
+            if is_dir:
+                path = distribute.get_worker_dir(path)
+            else:
+                folder = distribute.get_worker_dir(os.path.dirname(path) or ".")
+                os.makedirs(folder, exist_ok=True)
+                path = os.path.join(folder, os.path.basename(path))
+            setattr(callback, attr, path)
+
+
+def set_profiler_input(callbacks, train_ds, batch_size):
+    """
+    Gives the training dataset to the profiler callback, if any, so it can
+    measure the input pipeline alone.
+    """
+    for callback in callbacks:
+        if isinstance(callback, TrainingProfiler):
+            callback.set_input_dataset(train_ds, batch_size)
+
+
+def get_training_checkpoint(callbacks):
+    """
+    Returns the `training_checkpoint` callback, or None if not used.
+    """
+    for callback in callbacks:
+        if isinstance(callback, TrainingCheckpoint):
+            return callback
+
+    return None
+
+
+def train_head(config, class_names):
+    """
+    Trains only the classification head from embeddings stored in
+    `features.directory`. The store is created on first use by running the
+    Resnet50 base once over the data, see `utils.embeddings`.
+
+    Checkpoints saved while training only have the head. If
+    `features.output_model` is set, a full model with the trained head is
+    saved there at the end, ready for `predict_from_folder()`.
+
+    Parameters
+    ----------
+    config : dict
+        Experiment settings.
+
+    class_names : list
+        List of classes as string.
+    """
+    meta = embeddings.get_store_meta(config, class_names)
+    if not embeddings.store_exists(config["features"]["directory"], meta):
+        feature_extractor = resnet_50.create_feature_extractor(
+            tuple(config["model"].get("input_shape", (224, 224, 3)))
+        )
+        embeddings.extract_features(config, class_names, feature_extractor)
+
+    train_ds = embeddings.load_features_dataset(
+        config, "training", class_names, shuffle=True
+    )
+    val_ds = embeddings.load_features_dataset(config, "validation", class_names)
+
+    head = resnet_50.create_head(
+        classes=config["model"]["classes"],
+        dropout_rate=config["model"].get("dropout_rate", 0.0),
+        regulizer=config["model"].get("regulizer", 0.001),
+    )
+    print(head.summary())
+
+    # Compile model, prepare for training
+    optimizer = parse_optimizer(config)
+    head.compile(
+        optimizer=optimizer,
+        **config["compile"],
+    )
+
+    model_dir = get_model_dir(config)
+    if model_dir is not None:
+        class_index.save_class_index(model_dir, class_names)
+
+    # Start training!
+    callbacks = parse_callbacks(config)
+    set_profiler_input(callbacks, train_ds, config["data"].get("batch_size", 32))
+    head.fit(train_ds, validation_data=val_ds, callbacks=callbacks, **config["fit"])
+
+    if "output_model" in config["features"]:
+        cnn_model = resnet_50.create_model(**config["model"])
+        resnet_50.load_head_weights(cnn_model, head)
+        cnn_model.save(config["features"]["output_model"])
+        class_index.save_class_index(config["features"]["output_model"], class_names)
+
+
+def main(config_file, resume=False):
     """
     Code for the training logic.
 
@@ -94,6 +320,11 @@ def main(config_file):
     ----------
     config_file : str
         Full path to experiment configuration file.
+
+    resume : bool
+        Continue from the latest checkpoint of the `training_checkpoint`
+        callback. The epochs and steps it already covers are not trained
+        again.
     """
     # Load configuration file, use utils.load_config()
     config = utils.load_config(config_file)
@@ -109,40 +340,119 @@ def main(config_file):
             "The number classes between your dataset and your model" "doen't match."
         )
 
-    # Load training dataset
-    # We will split train data in train/validation while training our
-    # model, keeping away from our experiments the testing dataset
-    train_ds = keras.preprocessing.image_dataset_from_directory(
-        subset="training",
-        class_names=class_names,
-        seed=config["seed"],
-        **config["data"],
-    )
-    val_ds = keras.preprocessing.image_dataset_from_directory(
-        subset="validation",
-        class_names=class_names,
-        seed=config["seed"],
-        **config["data"],
-    )
+    # See `distribute` in the config to train on many devices or workers
+    distribute_config = distribute.parse_distribute_config(config.get("distribute"))
+    strategy = distribute.create_strategy(distribute_config)
 
-    # Creates a Resnet50 model for finetuning
-    cnn_model = resnet_50.create_model(**config["model"])
-    print(cnn_model.summary())
+    if "features" in config:
+        if distribute_config["strategy"] != "default":
+            raise ValueError(
+                "The `distribute` section is not supported when training from "
+                "stored features."
+            )
+        if "schedule" in config["fit"]:
+            raise ValueError(
+                "The `fit.schedule` setting is not supported when training from "
+                "stored features."
+            )
+        # Only the classification head is trained, from precomputed
+        # Resnet50 embeddings
+        train_head(config, class_names)
+        return
 
-    # Compile model, prepare for training
-    optimizer = parse_optimizer(config)
-    cnn_model.compile(
-        optimizer=optimizer,
-        **config["compile"],
-    )
+    # Layers can be frozen and unfrozen between stages, see `fit.schedule`
+    stages = schedule.parse_schedule(config["fit"])
+    freeze_batch_norm = config["model"].get("freeze_batch_norm", True)
+
+    # Model variables are created and mirrored by the strategy
+    with strategy.scope():
+        # Creates a Resnet50 model for finetuning
+        cnn_model = resnet_50.create_model(**get_model_config(config))
+        print(cnn_model.summary())
+
+        # Compile model, prepare for training
+        optimizer = parse_optimizer(config)
+        if any("trainable_from" in stage for stage in stages):
+            build_optimizer(optimizer, cnn_model, stages, freeze_batch_norm)
+        cnn_model.compile(
+            optimizer=optimizer,
+            **config["compile"],
+        )
+
+    # Keep the class order next to the saved models, so evaluation and
+    # serving never depend on listing the data folder
+    model_dir = get_model_dir(config)
+    if model_dir is not None and distribute.is_chief():
+        class_index.save_class_index(model_dir, class_names)
 
     # Start training!
+    # See `fit.schedule` in the config to change the image size, batch
+    # size, data augmentation or frozen layers between stages, model
+    # weights are kept
     callbacks = parse_callbacks(config)
-    cnn_model.fit(
-        train_ds, validation_data=val_ds, callbacks=callbacks, **config["fit"]
-    )
+    set_worker_dirs(callbacks)
+
+    # See `--resume`, the model and optimizer state come from the latest
+    # checkpoint
+    checkpoint = get_training_checkpoint(callbacks)
+    if checkpoint is not None and distribute_config["strategy"] != "default":
+        # SIGTERM only stops the worker receiving it, the others would wait
+        # for it forever
+        raise ValueError(
+            "The `training_checkpoint` callback doesn't support the `distribute` "
+            "section, use `backup_and_restore` instead."
+        )
+    initial_epoch, initial_step = 0, 0
+    if resume:
+        if checkpoint is None:
+            raise ValueError(
+                "Resuming needs the `training_checkpoint` callback in "
+                "`fit.callbacks`."
+            )
+        initial_epoch, initial_step = checkpoint.restore(cnn_model)
+
+    for stage in stages:
+        if "trainable_from" in stage:
+            with strategy.scope():
+                resnet_50.set_trainable_from(
+                    cnn_model, stage["trainable_from"], freeze_batch_norm
+                )
+                cnn_model.compile(optimizer=optimizer, **config["compile"])
+
+        # Stages finished before resuming are skipped
+        if stage["epochs"] <= initial_epoch:
+            continue
+        stage = dict(stage, initial_epoch=max(stage["initial_epoch"], initial_epoch))
+
+        # Load training dataset
+        # We will split train data in train/validation while training our
+        # model, keeping away from our experiments the testing dataset
+        # See `data.pipeline` in the config to setup caching, prefetching
+        # and parallel decoding
+        stage_config = schedule.get_stage_config(config, stage)
+        train_ds, val_ds, batch_size, steps = load_datasets(
+            stage_config,
+            class_names,
+            strategy,
+            distribute_config,
+            checkpoint.data_epoch if checkpoint is not None else None,
+        )
+        set_profiler_input(callbacks, train_ds, batch_size)
+        schedule.fit_stage(
+            cnn_model,
+            train_ds,
+            val_ds,
+            callbacks,
+            dict(steps, **schedule.get_fit_args(config["fit"], stage)),
+            initial_step if stage["initial_epoch"] == initial_epoch else 0,
+        )
+
+        if checkpoint is not None and checkpoint.interrupted:
+            print("Training interrupted, continue it with --resume")
+            # Same exit status as being killed by SIGTERM
+            sys.exit(128 + signal.SIGTERM)
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args.config_file)
+    main(args.config_file, resume=args.resume)
@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from utils.batching import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def test_batches(self):
+        batch_sizes = []
+
+        def predict_batch(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        async def run():
+            batcher = MicroBatcher(predict_batch, max_batch_size=4, max_wait_ms=50)
+            batcher.start()
+            results = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+            await batcher.stop()
+            return results
+
+        results = asyncio.run(run())
+
+        # Each request gets its own result
+        self.assertListEqual(results, [i * 2 for i in range(10)])
+        # Concurrent requests are grouped, never above the max batch size
+        self.assertListEqual(batch_sizes, [4, 4, 2])
+
+    def test_errors(self):
+        def predict_batch(items):
+            raise ValueError("Invalid batch")
+
+        async def run():
+            batcher = MicroBatcher(predict_batch, max_batch_size=4, max_wait_ms=1)
+            batcher.start()
+            try:
+                with self.assertRaises(ValueError):
+                    await batcher.submit(1)
+            finally:
+                await batcher.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
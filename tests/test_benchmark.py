@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from scripts import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def get_results(self, **benchmarks):
+        settings = {name: 1 for name in benchmark.COMPARED_SETTINGS}
+        return {"settings": settings, "benchmarks": benchmarks}
+
+    def test_compare_results(self):
+        baseline = self.get_results(
+            data_pipeline={"images_per_sec": 100.0},
+            detection={"latency_ms_mean": 10.0, "latency_ms_p95": 20.0},
+            train_step={"skipped": "Not run"},
+        )
+        results = self.get_results(
+            data_pipeline={"images_per_sec": 85.0},
+            detection={"latency_ms_mean": 10.5, "latency_ms_p95": 10.0},
+            train_step={"step_time_ms": 5.0},
+            predict_from_folder={"images_per_sec": 50.0},
+        )
+        comparison = benchmark.compare_results(results, baseline, tolerance=0.1)
+
+        # Only the metrics found in both results
+        changes = {"{}.{}".format(c["benchmark"], c["metric"]): c for c in comparison}
+        self.assertEqual(
+            sorted(changes),
+            [
+                "data_pipeline.images_per_sec",
+                "detection.latency_ms_mean",
+                "detection.latency_ms_p95",
+            ],
+        )
+        # Lower throughput is slower, higher latency too
+        self.assertAlmostEqual(changes["data_pipeline.images_per_sec"]["change"], -0.15)
+        self.assertTrue(changes["data_pipeline.images_per_sec"]["regression"])
+        self.assertFalse(changes["detection.latency_ms_mean"]["regression"])
+        self.assertAlmostEqual(changes["detection.latency_ms_p95"]["change"], 1.0)
+        self.assertFalse(changes["detection.latency_ms_p95"]["regression"])
+
+        # Slowdowns within the tolerance are fine
+        comparison = benchmark.compare_results(results, baseline, tolerance=0.2)
+        self.assertFalse(any(c["regression"] for c in comparison))
+
+    def test_check_settings(self):
+        baseline = self.get_results()
+        for name in ("batch_size", "image_size", "device"):
+            results = self.get_results()
+            results["settings"][name] = 2
+            with self.assertRaisesRegex(ValueError, name):
+                benchmark.compare_results(results, baseline)
+
+        # Other settings can change
+        results = self.get_results()
+        results["settings"]["repeats"] = 5
+        self.assertEqual(benchmark.compare_results(results, baseline), [])
+
+    def test_stub_detector(self):
+        detect = benchmark.create_stub_detector(min_size=64, max_size=96)
+        x1, y1, x2, y2 = detect(np.zeros((120, 200, 3), dtype=np.uint8))
+        self.assertTrue(0 <= x1 <= x2 <= 200)
+        self.assertTrue(0 <= y1 <= y2 <= 120)
+
+    def test_main(self):
+        baseline_file = os.path.join(self.folder, "baseline.json")
+        args = dict(
+            only=["detection", "predict_from_folder"],
+            detector="stub",
+            num_images=4,
+            num_classes=2,
+            image_size=32,
+            batch_size=2,
+            repeats=1,
+        )
+        self.assertEqual(benchmark.main(baseline_file, **args), [])
+        with open(baseline_file) as f:
+            results = json.load(f)
+        self.assertEqual(results["settings"]["detector"], "stub")
+        self.assertGreater(results["benchmarks"]["detection"]["latency_ms_mean"], 0)
+
+        # Compared against the baseline, any slowdown is accepted here
+        current_file = os.path.join(self.folder, "current.json")
+        benchmark.main(current_file, baseline=baseline_file, tolerance=1.0, **args)
+        with open(current_file) as f:
+            comparison = json.load(f)["comparison"]
+        self.assertIn(
+            ("detection", "latency_ms_mean"),
+            [(c["benchmark"], c["metric"]) for c in comparison],
+        )
+
+        # Refused before running anything with different settings
+        with self.assertRaises(ValueError):
+            benchmark.main(
+                current_file, baseline=baseline_file, **dict(args, batch_size=4)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from utils.callbacks import TrainingCheckpoint, TrainingProfiler
+from utils.data_pipeline import shuffle_by_epoch
+from utils.schedule import fit_stage
+
+
+class TestTrainingProfiler(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+
+    def test_profiler(self):
+        images = np.random.rand(40, 8, 8, 3).astype(np.float32)
+        labels = keras.utils.to_categorical(np.arange(40) % 2, 2)
+        dataset = tf.data.Dataset.from_tensor_slices((images, labels)).batch(4)
+
+        model = keras.Sequential(
+            [
+                keras.layers.Input(shape=(8, 8, 3)),
+                keras.layers.Flatten(),
+                keras.layers.Dense(2, activation="softmax"),
+            ]
+        )
+        model.compile(optimizer="adam", loss="categorical_crossentropy")
+
+        profiler = TrainingProfiler(self.log_dir, input_probe_steps=5)
+        profiler.set_input_dataset(dataset, 4)
+        model.fit(dataset, epochs=2, callbacks=[profiler], verbose=0)
+
+        with open(os.path.join(self.log_dir, "profile_summary.json")) as f:
+            summary = json.load(f)
+        self.assertEqual(summary["steps"], 20)
+        self.assertEqual(summary["epochs"], 2)
+        self.assertGreater(summary["examples_per_sec"], 0)
+        self.assertGreater(summary["peak_memory_mb"], 0)
+        self.assertIsNotNone(summary["input_ms_per_step"])
+        self.assertIn(summary["input_bound"], (True, False))
+
+        with open(os.path.join(self.log_dir, "steps.csv")) as f:
+            self.assertEqual(len(f.readlines()), 21)
+
+    def test_probe_after_first_epoch(self):
+        # Reading the dataset counts the decoded images
+        decoded = tf.Variable(0)
+
+        def decode(x):
+            decoded.assign_add(1)
+            return tf.fill([8, 8, 3], tf.cast(x, tf.float32)), tf.one_hot(x % 2, 2)
+
+        dataset = tf.data.Dataset.range(40).map(decode).cache().batch(4)
+        model = keras.Sequential(
+            [
+                keras.layers.Input(shape=(8, 8, 3)),
+                keras.layers.Flatten(),
+                keras.layers.Dense(2, activation="softmax"),
+            ]
+        )
+        model.compile(optimizer="adam", loss="categorical_crossentropy")
+
+        profiler = TrainingProfiler(self.log_dir, input_probe_steps=5)
+        profiler.set_input_dataset(dataset, 4)
+        model.fit(dataset, epochs=2, callbacks=[profiler], verbose=0)
+
+        # The probe read the filled cache, no image was decoded again
+        self.assertEqual(int(decoded.numpy()), 40)
+        self.assertIsNotNone(profiler.input_ms_per_step)
+
+
+class TestTrainingCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        images = np.random.rand(40, 8, 8, 3).astype(np.float32)
+        labels = keras.utils.to_categorical(np.arange(40) % 2, 2)
+        self.dataset = tf.data.Dataset.from_tensor_slices((images, labels)).batch(4)
+
+    def create_model(self):
+        model = keras.Sequential(
+            [
+                keras.layers.Input(shape=(8, 8, 3)),
+                keras.layers.Flatten(),
+                keras.layers.Dense(2, activation="softmax"),
+            ]
+        )
+        model.compile(optimizer="adam", loss="categorical_crossentropy")
+
+        return model
+
+    def test_interrupt_and_restore(self):
+        model = self.create_model()
+        checkpoint = TrainingCheckpoint(self.directory, save_every_steps=3)
+
+        class Preempt(keras.callbacks.Callback):
+            def on_train_batch_begin(self, batch, logs=None):
+                if self.model.optimizer.iterations == 14:
+                    checkpoint.handle_sigterm(None, None)
+
+        model.fit(self.dataset, epochs=3, callbacks=[checkpoint, Preempt()], verbose=0)
+        self.assertTrue(checkpoint.interrupted)
+
+        # Nothing is restored without checkpoints
+        empty_checkpoint = TrainingCheckpoint(os.path.join(self.directory, "empty"))
+        self.assertEqual(empty_checkpoint.restore(self.create_model()), (0, 0))
+
+        # Stopped in the second epoch after its 5th step
+        restored_model = self.create_model()
+        restored_checkpoint = TrainingCheckpoint(self.directory)
+        self.assertEqual(restored_checkpoint.restore(restored_model), (1, 5))
+        self.assertEqual(int(restored_model.optimizer.iterations), 15)
+        for weights, restored_weights in zip(
+            model.get_weights(), restored_model.get_weights()
+        ):
+            np.testing.assert_allclose(weights, restored_weights)
+
+    def test_interrupt_last_step(self):
+        model = self.create_model()
+        checkpoint = TrainingCheckpoint(self.directory, save_every_steps=5)
+
+        class Preempt(keras.callbacks.Callback):
+            def on_train_batch_begin(self, batch, logs=None):
+                if batch == 9:
+                    checkpoint.handle_sigterm(None, None)
+
+        model.fit(self.dataset, epochs=2, callbacks=[checkpoint, Preempt()], verbose=0)
+
+        # The whole epoch was done, it continues from the next one
+        restored_model = self.create_model()
+        restored_checkpoint = TrainingCheckpoint(self.directory)
+        self.assertEqual(restored_checkpoint.restore(restored_model), (1, 0))
+
+    def test_fit_stage_resume(self):
+        # Killed during validation after the last step of the first epoch
+        model = self.create_model()
+        fit_stage(
+            model,
+            self.dataset,
+            None,
+            [],
+            {"initial_epoch": 0, "epochs": 2, "verbose": 0},
+            initial_step=10,
+        )
+        self.assertEqual(int(model.optimizer.iterations), 10)
+
+        # Nothing left to train
+        fit_stage(
+            model,
+            self.dataset,
+            None,
+            [],
+            {"initial_epoch": 1, "epochs": 2, "verbose": 0},
+            initial_step=10,
+        )
+        self.assertEqual(int(model.optimizer.iterations), 10)
+
+        # The rest of the epoch and the next one
+        model = self.create_model()
+        fit_stage(
+            model,
+            self.dataset,
+            None,
+            [],
+            {"initial_epoch": 0, "epochs": 2, "verbose": 0},
+            initial_step=4,
+        )
+        self.assertEqual(int(model.optimizer.iterations), 16)
+
+    def test_resume_data_order(self):
+        class Recorder(keras.layers.Layer):
+            # Keeps the index of each training image, stored in its pixels
+            def __init__(self, seen):
+                super().__init__()
+                self.seen = seen
+
+            def call(self, inputs, training=None):
+                if training:
+                    self.seen.extend(inputs[:, 0, 0, 0].numpy().astype(int))
+                return inputs
+
+        def create_model(seen):
+            model = keras.Sequential(
+                [
+                    keras.layers.Input(shape=(8, 8, 3)),
+                    Recorder(seen),
+                    keras.layers.Flatten(),
+                    keras.layers.Dense(2, activation="softmax"),
+                ]
+            )
+            model.compile(
+                optimizer="adam", loss="categorical_crossentropy", run_eagerly=True
+            )
+            return model
+
+        def create_dataset(checkpoint):
+            images = np.arange(40, dtype=np.float32)[:, None, None, None]
+            images = np.broadcast_to(images, (40, 8, 8, 3))
+            labels = keras.utils.to_categorical(np.arange(40) % 2, 2)
+            dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+            dataset = shuffle_by_epoch(dataset, 40, 123, checkpoint.data_epoch)
+            return dataset.batch(4).prefetch(2)
+
+        # Uninterrupted run
+        expected = []
+        checkpoint = TrainingCheckpoint(os.path.join(self.directory, "full"))
+        create_model(expected).fit(
+            create_dataset(checkpoint), epochs=2, callbacks=[checkpoint], verbose=0
+        )
+        self.assertNotEqual(expected[:40], expected[40:])
+
+        # Stopped in the second epoch after its 5th step, then resumed
+        seen = []
+        checkpoint = TrainingCheckpoint(os.path.join(self.directory, "resumed"))
+
+        class Preempt(keras.callbacks.Callback):
+            def on_train_batch_begin(self, batch, logs=None):
+                if self.model.optimizer.iterations == 14:
+                    checkpoint.handle_sigterm(None, None)
+
+        create_model(seen).fit(
+            create_dataset(checkpoint),
+            epochs=2,
+            callbacks=[checkpoint, Preempt()],
+            verbose=0,
+        )
+        self.assertEqual(len(seen), 60)
+
+        resumed_seen = []
+        model = create_model(resumed_seen)
+        checkpoint = TrainingCheckpoint(os.path.join(self.directory, "resumed"))
+        initial_epoch, initial_step = checkpoint.restore(model)
+        fit_stage(
+            model,
+            create_dataset(checkpoint),
+            None,
+            [checkpoint],
+            {"initial_epoch": initial_epoch, "epochs": 2, "verbose": 0},
+            initial_step,
+        )
+
+        # Every image of the interrupted epoch is trained once
+        self.assertEqual(seen + resumed_seen, expected)
+
+    def test_save_every_epoch(self):
+        model = self.create_model()
+        checkpoint = TrainingCheckpoint(self.directory)
+        model.fit(self.dataset, epochs=2, callbacks=[checkpoint], verbose=0)
+        self.assertFalse(checkpoint.interrupted)
+
+        restored_checkpoint = TrainingCheckpoint(self.directory)
+        self.assertEqual(restored_checkpoint.restore(self.create_model()), (2, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import class_index, utils
+
+
+class TestClassIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_create_class_index(self):
+        index = class_index.create_class_index(["b", "c", "a"])
+        self.assertListEqual(index["class_names"], ["a", "b", "c"])
+        self.assertEqual(index["version"], class_index.CLASS_INDEX_VERSION)
+        # Order doesn't matter, the fingerprint is the same
+        self.assertEqual(
+            index["fingerprint"],
+            class_index.create_class_index(["c", "a", "b"])["fingerprint"],
+        )
+
+    def test_save_and_load(self):
+        model_path = os.path.join(self.folder, "model.06-2.0449.h5")
+        class_index.save_class_index(self.folder, ["a", "b"])
+        self.assertTrue(
+            os.path.exists(os.path.join(self.folder, class_index.CLASS_INDEX_FILENAME))
+        )
+
+        # Found next to `.h5` files and inside model folders
+        self.assertListEqual(class_index.load_class_names(model_path), ["a", "b"])
+        self.assertListEqual(class_index.load_class_names(self.folder), ["a", "b"])
+        self.assertListEqual(utils.get_model_class_names(model_path), ["a", "b"])
+
+        # Saving the same classes again is fine, different ones are not
+        class_index.save_class_index(model_path, ["a", "b"])
+        with self.assertRaises(ValueError):
+            class_index.save_class_index(model_path, ["a", "b", "c"])
+        with self.assertRaises(ValueError):
+            class_index.save_class_index(self.folder, ["b", "a"])
+
+        # Edited files are detected
+        path = class_index.get_class_index_path(model_path)
+        with open(path) as f:
+            index = json.load(f)
+        index["class_names"].reverse()
+        with open(path, "w") as f:
+            json.dump(index, f)
+        with self.assertRaises(ValueError):
+            class_index.load_class_index(model_path)
+
+    def test_save_legacy_order(self):
+        index = class_index.save_class_index(self.folder, ["b", "a"], legacy_order=True)
+        self.assertTrue(index["legacy_order"])
+        self.assertListEqual(class_index.load_class_names(self.folder), ["b", "a"])
+        self.assertNotIn("legacy_order", class_index.create_class_index(["b", "a"]))
+
+    def test_get_model_class_names_fallback(self):
+        for class_name in ("class_b", "class_a"):
+            os.makedirs(os.path.join(self.folder, "data", class_name))
+        config = {"data": {"directory": os.path.join(self.folder, "data")}}
+        model_path = os.path.join(self.folder, "model.h5")
+
+        with self.assertRaises(FileNotFoundError):
+            utils.get_model_class_names(model_path)
+
+        # Old models were trained with the unsorted folder listing, their
+        # outputs keep mapping to the same classes
+        with mock.patch("os.listdir", return_value=["class_b", "class_a"]):
+            self.assertListEqual(
+                utils.get_model_class_names(model_path, config),
+                ["class_b", "class_a"],
+            )
+            # New trainings use the sorted classes
+            self.assertListEqual(utils.get_class_names(config), ["class_a", "class_b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
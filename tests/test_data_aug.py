@@ -1,8 +1,20 @@
 import unittest
 
+import numpy as np
+import tensorflow as tf
 from tensorflow import keras
 
-from utils.data_aug import create_data_aug_layer
+from utils.data_aug import ColorJitter, Cutout, RandomResizedCrop, create_data_aug_layer
+
+
+def coordinate_images(batch_size, height, width):
+    """
+    Images whose first two channels hold the row and column of each pixel.
+    """
+    rows, cols = np.meshgrid(np.arange(height), np.arange(width), indexing="ij")
+    img = np.stack([rows, cols, np.zeros_like(rows)], axis=-1).astype(np.float32)
+
+    return tf.constant(np.repeat(img[np.newaxis], batch_size, axis=0))
 
 
 class TestDataAug(unittest.TestCase):
@@ -76,3 +88,66 @@ class TestDataAug(unittest.TestCase):
             places=4,
             msg="Incorrect RandomZoom 'width_factor' parameter",
         )
+
+    def test_random_resized_crop(self):
+        images = coordinate_images(16, 20, 30)
+        # Traced as in the input pipeline or `fit()`
+        layer = tf.function(RandomResizedCrop(min_scale=0.5, seed=1))
+        crops = layer(images, training=True)
+        self.assertEqual(crops.shape, images.shape)
+        self.assertEqual(crops.dtype, tf.float32)
+        self.assertGreaterEqual(float(tf.reduce_min(crops)), 0.0)
+        self.assertLessEqual(float(tf.reduce_max(crops)), 29.0)
+
+        # Windows sides and corners are drawn independently
+        crops = crops.numpy()
+        height_scale = (crops[:, -1, -1, 0] - crops[:, 0, 0, 0]) / 19
+        width_scale = (crops[:, -1, -1, 1] - crops[:, 0, 0, 1]) / 29
+        self.assertTrue(np.all(height_scale >= 0.5 - 1e-4))
+        self.assertFalse(np.allclose(height_scale, width_scale, atol=1e-3))
+        y1 = crops[:, 0, 0, 0] / 19
+        x1 = crops[:, 0, 0, 1] / 29
+        self.assertFalse(np.allclose(y1 / (1 - height_scale), x1 / (1 - width_scale)))
+
+        # Full size windows and inference leave images as they are
+        crops = RandomResizedCrop(min_scale=1.0)(images, training=True)
+        self.assertTrue(np.allclose(crops, images, atol=1e-4))
+        self.assertIs(RandomResizedCrop()(images, training=False), images)
+
+    def test_color_jitter(self):
+        images = tf.random.uniform((8, 10, 12, 3), 0, 255, seed=1)
+        layer = ColorJitter(brightness=0.3, contrast=0.3, saturation=0.3, hue=0.1)
+        jittered = layer(images, training=True)
+        self.assertEqual(jittered.shape, images.shape)
+        self.assertEqual(jittered.dtype, tf.float32)
+        self.assertGreaterEqual(float(tf.reduce_min(jittered)), 0.0)
+        self.assertLessEqual(float(tf.reduce_max(jittered)), 255.0)
+        self.assertFalse(np.allclose(jittered, images))
+
+        # Brightness alone shifts each image by its own random amount
+        shifted = ColorJitter(brightness=0.1)(tf.fill((8, 4, 4, 3), 100.0))
+        self.assertGreater(len(np.unique(np.round(shifted[:, 0, 0, 0], 3))), 1)
+
+        # No change at zero strength or during inference
+        self.assertTrue(np.allclose(ColorJitter()(images, training=True), images))
+        self.assertIs(layer(images, training=False), images)
+
+    def test_cutout(self):
+        images = tf.ones((16, 20, 20, 3))
+        layer = tf.function(Cutout(size=0.25, fill_value=-1.0, seed=1))
+        cut = layer(images, training=True)
+        self.assertEqual(cut.shape, images.shape)
+        self.assertEqual(cut.dtype, tf.float32)
+        self.assertTrue(np.all(np.isin(cut.numpy(), [-1.0, 1.0])))
+
+        # Rectangle of at most size times each side, centered anywhere
+        mask = cut.numpy()[..., 0] == -1.0
+        self.assertTrue(np.all(mask.sum(axis=(1, 2)) > 0))
+        self.assertTrue(np.all(mask.any(axis=2).sum(axis=1) <= 5))
+        center_rows = [np.nonzero(m.any(axis=1))[0].mean() for m in mask]
+        center_cols = [np.nonzero(m.any(axis=0))[0].mean() for m in mask]
+        self.assertFalse(np.allclose(center_rows, center_cols))
+
+        # No change at zero size or during inference
+        self.assertTrue(np.array_equal(Cutout(size=0.0)(images, training=True), images))
+        self.assertIs(Cutout()(images, training=False), images)
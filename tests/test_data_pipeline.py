@@ -0,0 +1,173 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import tensorflow as tf
+
+from utils.data_pipeline import (
+    AUTOTUNE,
+    build_dataset,
+    get_cache_path,
+    list_image_files,
+    parse_pipeline_config,
+    shuffle_by_epoch,
+)
+
+
+class TestDataPipeline(unittest.TestCase):
+    def setUp(self):
+        # Build a tiny dataset with two classes from the test images
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        test_images = {
+            "class_a": ["005652.jpg", "008773.jpg"],
+            "class_b": ["012310.jpg", "cat.jpeg"],
+        }
+        for class_name, filenames in test_images.items():
+            os.makedirs(os.path.join(self.folder, class_name))
+            for filename in filenames:
+                shutil.copy(
+                    os.path.join("tests/test_data", filename),
+                    os.path.join(self.folder, class_name, filename),
+                )
+
+    def get_config(self, pipeline):
+        return {
+            "seed": 123,
+            "data": {
+                "directory": self.folder,
+                "label_mode": "categorical",
+                "validation_split": 0.5,
+                "image_size": [32, 48],
+                "batch_size": 2,
+                "pipeline": pipeline,
+            },
+        }
+
+    def test_parse_pipeline_config(self):
+        pipeline_config = parse_pipeline_config(None)
+        self.assertEqual(pipeline_config["prefetch"], AUTOTUNE)
+        self.assertEqual(pipeline_config["num_parallel_calls"], AUTOTUNE)
+        self.assertIsNone(pipeline_config["cache"])
+
+        pipeline_config = parse_pipeline_config(
+            {"prefetch": 4, "num_parallel_calls": 8, "deterministic": False}
+        )
+        self.assertEqual(pipeline_config["prefetch"], 4)
+        self.assertEqual(pipeline_config["num_parallel_calls"], 8)
+        self.assertFalse(pipeline_config["deterministic"])
+
+    def test_get_cache_path(self):
+        self.assertIsNone(get_cache_path(None, "training", (32, 48)))
+        self.assertEqual(get_cache_path("memory", "training", (32, 48)), "")
+
+        cache = os.path.join(self.folder, "cache")
+        settings = {"directory": self.folder, "validation_split": 0.5, "seed": 1}
+        path = get_cache_path(cache, "training", (32, 48), settings)
+        self.assertTrue(os.path.basename(path).startswith("training_32x48_"))
+        self.assertEqual(path, get_cache_path(cache, "training", (32, 48), settings))
+
+        # Another split or dataset gets its own cache
+        for name, value in [
+            ("directory", "/other"),
+            ("validation_split", 0.2),
+            ("seed", 2),
+        ]:
+            other_path = get_cache_path(
+                cache, "training", (32, 48), dict(settings, **{name: value})
+            )
+            self.assertNotEqual(path, other_path)
+
+    def test_list_image_files(self):
+        # Settings only used by this project are left out for Keras
+        class_names = ["class_a", "class_b"]
+        data_config = dict(
+            self.get_config({"cache": "memory"})["data"], format="images"
+        )
+        file_paths, labels = list_image_files(data_config, "training", class_names, 123)
+        self.assertEqual(len(file_paths), 2)
+        for path, label in zip(file_paths, labels):
+            self.assertEqual(
+                os.path.basename(os.path.dirname(path)), class_names[label]
+            )
+
+    def test_build_dataset(self):
+        class_names = ["class_a", "class_b"]
+        config = self.get_config({"cache": "memory", "deterministic": False})
+        train_ds = build_dataset(config, "training", class_names)
+        val_ds = build_dataset(config, "validation", class_names)
+
+        # Same split as Keras would do
+        keras_val_ds = tf.keras.preprocessing.image_dataset_from_directory(
+            subset="validation",
+            class_names=class_names,
+            seed=config["seed"],
+            shuffle=True,
+            **{k: v for k, v in config["data"].items() if k != "pipeline"},
+        )
+        keras_images = sorted(
+            float(tf.reduce_sum(img)) for img, _ in keras_val_ds.unbatch()
+        )
+        images = sorted(float(tf.reduce_sum(img)) for img, _ in val_ds.unbatch())
+        self.assertListEqual(images, keras_images)
+
+        # Check batches shape
+        for imgs, labels in train_ds:
+            self.assertEqual(imgs.shape[1:], (32, 48, 3))
+            self.assertEqual(labels.shape[1:], (2,))
+
+        self.assertEqual(sum(int(imgs.shape[0]) for imgs, _ in train_ds), 2)
+
+    def test_shuffle_by_epoch(self):
+        epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        dataset = shuffle_by_epoch(tf.data.Dataset.range(20), 20, 123, epoch)
+        self.assertEqual(int(dataset.cardinality()), 20)
+
+        # The order only depends on the epoch number
+        orders = {}
+        for epoch_value in (0, 1, 0, 2, 1):
+            epoch.assign(epoch_value)
+            order = [int(x) for x in dataset]
+            self.assertEqual(sorted(order), list(range(20)))
+            self.assertEqual(orders.setdefault(epoch_value, order), order)
+        self.assertNotEqual(orders[0], orders[1])
+        self.assertNotEqual(orders[1], orders[2])
+
+        # Also through the whole pipeline, with cached images
+        config = self.get_config({"cache": "memory"})
+        config["data"]["batch_size"] = 1
+        train_ds = build_dataset(
+            config, "training", ["class_a", "class_b"], epoch=epoch
+        )
+        orders = []
+        for epoch_value in (3, 3):
+            epoch.assign(epoch_value)
+            orders.append([float(tf.reduce_sum(img)) for img, _ in train_ds])
+        self.assertEqual(orders[0], orders[1])
+
+    def test_build_dataset_augment(self):
+        class_names = ["class_a", "class_b"]
+        config = self.get_config({"cache": "memory", "augment": True})
+        config["model"] = {
+            "data_aug_layer": {
+                "random_flip": {"mode": "horizontal"},
+                "random_crop": {"min_scale": 0.5},
+                "color_jitter": {"brightness": 0.2},
+            }
+        }
+        train_ds = build_dataset(config, "training", class_names)
+        val_ds = build_dataset(config, "validation", class_names)
+        val_images = [imgs.numpy() for imgs, _ in val_ds]
+
+        for imgs, labels in train_ds:
+            self.assertEqual(imgs.shape[1:], (32, 48, 3))
+            self.assertEqual(labels.shape[1:], (2,))
+
+        # Validation images are never augmented
+        for imgs, (expected, _) in zip(val_images, val_ds):
+            self.assertTrue((imgs == expected.numpy()).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
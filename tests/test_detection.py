@@ -1,11 +1,39 @@
+import os
 import unittest
+from unittest import mock
 
 import cv2
+import torch
+from detectron2.structures import Boxes, Instances
 
-from utils.detection import get_vehicle_coordinates
+from utils import detection
+from utils.detection import get_vehicle_coordinates, get_vehicle_coordinates_batch
 
 
 class TestDataAug(unittest.TestCase):
+    def test_detector_settings(self):
+        # Defaults
+        settings = detection.get_detector_settings()
+        self.assertEqual(settings["device"], "cpu")
+        self.assertAlmostEqual(settings["score_thresh"], 0.5)
+        self.assertIsNone(settings["min_size"])
+
+        # Environment variables override defaults
+        env = {"DETECTOR_SCORE_THRESH": "0.7", "DETECTOR_MIN_SIZE": "600"}
+        with mock.patch.dict(os.environ, env):
+            settings = detection.get_detector_settings()
+            self.assertAlmostEqual(settings["score_thresh"], 0.7)
+            self.assertEqual(settings["min_size"], 600)
+
+            # configure_detector() overrides environment variables
+            self.addCleanup(setattr, detection, "_settings_overrides", {})
+            detection.configure_detector(score_thresh=0.3)
+            settings = detection.get_detector_settings()
+            self.assertAlmostEqual(settings["score_thresh"], 0.3)
+
+        with self.assertRaises(ValueError):
+            detection.configure_detector(threshold=0.3)
+
     def test_get_vehicle_coordinates(self):
         # Test no vehicle is detected
         im = cv2.imread("tests/test_data/cat.jpeg")
@@ -36,3 +64,62 @@ class TestDataAug(unittest.TestCase):
         self.assertAlmostEqual(y1, 181, delta=5)
         self.assertAlmostEqual(x2, 543, delta=5)
         self.assertAlmostEqual(y2, 408, delta=5)
+
+    def test_get_vehicle_coordinates_batch(self):
+        imgs = [
+            cv2.imread(os.path.join("tests/test_data", filename))
+            for filename in ["cat.jpeg", "012310.jpg", "005652.jpg", "008773.jpg"]
+        ]
+        boxes = get_vehicle_coordinates_batch(imgs, batch_size=3)
+
+        # Results must be in the same order and close to single image ones
+        self.assertEqual(len(boxes), len(imgs))
+        for img, box in zip(imgs, boxes):
+            expected_box = get_vehicle_coordinates(img)
+            for coord, expected_coord in zip(box, expected_box):
+                self.assertAlmostEqual(coord, expected_coord, delta=5)
+
+    def test_get_valid_boxes(self):
+        class_ids = {
+            name: detection.ALL_CLASS_NAMES.index(name)
+            for name in ["car", "truck", "bus", "person"]
+        }
+        instances = Instances((500, 500))
+        instances.pred_boxes = Boxes(
+            torch.tensor(
+                [
+                    [0.0, 0.0, 100.0, 100.0],
+                    [0.0, 0.0, 400.0, 400.0],
+                    [10.0, 10.0, 300.0, 300.0],
+                    [0.0, 0.0, 200.0, 100.0],
+                ]
+            )
+        )
+        instances.pred_classes = torch.tensor(
+            [
+                class_ids["car"],
+                class_ids["person"],
+                class_ids["bus"],
+                class_ids["truck"],
+            ]
+        )
+        outputs = {"instances": instances}
+
+        # Only cars and trucks by default, the truck is the largest one
+        valid_boxes = detection.get_valid_boxes(outputs)
+        self.assertEqual(len(valid_boxes), 2)
+        select_box = detection.box_with_largest_area(valid_boxes)
+        self.assertListEqual(select_box.tensor.tolist(), [[0.0, 0.0, 200.0, 100.0]])
+
+        # Buses can be considered vehicles too
+        self.addCleanup(detection.set_vehicle_classes, ["car", "truck"])
+        detection.set_vehicle_classes(["car", "truck", "bus"])
+        valid_boxes = detection.get_valid_boxes(outputs)
+        self.assertEqual(len(valid_boxes), 3)
+        select_box = detection.box_with_largest_area(valid_boxes)
+        self.assertListEqual(select_box.tensor.tolist(), [[10.0, 10.0, 300.0, 300.0]])
+
+        # No vehicles at all
+        detection.set_vehicle_classes(["motorcycle"])
+        valid_boxes = detection.get_valid_boxes(outputs)
+        self.assertIsNone(detection.box_with_largest_area(valid_boxes))
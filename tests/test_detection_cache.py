@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+
+from utils.detection_cache import DetectionCache
+
+
+class TestDetectionCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, "detections.db")
+
+    def test_get_put(self):
+        cache = DetectionCache(self.path, "detector_1", store_raw_boxes=True)
+        self.addCleanup(cache.close)
+        car_im = cv2.imread("tests/test_data/012310.jpg")
+        cat_im = cv2.imread("tests/test_data/cat.jpeg")
+
+        # Nothing stored yet
+        self.assertIsNone(cache.get(car_im))
+
+        cache.put(car_im, (72, 106, 572, 359), [[72.0, 106.0, 572.0, 359.0]])
+        cache.put(cat_im, None, [])
+
+        entry = cache.get(car_im)
+        self.assertEqual(entry["box"], (72, 106, 572, 359))
+        self.assertEqual(entry["raw_boxes"], [[72.0, 106.0, 572.0, 359.0]])
+
+        # No vehicle found is also a hit
+        entry = cache.get(cat_im)
+        self.assertIsNotNone(entry)
+        self.assertIsNone(entry["box"])
+
+        # Same content, different array, is a hit
+        self.assertIsNotNone(cache.get(car_im.copy()))
+
+        # A different image is a miss
+        self.assertIsNone(cache.get(car_im[:100]))
+
+    def test_detector_key(self):
+        car_im = cv2.imread("tests/test_data/012310.jpg")
+        cache = DetectionCache(self.path, "detector_1")
+        cache.put(car_im, (72, 106, 572, 359), [[72.0, 106.0, 572.0, 359.0]])
+        cache.close()
+
+        # Results persist on disk, raw boxes weren't requested
+        cache = DetectionCache(self.path, "detector_1")
+        self.addCleanup(cache.close)
+        entry = cache.get(car_im)
+        self.assertEqual(entry["box"], (72, 106, 572, 359))
+        self.assertIsNone(entry["raw_boxes"])
+
+        # Changing detector settings must not return stale boxes
+        other_cache = DetectionCache(self.path, "detector_2")
+        self.addCleanup(other_cache.close)
+        self.assertIsNone(other_cache.get(car_im))
+
+    def test_flush(self):
+        car_im = cv2.imread("tests/test_data/012310.jpg")
+        cat_im = cv2.imread("tests/test_data/cat.jpeg")
+        cache = DetectionCache(self.path, "detector_1")
+        reader = DetectionCache(self.path, "detector_1")
+        self.addCleanup(reader.close)
+
+        # Pending entries are only seen by the cache that wrote them
+        cache.put(car_im, (72, 106, 572, 359), commit=False)
+        self.assertIsNotNone(cache.get(car_im))
+        self.assertIsNone(reader.get(car_im))
+
+        cache.flush()
+        self.assertEqual(reader.get(car_im)["box"], (72, 106, 572, 359))
+
+        # Closing the cache commits what is left
+        cache.put(cat_im, None, commit=False)
+        cache.close()
+        self.assertIsNotNone(reader.get(cat_im))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import csv
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+from tensorflow import keras
+
+from scripts import launch_workers
+from utils import distribute
+
+
+class TestDistribute(unittest.TestCase):
+    def setUp(self):
+        # Build a tiny dataset with two classes from the test images
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        for class_name in ("class_a", "class_b"):
+            os.makedirs(os.path.join(self.folder, class_name))
+            for i in range(5):
+                shutil.copy(
+                    "tests/test_data/005652.jpg",
+                    os.path.join(self.folder, class_name, "{}.jpg".format(i)),
+                )
+
+    def test_parse_distribute_config(self):
+        distribute_config = distribute.parse_distribute_config(None)
+        self.assertEqual(distribute_config["strategy"], "default")
+        self.assertTrue(distribute_config["scale_batch_size"])
+
+        with self.assertRaises(ValueError):
+            distribute.parse_distribute_config({"strategy": "tpu"})
+        with self.assertRaises(ValueError):
+            distribute.parse_distribute_config({"communication": "grpc"})
+
+    def test_is_chief(self):
+        cluster = {"worker": ["localhost:2000", "localhost:2001"]}
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertTrue(distribute.is_chief())
+
+        for task_id, expected in [(0, True), (1, False)]:
+            tf_config = {
+                "cluster": cluster,
+                "task": {"type": "worker", "index": task_id},
+            }
+            with mock.patch.dict(os.environ, {"TF_CONFIG": json.dumps(tf_config)}):
+                self.assertEqual(distribute.is_chief(), expected)
+                self.assertEqual(
+                    distribute.get_worker_dir("/logs") == "/logs", expected
+                )
+
+    def test_distribute_dataset(self):
+        strategy = distribute.create_strategy({"strategy": "mirrored"})
+        global_batch_size = distribute.get_global_batch_size(2, strategy)
+        self.assertEqual(global_batch_size, 2 * strategy.num_replicas_in_sync)
+        self.assertEqual(
+            distribute.get_global_batch_size(2, strategy, scale_batch_size=False), 2
+        )
+
+        config = {
+            "seed": 123,
+            "data": {
+                "directory": self.folder,
+                "label_mode": "categorical",
+                "validation_split": 0.2,
+                "image_size": [32, 32],
+                "batch_size": 2,
+            },
+        }
+        train_ds, steps = distribute.distribute_dataset(
+            strategy, config, "training", ["class_a", "class_b"], global_batch_size
+        )
+        self.assertEqual(steps, 8 // global_batch_size)
+
+        # The dataset repeats, so it never runs out of batches
+        iterator = iter(train_ds)
+        for _ in range(steps * 3):
+            images, labels = next(iterator)
+        images = strategy.experimental_local_results(images)[0]
+        self.assertEqual(images.shape[1:], (32, 32, 3))
+
+
+class TestLaunchWorkers(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        data_folder = os.path.join(self.folder, "data")
+        for class_name in ("class_a", "class_b"):
+            os.makedirs(os.path.join(data_folder, class_name))
+            for i in range(4):
+                shutil.copy(
+                    "tests/test_data/005652.jpg",
+                    os.path.join(data_folder, class_name, "{}.jpg".format(i)),
+                )
+
+        # Small stand-in for the Resnet50 model, trained from its file
+        base_input = keras.Input((None, None, 3))
+        x = keras.layers.Conv2D(4, 3)(base_input)
+        x = keras.layers.GlobalAveragePooling2D()(x)
+        base_model = keras.Model(base_input, x, name="resnet50")
+        input = keras.Input((32, 32, 3))
+        outputs = keras.layers.Dense(2, activation="softmax")(base_model(input))
+        weights = os.path.join(self.folder, "init.h5")
+        keras.Model(input, outputs).save(weights)
+
+        self.output_folder = os.path.join(self.folder, "exp")
+        self.config_file = os.path.join(self.folder, "config.yml")
+        with open(self.config_file, "w") as f:
+            yaml.safe_dump(
+                {
+                    "seed": 123,
+                    "data": {
+                        "directory": data_folder,
+                        "label_mode": "categorical",
+                        "validation_split": 0.25,
+                        "image_size": [32, 32],
+                        "batch_size": 2,
+                    },
+                    "model": {"weights": weights, "classes": 2},
+                    "compile": {
+                        "optimizer": {"sgd": {"learning_rate": 0.01}},
+                        "loss": "categorical_crossentropy",
+                        "metrics": ["accuracy"],
+                    },
+                    "fit": {
+                        "epochs": 2,
+                        "callbacks": {
+                            "model_checkpoint": {
+                                "filepath": os.path.join(
+                                    self.output_folder, "models", "model.{epoch:02d}.h5"
+                                )
+                            },
+                            "csv_logger": {
+                                "filename": os.path.join(
+                                    self.output_folder, "history.csv"
+                                )
+                            },
+                            "tensor_board": {
+                                "log_dir": os.path.join(self.output_folder, "logs")
+                            },
+                        },
+                    },
+                    "distribute": {"strategy": "multi_worker_mirrored"},
+                },
+                f,
+            )
+
+    def test_main(self):
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            base_port = s.getsockname()[1]
+        # Workers run `scripts/train.py`, it imports the project modules
+        with mock.patch.dict(os.environ, {"PYTHONPATH": os.getcwd()}):
+            returncode = launch_workers.main(self.config_file, 2, base_port)
+        self.assertEqual(returncode, 0)
+
+        # Only the chief writes to the configured paths, the other worker
+        # gets its own subfolders
+        models_dir = os.path.join(self.output_folder, "models")
+        self.assertEqual(
+            sorted(os.listdir(models_dir)),
+            ["class_index.json", "model.01.h5", "model.02.h5", "worker_1"],
+        )
+        self.assertTrue(os.path.isdir(os.path.join(self.output_folder, "worker_1")))
+        self.assertTrue(os.path.isdir(os.path.join(self.output_folder, "logs")))
+        self.assertTrue(
+            os.path.isdir(os.path.join(self.output_folder, "logs", "worker_1"))
+        )
+
+        model = keras.models.load_model(os.path.join(models_dir, "model.02.h5"))
+        self.assertEqual(model.output_shape, (None, 2))
+        with open(os.path.join(self.output_folder, "history.csv"), newline="") as f:
+            history = list(csv.DictReader(f))
+        self.assertEqual([row["epoch"] for row in history], ["0", "1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
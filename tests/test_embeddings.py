@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from tensorflow import keras
+
+from utils import embeddings
+
+
+class TestEmbeddings(unittest.TestCase):
+    def setUp(self):
+        # Build a tiny dataset with two classes from the test images
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        test_images = {
+            "class_a": ["005652.jpg", "008773.jpg"],
+            "class_b": ["012310.jpg", "cat.jpeg"],
+        }
+        for class_name, filenames in test_images.items():
+            os.makedirs(os.path.join(self.folder, "data", class_name))
+            for filename in filenames:
+                shutil.copy(
+                    os.path.join("tests/test_data", filename),
+                    os.path.join(self.folder, "data", class_name, filename),
+                )
+
+        self.class_names = ["class_a", "class_b"]
+        self.config = {
+            "seed": 123,
+            "data": {
+                "directory": os.path.join(self.folder, "data"),
+                "label_mode": "categorical",
+                "validation_split": 0.5,
+                "image_size": [32, 32],
+                "batch_size": 2,
+            },
+            "model": {
+                "data_aug_layer": {"random_flip": {"mode": "horizontal"}},
+            },
+            "features": {
+                "directory": os.path.join(self.folder, "features"),
+                "augmented_copies": 2,
+            },
+        }
+
+        # Small stand-in for the Resnet50 base
+        inputs = keras.layers.Input(shape=(32, 32, 3))
+        outputs = keras.layers.GlobalAveragePooling2D()(inputs)
+        self.feature_extractor = keras.Model(inputs, outputs)
+
+    def test_extract_and_load(self):
+        directory = self.config["features"]["directory"]
+        meta = embeddings.get_store_meta(self.config, self.class_names)
+        self.assertFalse(embeddings.store_exists(directory, meta))
+
+        embeddings.extract_features(
+            self.config, self.class_names, self.feature_extractor
+        )
+        self.assertTrue(embeddings.store_exists(directory, meta))
+
+        # Training subset is stored once plus the augmented copies
+        train_features = np.load(os.path.join(directory, "training_features.npy"))
+        self.assertEqual(train_features.shape, (6, 3))
+        val_labels = np.load(os.path.join(directory, "validation_labels.npy"))
+        self.assertEqual(val_labels.shape, (2,))
+
+        train_ds = embeddings.load_features_dataset(
+            self.config, "training", self.class_names, shuffle=True
+        )
+        features, labels = next(iter(train_ds))
+        self.assertEqual(features.shape, (2, 3))
+        self.assertEqual(labels.shape, (2, 2))
+        self.assertEqual(sum(len(labels) for _, labels in train_ds), 6)
+
+        # Changing settings must not reuse the store
+        for section, name, value in [
+            ("features", "augmented_copies", 1),
+            ("data", "directory", os.path.join(self.folder, "other")),
+            ("model", "input_shape", [64, 64, 3]),
+        ]:
+            config = dict(self.config)
+            config[section] = dict(config[section], **{name: value})
+            meta = embeddings.get_store_meta(config, self.class_names)
+            with self.assertRaises(ValueError):
+                embeddings.store_exists(directory, meta)
+
+    def test_pipeline_augment(self):
+        # Rotations always change the pooled image corners
+        self.config["model"]["data_aug_layer"] = {
+            "random_rotation": {"factor": [0.25, 0.25]}
+        }
+        self.config["features"]["augmented_copies"] = 1
+        inputs = keras.layers.Input(shape=(32, 32, 3))
+        outputs = keras.layers.Flatten()(keras.layers.AveragePooling2D(16)(inputs))
+        feature_extractor = keras.Model(inputs, outputs)
+
+        embeddings.extract_features(self.config, self.class_names, feature_extractor)
+        directory = self.config["features"]["directory"]
+        expected = np.load(os.path.join(directory, "training_features.npy"))
+
+        # Augmenting in the input pipeline doesn't change the stored features,
+        # the first copy is still clean and the others augmented once
+        config = dict(self.config)
+        config["data"] = dict(config["data"], pipeline={"augment": True})
+        config["features"] = dict(
+            config["features"], directory=os.path.join(self.folder, "pipeline")
+        )
+        embeddings.extract_features(config, self.class_names, feature_extractor)
+        features = np.load(
+            os.path.join(self.folder, "pipeline", "training_features.npy")
+        )
+        self.assertFalse(np.allclose(expected[:2], expected[2:]))
+        self.assertTrue(np.allclose(features, expected, atol=1e-4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import tensorflow as tf
+import yaml
+from tensorflow import keras
+
+from models import export, resnet_50
+from scripts import export_model, quantize_model
+from utils import class_index, utils
+from utils.data_aug import create_data_aug_layer
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        # Small stand-in for a trained model, with the same layers as
+        # `resnet_50.create_model()` builds
+        keras.utils.set_random_seed(123)
+        base_input = keras.Input((None, None, 3))
+        x = keras.layers.Conv2D(4, 3)(base_input)
+        x = keras.layers.GlobalAveragePooling2D()(x)
+        base_model = keras.Model(base_input, x, name="resnet50")
+        input = keras.Input((32, 32, 3))
+        x = create_data_aug_layer({"random_flip": {"mode": "horizontal"}})(input)
+        x = keras.applications.resnet50.preprocess_input(x)
+        x = base_model(x)
+        x = keras.layers.Dropout(0.5)(x)
+        outputs = keras.layers.Dense(3, activation="softmax")(x)
+        self.model = keras.Model(input, outputs)
+
+        self.class_names = ["class_a", "class_b", "class_c"]
+        self.weights = os.path.join(self.folder, "model", "model.01-1.0000.h5")
+        os.makedirs(os.path.dirname(self.weights))
+        self.model.save(self.weights)
+        class_index.save_class_index(self.weights, self.class_names)
+
+        self.images = tf.random.uniform((5, 32, 32, 3), 0, 255, seed=1).numpy()
+        self.expected = self.model(self.images, training=False).numpy()
+
+    def test_create_inference_model(self):
+        inference_model = resnet_50.create_inference_model(self.model)
+        layer_types = [type(layer) for layer in inference_model.layers]
+        self.assertNotIn(keras.Sequential, layer_types)
+        self.assertNotIn(keras.layers.Dropout, layer_types)
+        self.assertTrue(
+            np.allclose(inference_model(self.images), self.expected, atol=1e-6)
+        )
+
+    def test_export_model(self):
+        output_folder = os.path.join(self.folder, "export")
+        export_model.main(self.weights, output_folder, tflite="none")
+
+        # SavedModel serving signature
+        saved_model = tf.saved_model.load(os.path.join(output_folder, "saved_model"))
+        serve = saved_model.signatures["serving_default"]
+        scores = serve(images=tf.constant(self.images))["scores"].numpy()
+        self.assertTrue(np.allclose(scores, self.expected, atol=1e-5))
+
+        # TFLite model, on batches of any size
+        tflite_model = export.TFLiteModel(
+            os.path.join(output_folder, "model_none.tflite")
+        )
+        self.assertTrue(
+            np.allclose(tflite_model(self.images), self.expected, atol=1e-5)
+        )
+        self.assertTrue(
+            np.allclose(tflite_model(self.images[:2]), self.expected[:2], atol=1e-5)
+        )
+
+        # Exported models keep the class index
+        for folder in (output_folder, os.path.join(output_folder, "saved_model")):
+            self.assertEqual(utils.get_model_class_names(folder), self.class_names)
+
+        with self.assertRaises(ValueError):
+            export.convert_to_tflite(
+                os.path.join(output_folder, "saved_model"),
+                os.path.join(output_folder, "model.tflite"),
+                quantization="float8",
+            )
+
+    def create_dataset(self):
+        """
+        Tiny dataset with the model classes, used for calibration and test.
+        Returns its folder and an experiment config file using it.
+        """
+        data_folder = os.path.join(self.folder, "data")
+        test_images = {
+            "class_a": ["005652.jpg", "008773.jpg"],
+            "class_b": ["012310.jpg"],
+            "class_c": ["cat.jpeg"],
+        }
+        for class_name, filenames in test_images.items():
+            os.makedirs(os.path.join(data_folder, class_name))
+            for filename in filenames:
+                shutil.copy(
+                    os.path.join("tests/test_data", filename),
+                    os.path.join(data_folder, class_name, filename),
+                )
+        config_file = os.path.join(self.folder, "config.yml")
+        with open(config_file, "w") as f:
+            yaml.safe_dump(
+                {
+                    "seed": 123,
+                    "data": {
+                        "directory": data_folder,
+                        "validation_split": 0.5,
+                        "image_size": [32, 32],
+                    },
+                },
+                f,
+            )
+
+        return data_folder, config_file
+
+    def test_quantize_model(self):
+        data_folder, config_file = self.create_dataset()
+
+        output_folder = os.path.join(self.folder, "int8")
+        quantize_model.main(
+            config_file, self.weights, data_folder, output_folder, batch_size=3
+        )
+
+        # Weights and activations are int8, inputs and outputs stay float32
+        tflite_path = os.path.join(output_folder, "model_int8.tflite")
+        int8_model = export.TFLiteModel(tflite_path)
+        tensor_types = {
+            detail["dtype"] for detail in int8_model.interpreter.get_tensor_details()
+        }
+        self.assertIn(np.int8, tensor_types)
+        images = np.stack(
+            [
+                utils.load_image_array(os.path.join(dirpath, filename), (32, 32))
+                for dirpath, filename in utils.walkdir(data_folder)
+            ]
+        )
+        scores = int8_model(images)
+        self.assertEqual(scores.dtype, np.float32)
+        expected = self.model(images, training=False).numpy()
+        self.assertTrue(np.allclose(scores, expected, atol=0.05))
+
+        # The TFLite model runs through `predict_from_folder()` like Keras
+        predictions, labels = utils.predict_from_folder(
+            data_folder, int8_model, (32, 32), self.class_names, batch_size=3
+        )
+        float_predictions, float_labels = utils.predict_from_folder(
+            data_folder, self.model, (32, 32), self.class_names, batch_size=3
+        )
+        self.assertEqual(predictions, float_predictions)
+        self.assertEqual(labels, float_labels)
+
+        with open(os.path.join(output_folder, "quantization_report.json")) as f:
+            report = json.load(f)
+        for name in ("float32", "int8"):
+            self.assertEqual(
+                sorted(report[name]["per_class_accuracy"]), self.class_names
+            )
+            self.assertGreater(report[name]["images_per_sec"], 0)
+        # Sizes of the TFLite files, the stand-in model is too small for
+        # int8 weights to make up for the quantization parameters
+        for name in ("float32", "int8"):
+            tflite_path = os.path.join(output_folder, "model_{}.tflite".format(name))
+            self.assertEqual(
+                report[name]["size_mb"], os.path.getsize(tflite_path) / 2**20
+            )
+        self.assertEqual(utils.get_model_class_names(output_folder), self.class_names)
+
+    def test_legacy_class_order(self):
+        # Model trained before the class index existed, with its classes in
+        # the unsorted `os.listdir()` order
+        os.remove(class_index.get_class_index_path(self.weights))
+        data_folder, config_file = self.create_dataset()
+        legacy_names = ["class_c", "class_a", "class_b"]
+
+        with mock.patch.object(
+            utils, "get_legacy_class_names", return_value=legacy_names
+        ):
+            output_folder = os.path.join(self.folder, "export")
+            export_model.main(
+                self.weights, output_folder, tflite="none", config_file=config_file
+            )
+            int8_folder = os.path.join(self.folder, "int8")
+            quantize_model.main(
+                config_file, self.weights, data_folder, int8_folder, batch_size=3
+            )
+
+        for folder in (
+            output_folder,
+            os.path.join(output_folder, "saved_model"),
+            int8_folder,
+        ):
+            index = class_index.load_class_index(folder)
+            self.assertEqual(index["class_names"], legacy_names)
+            self.assertTrue(index["legacy_order"])
+
+        # Indexes of exported models are copied with their flag
+        utils.copy_class_index(output_folder, [os.path.join(self.folder, "copy")])
+        self.assertEqual(
+            utils.get_model_class_names(os.path.join(self.folder, "copy")),
+            legacy_names,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
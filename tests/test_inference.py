@@ -0,0 +1,127 @@
+import threading
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.inference import DetectClassifyPipeline, crop_and_resize
+
+
+def fake_detection(imgs, batch_size=4):
+    # Left half of each image is the "vehicle"
+    return [(0, 0, img.shape[1] // 2, img.shape[0]) for img in imgs]
+
+
+def fake_classifier(img_batch):
+    # First class when the image is dark, second one otherwise
+    bright = (img_batch.mean(axis=(1, 2, 3)) > 100).astype(np.float32)
+    return np.stack([1 - bright, bright], axis=1)
+
+
+class TestDetectClassifyPipeline(unittest.TestCase):
+    def test_crop_and_resize(self):
+        img = cv2.imread("tests/test_data/012310.jpg")
+        crop = crop_and_resize(img, (72, 106, 572, 359), (64, 96))
+        self.assertEqual(crop.shape, (64, 96, 3))
+        self.assertEqual(crop.dtype, np.float32)
+        # Same pixels as cropping and resizing the RGB picture
+        expected = (
+            Image.open("tests/test_data/012310.jpg")
+            .crop((72, 106, 572, 359))
+            .resize((96, 64), Image.NEAREST)
+        )
+        self.assertLess(np.abs(crop - np.asarray(expected)).mean(), 1)
+
+    @mock.patch(
+        "utils.detection.get_vehicle_coordinates_batch", side_effect=fake_detection
+    )
+    def test_predict(self, _):
+        imgs = [np.full((40, 60, 3), 255 * (i % 2), dtype=np.uint8) for i in range(10)]
+        pipeline = DetectClassifyPipeline(
+            fake_classifier,
+            ["dark", "bright"],
+            (32, 32),
+            detect_batch_size=3,
+            classify_batch_size=4,
+        )
+        results = list(pipeline.predict(iter(imgs)))
+
+        # Same order as the input images
+        self.assertEqual(len(results), 10)
+        for i, result in enumerate(results):
+            self.assertEqual(result["box"], (0, 0, 30, 40))
+            self.assertEqual(result["class_name"], ["dark", "bright"][i % 2])
+
+        report = pipeline.latency_report()
+        self.assertSetEqual(set(report), {"detection", "classification", "end_to_end"})
+
+    @mock.patch(
+        "utils.detection.get_vehicle_coordinates_batch",
+        side_effect=ValueError("Detector failed"),
+    )
+    def test_predict_errors(self, _):
+        pipeline = DetectClassifyPipeline(fake_classifier, ["a", "b"], (32, 32))
+        with self.assertRaises(ValueError):
+            list(pipeline.predict([np.zeros((40, 60, 3), dtype=np.uint8)]))
+
+    def run_with_timeout(self, target, timeout=30):
+        """
+        Runs `target` in a thread and fails if it doesn't finish in time.
+        Returns the error it raised, if any.
+        """
+        errors = []
+
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), "The pipeline never returned")
+
+        return errors[0] if errors else None
+
+    @mock.patch(
+        "utils.detection.get_vehicle_coordinates_batch", side_effect=fake_detection
+    )
+    def test_classifier_errors(self, _):
+        def failing_classifier(img_batch):
+            raise ValueError("Classifier failed")
+
+        # More images than fit in the queues, the detector would block on
+        # them once the classifier is gone
+        imgs = [np.zeros((40, 60, 3), dtype=np.uint8) for _ in range(50)]
+        pipeline = DetectClassifyPipeline(
+            failing_classifier, ["a", "b"], (32, 32), queue_size=2
+        )
+        num_threads = threading.active_count()
+        error = self.run_with_timeout(lambda: list(pipeline.predict(iter(imgs))))
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual(threading.active_count(), num_threads)
+
+    @mock.patch(
+        "utils.detection.get_vehicle_coordinates_batch", side_effect=fake_detection
+    )
+    def test_stop_reading(self, _):
+        imgs = [np.zeros((40, 60, 3), dtype=np.uint8) for _ in range(50)]
+        pipeline = DetectClassifyPipeline(
+            fake_classifier, ["dark", "bright"], (32, 32), queue_size=2
+        )
+        num_threads = threading.active_count()
+
+        def read_first():
+            results = pipeline.predict(iter(imgs))
+            self.assertEqual(next(results)["class_name"], "dark")
+            results.close()
+
+        self.assertIsNone(self.run_with_timeout(read_first))
+        self.assertEqual(threading.active_count(), num_threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
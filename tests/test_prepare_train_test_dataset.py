@@ -0,0 +1,89 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from scripts import prepare_train_test_dataset as prepare
+
+
+class TestPrepareTrainTestDataset(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        self.data_folder = os.path.join(self.folder, "car_ims")
+        os.makedirs(self.data_folder)
+        for filename in ["005652.jpg", "008773.jpg", "012310.jpg"]:
+            shutil.copy(
+                os.path.join("tests/test_data", filename),
+                os.path.join(self.data_folder, filename),
+            )
+
+        self.labels = os.path.join(self.folder, "car_dataset_labels.csv")
+        with open(self.labels, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["img_name", "class", "subset"])
+            writer.writerow(["005652.jpg", "Jeep Patriot SUV 2012", "train"])
+            writer.writerow(["008773.jpg", "Jeep Patriot SUV 2012", "test"])
+            writer.writerow(["012310.jpg", "Acura TL Sedan 2012", "train"])
+            # Repeated row and an image missing from the data folder
+            writer.writerow(["005652.jpg", "Jeep Patriot SUV 2012", "train"])
+            writer.writerow(["000001.jpg", "Acura TL Sedan 2012", "test"])
+
+        self.output_folder = os.path.join(self.folder, "car_ims_v1")
+
+    def test_plan(self):
+        work = prepare.plan(self.data_folder, self.labels, self.output_folder)
+        self.assertEqual(
+            work["folders"],
+            [
+                os.path.join(self.output_folder, "test", "Jeep Patriot SUV 2012"),
+                os.path.join(self.output_folder, "train", "Acura TL Sedan 2012"),
+                os.path.join(self.output_folder, "train", "Jeep Patriot SUV 2012"),
+            ],
+        )
+        self.assertEqual(len(work["files"]), 3)
+        self.assertEqual(work["existing"], 0)
+        self.assertEqual(work["missing"], ["000001.jpg"])
+        self.assertEqual(work["subsets"], {"train": 2, "test": 1})
+
+    def test_modes(self):
+        for mode in prepare.MODES:
+            with self.subTest(mode=mode):
+                output_folder = os.path.join(self.folder, mode)
+                prepare.main(self.data_folder, self.labels, output_folder, mode=mode)
+
+                src = os.path.join(self.data_folder, "005652.jpg")
+                dst = os.path.join(
+                    output_folder, "train", "Jeep Patriot SUV 2012", "005652.jpg"
+                )
+                with open(src, "rb") as src_f, open(dst, "rb") as dst_f:
+                    self.assertEqual(src_f.read(), dst_f.read())
+                self.assertEqual(os.path.islink(dst), mode == "symlink")
+                self.assertEqual(
+                    os.stat(dst, follow_symlinks=False).st_ino == os.stat(src).st_ino,
+                    mode == "link",
+                )
+
+                # Images already in place are skipped on a second run
+                work = prepare.main(
+                    self.data_folder, self.labels, output_folder, mode=mode
+                )
+                self.assertEqual(work["files"], [])
+                self.assertEqual(work["folders"], [])
+                self.assertEqual(work["existing"], 3)
+
+    def test_dry_run(self):
+        work = prepare.main(
+            self.data_folder, self.labels, self.output_folder, dry_run=True
+        )
+        self.assertEqual(len(work["files"]), 3)
+        self.assertFalse(os.path.exists(self.output_folder))
+
+        with self.assertRaises(ValueError):
+            prepare.main(self.data_folder, self.labels, self.output_folder, mode="move")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from utils import data_pipeline, utils
+from utils.preprocess_cache import PreprocessCache
+
+
+class TestPreprocessCache(unittest.TestCase):
+    def setUp(self):
+        # Build a tiny dataset with two classes from the test images
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        test_images = {
+            "class_a": ["005652.jpg", "008773.jpg"],
+            "class_b": ["012310.jpg", "cat.jpeg"],
+        }
+        self.paths = []
+        for class_name, filenames in test_images.items():
+            os.makedirs(os.path.join(self.folder, "data", class_name))
+            for filename in filenames:
+                path = os.path.join(self.folder, "data", class_name, filename)
+                shutil.copy(os.path.join("tests/test_data", filename), path)
+                self.paths.append(path)
+        self.cache_dir = os.path.join(self.folder, "cache")
+
+    def test_update(self):
+        cache = PreprocessCache(self.cache_dir, (32, 48))
+        self.addCleanup(cache.close)
+        rows = cache.update(self.paths)
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.images.shape, (4, 32, 48, 3))
+        self.assertEqual(cache.images.dtype, np.uint8)
+
+        # Nothing new to decode, same rows
+        self.assertTrue(np.array_equal(cache.update(self.paths), rows))
+        self.assertEqual(len(cache), 4)
+
+        # Copies of the same image share the entry, crops get their own
+        copy_path = os.path.join(self.folder, "copy.jpg")
+        shutil.copy(self.paths[0], copy_path)
+        new_rows = cache.update([copy_path, self.paths[0]], [None, (0, 0, 20, 10)])
+        self.assertEqual(new_rows[0], rows[0])
+        self.assertEqual(new_rows[1], 4)
+
+        # Changed images get a new entry
+        shutil.copy(self.paths[2], copy_path)
+        os.utime(copy_path, ns=(0, 0))
+        self.assertEqual(cache.update([copy_path])[0], rows[2])
+
+        # Same content as loading with the data pipeline
+        img = data_pipeline.load_image(self.paths[3], (32, 48)).numpy()
+        self.assertLessEqual(np.abs(img - cache.images[rows[3]]).max(), 0.5)
+
+        # Other processes see the same entries
+        other = PreprocessCache(self.cache_dir, (32, 48))
+        self.addCleanup(other.close)
+        self.assertTrue(np.array_equal(other.update(self.paths), rows))
+
+    def test_build_dataset(self):
+        config = {
+            "seed": 123,
+            "data": {
+                "directory": os.path.join(self.folder, "data"),
+                "label_mode": "categorical",
+                "validation_split": 0.5,
+                "image_size": [32, 48],
+                "batch_size": 2,
+                "pipeline": {"preprocess_cache": self.cache_dir},
+            },
+        }
+        class_names = ["class_a", "class_b"]
+        cached_ds = data_pipeline.build_dataset(config, "validation", class_names)
+        del config["data"]["pipeline"]
+        decoded_ds = data_pipeline.build_dataset(config, "validation", class_names)
+
+        for (cached, cached_labels), (decoded, labels) in zip(cached_ds, decoded_ds):
+            self.assertEqual(cached.shape, decoded.shape)
+            self.assertLessEqual(np.abs(cached - decoded).max(), 0.5)
+            self.assertTrue(np.array_equal(cached_labels, labels))
+
+    def test_pil_decoder(self):
+        cache = PreprocessCache(
+            self.cache_dir, (32, 48), interpolation="nearest", decoder="pil"
+        )
+        self.addCleanup(cache.close)
+        rows = cache.update(self.paths)
+
+        # Same pixels as the images loaded by `predict_from_folder()`
+        for path, row in zip(self.paths, rows):
+            img = utils.load_image_array(path, (32, 48))
+            self.assertTrue(np.array_equal(cache.images[row], img))
+
+        # Crops are resized the same way
+        row = cache.update([self.paths[0]], [(10, 5, 60, 40)])[0]
+        img = tf.keras.utils.load_img(self.paths[0]).crop((10, 5, 60, 40))
+        img = tf.keras.utils.img_to_array(img.resize((48, 32), Image.NEAREST))
+        self.assertTrue(np.array_equal(cache.images[row], img))
+
+        # Kept apart from the TensorFlow decoded images
+        tf_cache = PreprocessCache(self.cache_dir, (32, 48), interpolation="nearest")
+        self.addCleanup(tf_cache.close)
+        self.assertEqual(len(tf_cache), 0)
+
+        with self.assertRaises(ValueError):
+            PreprocessCache(self.cache_dir, (32, 48), decoder="cv2")
+
+    def test_predict_from_folder(self):
+        cache = PreprocessCache(
+            self.cache_dir, (32, 48), interpolation="nearest", decoder="pil"
+        )
+        self.addCleanup(cache.close)
+
+        images = []
+
+        def model(img_batch):
+            # Keep the images sent to the model, scores are random
+            images.extend(img_batch)
+            return np.random.rand(len(img_batch), 2).astype(np.float32)
+
+        predictions, labels = utils.predict_from_folder(
+            os.path.join(self.folder, "data"),
+            model,
+            (32, 48),
+            ["a", "b"],
+            batch_size=3,
+            preprocess_cache=cache,
+        )
+        self.assertEqual(len(predictions), 4)
+        self.assertEqual(sorted(labels), ["class_a"] * 2 + ["class_b"] * 2)
+        self.assertEqual(len(cache), 4)
+
+        # The model gets exactly the same images as decoding them every time
+        _, uncached_labels = utils.predict_from_folder(
+            os.path.join(self.folder, "data"),
+            model,
+            (32, 48),
+            ["a", "b"],
+            batch_size=3,
+        )
+        self.assertEqual(labels, uncached_labels)
+        self.assertEqual(len(images), 8)
+        for cached, uncached in zip(images[:4], images[4:]):
+            self.assertEqual(cached.dtype, uncached.dtype)
+            self.assertTrue(np.array_equal(cached, uncached))
+
+        tf_cache = PreprocessCache(self.cache_dir, (32, 48), interpolation="nearest")
+        self.addCleanup(tf_cache.close)
+        with self.assertRaises(ValueError):
+            utils.predict_from_folder(
+                self.folder, model, (32, 48), ["a", "b"], preprocess_cache=tf_cache
+            )
+        with self.assertRaises(ValueError):
+            utils.predict_from_folder(
+                self.folder, model, (64, 64), ["a", "b"], preprocess_cache=cache
+            )
+        with self.assertRaises(ValueError):
+            utils.predict_from_folder(
+                self.folder,
+                model,
+                (32, 48),
+                ["a", "b"],
+                preprocess_cache=cache,
+                interpolation="bilinear",
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
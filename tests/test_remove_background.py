@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from scripts import remove_background
+
+# Height of the image the failing detector can't process
+BAD_HEIGHT = 99
+
+
+def init_stub_detector(detection_cache=None, vehicle_classes=None):
+    pass
+
+
+def stub_detect_batch(imgs):
+    """
+    Stand-in for the vehicle detector, keeps the top half of each image.
+    """
+    return [(0, 0, img.shape[1], img.shape[0] // 2) for img in imgs]
+
+
+def failing_detect_batch(imgs):
+    if any(img.shape[0] == BAD_HEIGHT for img in imgs):
+        raise RuntimeError("Detector failed")
+
+    return stub_detect_batch(imgs)
+
+
+class TestRemoveBackground(unittest.TestCase):
+    def setUp(self):
+        # Images with different heights, so the output tells them apart
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.data_folder = os.path.join(self.folder, "data")
+        self.output_folder = os.path.join(self.folder, "output")
+        self.heights = {}
+        for index in range(8):
+            class_name = "class_a" if index % 2 else "class_b"
+            rel_path = os.path.join("train", class_name, "{}.png".format(index))
+            self.heights[rel_path] = 20 + 2 * index
+            self.write_image(rel_path, self.heights[rel_path])
+
+        patcher = mock.patch.multiple(
+            remove_background,
+            init_detector=init_stub_detector,
+            detect_batch=stub_detect_batch,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_image(self, rel_path, height):
+        path = os.path.join(self.data_folder, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, np.full((height, 16, 3), 128, dtype=np.uint8))
+
+    def run_main(self, **kwargs):
+        """
+        Runs the script in a thread, so a deadlock fails the test instead
+        of hanging it.
+        """
+        errors = []
+
+        def target():
+            try:
+                remove_background.main(
+                    self.data_folder,
+                    self.output_folder,
+                    workers=1,
+                    batch_size=2,
+                    queue_size=2,
+                    **kwargs
+                )
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout=60)
+        self.assertFalse(thread.is_alive(), "remove_background didn't finish")
+
+        return errors
+
+    def read_output(self, rel_path):
+        return cv2.imread(os.path.join(self.output_folder, rel_path))
+
+    def test_main(self):
+        self.assertListEqual(self.run_main(), [])
+
+        manifest = remove_background.load_manifest(self.output_folder)
+        self.assertSetEqual(manifest, set(self.heights))
+        for rel_path, height in self.heights.items():
+            self.assertEqual(self.read_output(rel_path).shape, (height // 2, 16, 3))
+
+    def test_resume(self):
+        # A previous run already processed half of the images
+        done = sorted(self.heights)[:4]
+        os.makedirs(self.output_folder)
+        with open(
+            os.path.join(self.output_folder, remove_background.MANIFEST_FILENAME), "w"
+        ) as f:
+            for rel_path in done:
+                f.write(rel_path + "\n")
+                path = os.path.join(self.output_folder, rel_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                cv2.imwrite(path, np.zeros((1, 1, 3), dtype=np.uint8))
+
+        self.assertListEqual(self.run_main(), [])
+
+        # Processed images are kept, the others are cropped
+        for rel_path, height in self.heights.items():
+            shape = (1, 1, 3) if rel_path in done else (height // 2, 16, 3)
+            self.assertEqual(self.read_output(rel_path).shape, shape)
+
+        with open(
+            os.path.join(self.output_folder, remove_background.MANIFEST_FILENAME)
+        ) as f:
+            self.assertListEqual(sorted(f.read().split()), sorted(self.heights))
+
+    def test_detector_errors(self):
+        bad_path = os.path.join("train", "class_a", "bad.png")
+        self.write_image(bad_path, BAD_HEIGHT)
+
+        with mock.patch.object(remove_background, "detect_batch", failing_detect_batch):
+            errors = self.run_main()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], RuntimeError)
+
+        manifest = remove_background.load_manifest(self.output_folder)
+        self.assertNotIn(bad_path, manifest)
+
+        # Running again resumes with the images left
+        os.remove(os.path.join(self.data_folder, bad_path))
+        self.assertListEqual(self.run_main(), [])
+        self.assertSetEqual(
+            remove_background.load_manifest(self.output_folder), set(self.heights)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 
 from tensorflow import keras
 
-from models.resnet_50 import create_model
+from models.resnet_50 import create_model, set_trainable_from
 
 
 class TestResnet50(unittest.TestCase):
@@ -129,6 +129,58 @@ class TestResnet50(unittest.TestCase):
             msg="Incorrect RandomRotation parameters",
         )
 
+    def test_create_model_mixed_precision(self):
+        model = create_model(
+            weights="imagenet",
+            input_shape=(128, 128, 3),
+            classes=10,
+            dtype_policy="mixed_bfloat16",
+        )
+
+        # Resnet50 base computes in bfloat16
+        resnet50 = model.get_layer("resnet50")
+        self.assertEqual(resnet50.compute_dtype, "bfloat16")
+
+        # Output layer must stay in float32
+        output_layer = model.layers[-1]
+        self.assertEqual(output_layer.compute_dtype, "float32")
+        self.assertEqual(model.output.dtype, "float32")
+
+        # Global policy is restored after building the model
+        self.assertEqual(keras.mixed_precision.global_policy().name, "float32")
+
+    def test_set_trainable_from(self):
+        # Small stand-in for the Resnet50 base, with the same layer names
+        base_input = keras.Input((None, None, 3))
+        x = keras.layers.Conv2D(4, 3, name="conv1_conv")(base_input)
+        x = keras.layers.BatchNormalization(name="conv1_bn")(x)
+        x = keras.layers.Conv2D(4, 3, name="conv5_block1_1_conv")(x)
+        x = keras.layers.BatchNormalization(name="conv5_block1_1_bn")(x)
+        x = keras.layers.GlobalAveragePooling2D(name="avg_pool")(x)
+        base_model = keras.Model(base_input, x, name="resnet50")
+        input = keras.Input((32, 32, 3))
+        outputs = keras.layers.Dense(2, name="head")(base_model(input))
+        model = keras.Model(input, outputs)
+
+        def trainable_names():
+            layers = base_model.layers + [model.get_layer("head")]
+            return [layer.name for layer in layers if layer.trainable_weights]
+
+        set_trainable_from(model, "head")
+        self.assertEqual(trainable_names(), ["head"])
+
+        set_trainable_from(model, "conv5_block1")
+        self.assertEqual(trainable_names(), ["conv5_block1_1_conv", "head"])
+
+        # BatchNormalization layers stay frozen unless asked
+        set_trainable_from(model, "all")
+        self.assertNotIn("conv1_bn", trainable_names())
+        set_trainable_from(model, "all", freeze_batch_norm=False)
+        self.assertIn("conv1_bn", trainable_names())
+
+        with self.assertRaises(ValueError):
+            set_trainable_from(model, "conv6")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from utils.schedule import (
+    get_fit_args,
+    get_stage_config,
+    has_variable_image_size,
+    parse_schedule,
+)
+
+
+class TestSchedule(unittest.TestCase):
+    def test_no_schedule(self):
+        stages = parse_schedule({"epochs": 5})
+        self.assertEqual(stages, [{"initial_epoch": 0, "epochs": 5}])
+        self.assertFalse(has_variable_image_size(stages, [224, 224]))
+
+        fit_args = get_fit_args({"epochs": 5, "verbose": 2}, stages[0])
+        self.assertEqual(fit_args, {"epochs": 5, "initial_epoch": 0, "verbose": 2})
+
+    def test_parse_schedule(self):
+        fit_config = {
+            "epochs": 10,
+            "schedule": [
+                {"epochs": 3, "image_size": [128, 128], "batch_size": 64},
+                {"epochs": 3, "image_size": [176, 176]},
+                {"image_size": [224, 224], "trainable_from": "conv5_block1"},
+            ],
+        }
+        stages = parse_schedule(fit_config)
+        self.assertEqual(
+            [(s["initial_epoch"], s["epochs"]) for s in stages],
+            [(0, 3), (3, 6), (6, 10)],
+        )
+        self.assertEqual(stages[0]["batch_size"], 64)
+        self.assertNotIn("batch_size", stages[1])
+        self.assertEqual(stages[2]["trainable_from"], "conv5_block1")
+        self.assertTrue(has_variable_image_size(stages, [224, 224]))
+
+        fit_args = get_fit_args(fit_config, stages[1])
+        self.assertNotIn("schedule", fit_args)
+        self.assertEqual(fit_args["initial_epoch"], 3)
+        self.assertEqual(fit_args["epochs"], 6)
+
+    def test_invalid_schedule(self):
+        with self.assertRaises(ValueError):
+            parse_schedule({"epochs": 4, "schedule": [{"epochs": 5}]})
+        with self.assertRaises(ValueError):
+            parse_schedule({"epochs": 4, "schedule": [{}, {"epochs": 2}]})
+        with self.assertRaises(ValueError):
+            parse_schedule({"epochs": 4, "schedule": [{"learning_rate": 0.1}]})
+
+    def test_get_stage_config(self):
+        config = {
+            "data": {"image_size": [224, 224], "batch_size": 32},
+            "model": {"classes": 2, "data_aug_layer": {"random_flip": {}}},
+            "fit": {"epochs": 4},
+        }
+        stage = {
+            "initial_epoch": 0,
+            "epochs": 2,
+            "image_size": [128, 128],
+            "data_aug_layer": {},
+        }
+        stage_config = get_stage_config(config, stage)
+        self.assertEqual(stage_config["data"]["image_size"], [128, 128])
+        self.assertEqual(stage_config["data"]["batch_size"], 32)
+        self.assertEqual(stage_config["model"]["data_aug_layer"], {})
+
+        # The experiment config is left as is
+        self.assertEqual(config["data"]["image_size"], [224, 224])
+        self.assertEqual(config["model"]["data_aug_layer"], {"random_flip": {}})
+
+
+if __name__ == "__main__":
+    unittest.main()
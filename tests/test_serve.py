@@ -0,0 +1,171 @@
+import asyncio
+import http.client
+import json
+import socket
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from tensorflow import keras
+
+from scripts import serve
+
+
+def stub_detect_batch(self, imgs):
+    """
+    Stand-in for the vehicle detector, keeps the left half of each image.
+    """
+    return [(0, 0, img.shape[1] // 2, img.shape[0]) for img in imgs]
+
+
+class TestInferenceServer(unittest.TestCase):
+    def setUp(self):
+        keras.utils.set_random_seed(123)
+        self.class_names = ["class_a", "class_b", "class_c"]
+        self.model = keras.Sequential(
+            [
+                keras.layers.Input((32, 32, 3)),
+                keras.layers.Rescaling(1 / 255),
+                keras.layers.Conv2D(4, 3),
+                keras.layers.GlobalAveragePooling2D(),
+                keras.layers.Dense(3, activation="softmax"),
+            ]
+        )
+        with open("tests/test_data/012310.jpg", "rb") as f:
+            self.image = f.read()
+
+        with mock.patch.object(
+            serve.InferenceServer, "detect_batch", stub_detect_batch
+        ):
+            self.server = serve.InferenceServer(
+                self.model, self.class_names, (32, 32), max_wait_ms=1, top_k=2
+            )
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+
+        # Run the server in its own event loop until the test cancels it
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.server.serve("127.0.0.1", self.port))
+        self.thread = threading.Thread(target=self.run_server, daemon=True)
+        self.thread.start()
+        self.addCleanup(self.loop.close)
+        self.addCleanup(self.stop_server)
+        self.wait_server()
+
+    def run_server(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+
+    def wait_server(self):
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port)).close()
+                return
+            except ConnectionRefusedError:
+                self.thread.join(timeout=0.05)
+        self.fail("Server didn't start")
+
+    def stop_server(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join(timeout=10)
+        self.assertFalse(self.thread.is_alive(), "Server didn't stop")
+
+    def request(self, method, path, body=None, conn=None):
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+            self.addCleanup(conn.close)
+        conn.request(method, path, body=body)
+        response = conn.getresponse()
+
+        return response.status, json.loads(response.read())
+
+    def expected_scores(self, box_coordinates=None):
+        img = serve.decode_image(self.image, (32, 32), box_coordinates)
+        return self.model.predict(img[None], verbose=0)[0]
+
+    def test_routes(self):
+        self.assertEqual(self.request("GET", "/health"), (200, {"status": "ok"}))
+        status, payload = self.request("GET", "/unknown")
+        self.assertEqual(status, 404)
+        status, payload = self.request("GET", "/predict")
+        self.assertEqual(status, 405)
+
+    def test_predict(self):
+        status, payload = self.request("POST", "/predict", self.image)
+        self.assertEqual(status, 200)
+
+        # Top-k classes, best first, same scores as Keras
+        scores = self.expected_scores()
+        top_idxs = np.argsort(scores)[::-1][:2]
+        predictions = payload["predictions"]
+        self.assertListEqual(
+            [p["class_name"] for p in predictions],
+            [self.class_names[i] for i in top_idxs],
+        )
+        np.testing.assert_allclose(
+            [p["score"] for p in predictions], scores[top_idxs], rtol=1e-5
+        )
+
+        status, payload = self.request("POST", "/predict?top_k=3", self.image)
+        self.assertEqual(len(payload["predictions"]), 3)
+
+    def test_predict_crop(self):
+        status, payload = self.request("POST", "/predict_crop", self.image)
+        self.assertEqual(status, 200)
+
+        # The detector gets the decoded image, the classifier its crop
+        width, height = 640, 440
+        self.assertListEqual(payload["box"], [0, 0, width // 2, height])
+        scores = self.expected_scores(payload["box"])
+        np.testing.assert_allclose(
+            [p["score"] for p in payload["predictions"]],
+            np.sort(scores)[::-1][:2],
+            rtol=1e-5,
+        )
+
+    def test_errors(self):
+        status, payload = self.request("POST", "/predict", b"not an image")
+        self.assertEqual(status, 400)
+        self.assertIn("error", payload)
+        status, payload = self.request("POST", "/predict?top_k=two", self.image)
+        self.assertEqual(status, 400)
+        status, payload = self.request("POST", "/predict_crop", b"not an image")
+        self.assertEqual(status, 400)
+
+        # Unexpected errors don't stop the server
+        with mock.patch.object(
+            self.server, "predict_step", side_effect=RuntimeError("Model failed")
+        ):
+            status, payload = self.request("POST", "/predict", self.image)
+        self.assertEqual((status, payload), (500, {"error": "Model failed"}))
+        self.assertEqual(self.request("POST", "/predict", self.image)[0], 200)
+
+    def test_keep_alive(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        self.addCleanup(conn.close)
+        for _ in range(3):
+            status, _ = self.request("POST", "/predict", self.image, conn=conn)
+            self.assertEqual(status, 200)
+
+        # A malformed request closes the connection without an answer
+        with socket.create_connection(("127.0.0.1", self.port), timeout=10) as s:
+            s.sendall(b"garbage\r\n\r\n")
+            self.assertEqual(s.recv(1024), b"")
+
+    def test_shutdown(self):
+        self.stop_server()
+
+        # Batchers are stopped and the port is released
+        self.assertTrue(self.server.classifier._task.done())
+        self.assertTrue(self.server.detector._task.done())
+        with self.assertRaises(ConnectionRefusedError):
+            socket.create_connection(("127.0.0.1", self.port), timeout=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
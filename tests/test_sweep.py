@@ -0,0 +1,268 @@
+import csv
+import os
+import random
+import shutil
+import tempfile
+import textwrap
+import unittest
+from unittest import mock
+
+import yaml
+
+from scripts import sweep as sweep_script
+from utils.sweep import (
+    AsyncSuccessiveHalving,
+    create_trial_config,
+    get_rungs,
+    parse_sweep_config,
+    read_metric,
+    sample_params,
+    truncate_schedule,
+    write_leaderboard,
+)
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_parse_sweep_config(self):
+        sweep_config = parse_sweep_config({"space": {"a": {"uniform": [0, 1]}}})
+        self.assertEqual(sweep_config["metric"], "val_accuracy")
+        self.assertEqual(sweep_config["mode"], "max")
+
+        with self.assertRaises(ValueError):
+            parse_sweep_config({})
+        with self.assertRaises(ValueError):
+            parse_sweep_config({"space": {"a": {"normal": [0, 1]}}})
+        with self.assertRaises(ValueError):
+            parse_sweep_config({"space": {"a": {"uniform": [0, 1]}}, "min_epochs": 0})
+        with self.assertRaises(ValueError):
+            parse_sweep_config(
+                {"space": {"a": {"uniform": [0, 1]}}, "reduction_factor": 1}
+            )
+
+    def test_sample_params(self):
+        space = {
+            "compile.optimizer.adam.learning_rate": {"loguniform": [1e-5, 1e-2]},
+            "model.dropout_rate": {"uniform": [0.0, 0.5]},
+            "data.batch_size": {"randint": [8, 64]},
+            "model.regulizer": {"choice": [0.0, 0.001]},
+        }
+        params = sample_params(space, random.Random(0))
+        self.assertTrue(1e-5 <= params["compile.optimizer.adam.learning_rate"] <= 1e-2)
+        self.assertTrue(0.0 <= params["model.dropout_rate"] <= 0.5)
+        self.assertTrue(8 <= params["data.batch_size"] <= 64)
+        self.assertIn(params["model.regulizer"], (0.0, 0.001))
+
+        # Same seed, same trials
+        self.assertEqual(params, sample_params(space, random.Random(0)))
+
+    def test_truncate_schedule(self):
+        schedule = [{"epochs": 2, "trainable_from": "head"}, {"epochs": 3}, {}]
+        self.assertEqual(truncate_schedule(schedule, 1), [{"trainable_from": "head"}])
+        self.assertEqual(
+            truncate_schedule(schedule, 4),
+            [{"epochs": 2, "trainable_from": "head"}, {}],
+        )
+        self.assertEqual(truncate_schedule(schedule, 10), schedule)
+
+    def test_create_trial_config(self):
+        base_config = {
+            "model": {"dropout_rate": 0.0},
+            "fit": {
+                "epochs": 10,
+                "callbacks": {
+                    "model_checkpoint": {"filepath": "/models/model.{epoch:02d}.h5"}
+                },
+            },
+        }
+        config = create_trial_config(
+            base_config,
+            {"model.dropout_rate": 0.3, "compile.optimizer.adam.learning_rate": 0.1},
+            "/sweep/trial_000",
+            3,
+        )
+        self.assertEqual(config["model"]["dropout_rate"], 0.3)
+        self.assertEqual(config["compile"]["optimizer"]["adam"]["learning_rate"], 0.1)
+        self.assertEqual(config["fit"]["epochs"], 3)
+
+        callbacks = config["fit"]["callbacks"]
+        self.assertEqual(
+            callbacks["model_checkpoint"]["filepath"],
+            "/sweep/trial_000/models/model.{epoch:02d}.h5",
+        )
+        self.assertEqual(
+            callbacks["training_checkpoint"]["directory"],
+            "/sweep/trial_000/checkpoints",
+        )
+        self.assertTrue(callbacks["csv_logger"]["append"])
+
+        # The base config is left as is
+        self.assertEqual(base_config["model"]["dropout_rate"], 0.0)
+        self.assertEqual(len(base_config["fit"]["callbacks"]), 1)
+
+    def test_read_metric(self):
+        history_path = os.path.join(self.folder, "history.csv")
+        with open(history_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["epoch", "loss", "val_accuracy"])
+            writer.writerow([0, 1.0, 0.5])
+            writer.writerow([1, 0.5, 0.75])
+
+        self.assertEqual(read_metric(history_path, "val_accuracy"), 0.75)
+        with self.assertRaises(ValueError):
+            read_metric(history_path, "val_loss")
+
+    def test_get_rungs(self):
+        self.assertEqual(get_rungs(1, 20, 3), [1, 3, 9, 20])
+        self.assertEqual(get_rungs(2, 2, 3), [2])
+
+    def test_async_successive_halving(self):
+        scheduler = AsyncSuccessiveHalving([1, 3, 9], reduction_factor=2)
+        self.assertIsNone(scheduler.get_promotion())
+
+        scheduler.report(0, 0, 0.5)
+        self.assertIsNone(scheduler.get_promotion())
+        scheduler.report(1, 0, 0.7)
+        # Top half of 2 trials
+        self.assertEqual(scheduler.get_promotion(), (1, 1))
+        self.assertIsNone(scheduler.get_promotion())
+
+        scheduler.report(2, 0, 0.6)
+        scheduler.report(3, 0, 0.4)
+        self.assertEqual(scheduler.get_promotion(), (2, 1))
+
+        # Higher rungs go first
+        scheduler.report(1, 1, 0.8)
+        scheduler.report(2, 1, 0.9)
+        self.assertEqual(scheduler.get_promotion(), (2, 2))
+
+        scheduler = AsyncSuccessiveHalving([1, 3], reduction_factor=2, mode="min")
+        scheduler.report(0, 0, 0.5)
+        scheduler.report(1, 0, 0.7)
+        self.assertEqual(scheduler.get_promotion(), (0, 1))
+
+    def test_write_leaderboard(self):
+        trials = [
+            {"trial": 0, "status": "stopped", "epochs": 1, "metric": 0.9, "params": {}},
+            {
+                "trial": 1,
+                "status": "completed",
+                "epochs": 3,
+                "metric": 0.7,
+                "params": {"model.dropout_rate": 0.1},
+            },
+            {"trial": 2, "status": "failed", "epochs": 0, "metric": None, "params": {}},
+            {
+                "trial": 3,
+                "status": "stopped",
+                "epochs": 1,
+                "metric": 0.95,
+                "params": {},
+            },
+        ]
+        path = os.path.join(self.folder, "leaderboard.csv")
+        leaderboard = write_leaderboard(path, trials)
+        self.assertEqual([row["trial"] for row in leaderboard], [1, 3, 0, 2])
+        self.assertEqual(leaderboard[0]["model.dropout_rate"], 0.1)
+
+        with open(path, newline="") as f:
+            self.assertEqual(len(list(csv.DictReader(f))), 4)
+
+
+class TestSweepScript(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        # Stand-in for `scripts/train.py`, it continues the trial history up
+        # to `fit.epochs` and the metric grows with the dropout rate
+        self.train_script = os.path.join(self.folder, "train.py")
+        with open(self.train_script, "w") as f:
+            f.write(
+                textwrap.dedent(
+                    """
+                    import csv, os, sys, yaml
+
+                    with open(sys.argv[1]) as f:
+                        config = yaml.safe_load(f)
+                    path = config["fit"]["callbacks"]["csv_logger"]["filename"]
+                    done = 0
+                    if os.path.exists(path):
+                        with open(path) as f:
+                            done = len(f.readlines()) - 1
+                    with open(path, "a", newline="") as f:
+                        writer = csv.writer(f)
+                        if not done:
+                            writer.writerow(["epoch", "val_accuracy"])
+                        for epoch in range(done, config["fit"]["epochs"]):
+                            rate = config["model"]["dropout_rate"]
+                            writer.writerow([epoch, rate * (epoch + 1)])
+                    """
+                )
+            )
+
+        self.config_file = os.path.join(self.folder, "config.yml")
+        with open(self.config_file, "w") as f:
+            yaml.safe_dump(
+                {
+                    "seed": 123,
+                    "data": {"directory": "/data"},
+                    "model": {"dropout_rate": 0.0},
+                    "fit": {"epochs": 2},
+                },
+                f,
+            )
+        self.sweep_file = os.path.join(self.folder, "sweep.yml")
+        with open(self.sweep_file, "w") as f:
+            yaml.safe_dump(
+                {
+                    "num_trials": 4,
+                    "min_epochs": 1,
+                    "reduction_factor": 2,
+                    "space": {"model.dropout_rate": {"uniform": [0.0, 0.5]}},
+                },
+                f,
+            )
+
+    def test_get_available_cpus(self):
+        self.assertGreaterEqual(sweep_script.get_available_cpus(), 1)
+        self.assertLessEqual(sweep_script.get_available_cpus(), os.cpu_count())
+
+    def test_main(self):
+        output_dir = os.path.join(self.folder, "sweep")
+        with mock.patch.object(sweep_script, "TRAIN_SCRIPT", self.train_script):
+            leaderboard = sweep_script.main(
+                self.config_file, self.sweep_file, output_dir, parallel_trials=2
+            )
+
+        self.assertEqual(len(leaderboard), 4)
+        statuses = [row["status"] for row in leaderboard]
+        self.assertNotIn("failed", statuses)
+        self.assertIn("stopped", statuses)
+
+        # The best trial is always promoted and the others ranked after it
+        best = max(leaderboard, key=lambda row: row["model.dropout_rate"])
+        self.assertEqual(leaderboard[0]["trial"], best["trial"])
+        self.assertEqual(best["status"], "completed")
+        self.assertEqual(best["epochs"], 2)
+        self.assertAlmostEqual(best["metric"], best["model.dropout_rate"] * 2)
+
+        # Promoted trials continue their history instead of starting over
+        for row in leaderboard:
+            history_path = os.path.join(
+                output_dir, "trial_{:03d}".format(row["trial"]), "history.csv"
+            )
+            with open(history_path, newline="") as f:
+                epochs = [int(r["epoch"]) for r in csv.DictReader(f)]
+            self.assertEqual(epochs, list(range(row["epochs"])))
+
+        # Trials of a previous sweep are not reused
+        with self.assertRaises(ValueError):
+            sweep_script.main(self.config_file, self.sweep_file, output_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from scripts import build_tfrecords
+from utils import data_pipeline, tfrecords, utils
+
+
+class TestTFRecords(unittest.TestCase):
+    def setUp(self):
+        # Write 4 shards with 2 images each from the test images
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.class_names = ["class_a", "class_b"]
+        test_images = [
+            ("005652.jpg", 0),
+            ("008773.jpg", 0),
+            ("012310.jpg", 1),
+            ("cat.jpeg", 1),
+        ]
+        num_examples = {}
+        for index in range(4):
+            filename = tfrecords.SHARD_PATTERN.format(
+                subset="train", index=index, total=4
+            )
+            examples = []
+            for image_name, label in test_images[index : index + 2]:
+                with open(os.path.join("tests/test_data", image_name), "rb") as f:
+                    examples.append((f.read(), label, image_name))
+            num_examples[filename] = tfrecords.write_shard(
+                os.path.join(self.folder, filename), examples
+            )
+        tfrecords.save_class_index(self.folder, self.class_names, num_examples)
+
+        self.config = {
+            "seed": 123,
+            "data": {
+                "directory": self.folder,
+                "format": "tfrecord",
+                "label_mode": "categorical",
+                "validation_split": 0.25,
+                "image_size": [32, 48],
+                "batch_size": 2,
+            },
+        }
+
+    def test_class_index(self):
+        self.assertEqual(len(tfrecords.list_shards(self.folder)), 4)
+        self.assertListEqual(utils.get_class_names(self.config), self.class_names)
+
+    def test_stale_shards(self):
+        # Shards missing from the class index are ignored
+        stale_path = os.path.join(self.folder, "train-00000-of-00009.tfrecord")
+        shutil.copy(tfrecords.list_shards(self.folder)[0], stale_path)
+        self.assertNotIn(stale_path, tfrecords.list_shards(self.folder))
+        self.assertEqual(
+            data_pipeline.count_examples(self.config, None, self.class_names), 7
+        )
+
+    def test_rebuild(self):
+        labels = os.path.join(self.folder, "labels.csv")
+        with open(labels, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["img_name", "class", "subset"])
+            for image_name in ["005652.jpg", "008773.jpg", "012310.jpg"]:
+                writer.writerow([image_name, "class_a", "train"])
+
+        output_folder = os.path.join(self.folder, "output")
+        subset_folder = os.path.join(output_folder, "train")
+        build_tfrecords.main(
+            "tests/test_data", labels, output_folder, images_per_shard=1
+        )
+        self.assertEqual(len(os.listdir(subset_folder)), 4)
+
+        # A smaller build removes the shards of the previous one
+        build_tfrecords.main(
+            "tests/test_data", labels, output_folder, images_per_shard=2
+        )
+        self.assertListEqual(
+            sorted(os.listdir(subset_folder)),
+            [
+                "classes.json",
+                "train-00000-of-00002.tfrecord",
+                "train-00001-of-00002.tfrecord",
+            ],
+        )
+
+    def test_build_dataset(self):
+        self.assertEqual(
+            data_pipeline.count_examples(self.config, "training", self.class_names), 6
+        )
+        self.assertEqual(
+            data_pipeline.count_examples(self.config, "validation", self.class_names),
+            1,
+        )
+
+        train_ds = data_pipeline.build_dataset(
+            self.config, "training", self.class_names
+        )
+        images, labels = next(iter(train_ds))
+        self.assertEqual(images.shape, (2, 32, 48, 3))
+        self.assertEqual(labels.shape, (2, 2))
+        self.assertEqual(sum(len(labels) for _, labels in train_ds), 6)
+
+        # Last shard only has one image left
+        val_ds = data_pipeline.build_dataset(
+            self.config, "validation", self.class_names
+        )
+        self.assertEqual(sum(len(labels) for _, labels in val_ds), 1)
+
+        with self.assertRaises(ValueError):
+            data_pipeline.build_dataset(self.config, "training", ["class_b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
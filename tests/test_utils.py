@@ -1,6 +1,12 @@
+import os
+import shutil
+import tempfile
 import unittest
 
-from utils.utils import load_config
+import numpy as np
+from tensorflow import keras
+
+from utils.utils import load_config, predict_from_folder
 
 
 class TestUtils(unittest.TestCase):
@@ -44,3 +50,44 @@ class TestUtils(unittest.TestCase):
         loaded_config = load_config("tests/test_data/config_test.yml")
 
         self.assertDictEqual(loaded_config, config)
+
+    def test_predict_from_folder(self):
+        # Build a tiny folder with two classes from the test images
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        test_images = {
+            "class_a": ["005652.jpg", "008773.jpg"],
+            "class_b": ["012310.jpg", "cat.jpeg"],
+        }
+        for class_name, filenames in test_images.items():
+            os.makedirs(os.path.join(folder, class_name))
+            for filename in filenames:
+                shutil.copy(
+                    os.path.join("tests/test_data", filename),
+                    os.path.join(folder, class_name, filename),
+                )
+
+        input_size = (32, 32)
+        class_names = ["class_a", "class_b"]
+        inputs = keras.layers.Input(shape=input_size + (3,))
+        x = keras.layers.GlobalAveragePooling2D()(inputs)
+        outputs = keras.layers.Dense(2, activation="softmax")(x)
+        model = keras.Model(inputs, outputs)
+
+        # Batched results must match one-by-one predictions
+        predictions, labels = predict_from_folder(
+            folder, model, input_size, class_names, batch_size=3
+        )
+        expected_predictions, expected_labels = [], []
+        for dirpath, _, files in os.walk(folder):
+            for filename in files:
+                img = keras.utils.load_img(
+                    os.path.join(dirpath, filename), target_size=input_size
+                )
+                img_array = keras.utils.img_to_array(img)[np.newaxis]
+                pred = model.predict(img_array, verbose=0)
+                expected_predictions.append(class_names[np.argmax(pred)])
+                expected_labels.append(os.path.basename(dirpath))
+
+        self.assertListEqual(predictions, expected_predictions)
+        self.assertListEqual(labels, expected_labels)
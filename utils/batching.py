@@ -0,0 +1,113 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    Groups concurrent asyncio requests into batches, so the model runs once
+    per batch instead of once per request.
+
+    A batch is sent as soon as it has `max_batch_size` items or when
+    `max_wait_ms` have passed since its first item arrived, whatever comes
+    first. Batches run one at a time in a worker thread, so the event loop
+    keeps accepting requests meanwhile.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=5.0):
+        """
+        Parameters
+        ----------
+        predict_batch : callable
+            Function receiving a list of items and returning a list with
+            one result per item, in the same order.
+
+        max_batch_size : int
+            Max number of items per batch.
+
+        max_wait_ms : float
+            Max time in milliseconds the first item of a batch waits for
+            more items to arrive.
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        """
+        Starts processing batches, must be called from the event loop.
+        """
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops processing batches.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        """
+        Queues an item and waits for its result.
+
+        Parameters
+        ----------
+        item : object
+            Input for `predict_batch`.
+
+        Returns
+        -------
+        result : object
+            Result for this item.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def _predict(self, items):
+        # Errors are returned instead of raised, so their traceback doesn't
+        # keep a reference to the batching loop
+        try:
+            return self.predict_batch(items), None
+        except Exception as e:
+            return None, e
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            items = [item for item, _ in batch]
+            results, error = await loop.run_in_executor(
+                self.executor, self._predict, items
+            )
+
+            for i, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(results[i])
@@ -0,0 +1,366 @@
+import csv
+import json
+import os
+import resource
+import signal
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+# `ru_maxrss` is in kilobytes on Linux and in bytes on macOS
+MAXRSS_TO_MB = 1 / 2**20 if sys.platform == "darwin" else 1 / 2**10
+
+
+def get_peak_memory_mb():
+    """
+    Returns the peak resident memory used by this process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_TO_MB
+
+
+class TrainingProfiler(keras.callbacks.Callback):
+    """
+    Records the wall time of each training step, examples/sec and peak
+    host memory, and writes a summary at the end of the run.
+
+    To tell if the run is input-bound, the training dataset is read alone
+    for a few batches at the end of the first epoch, see
+    `set_input_dataset()`. By then cached datasets are filled and the
+    pipeline is warm, so the probe measures the same reads as the next
+    epochs. If reading a batch takes about as long as a whole training
+    step, the model is waiting on the input pipeline.
+
+    Optionally, a TensorFlow profiler trace is captured for a window of
+    steps, it can be opened from the TensorBoard "Profile" tab.
+    """
+
+    def __init__(self, log_dir, trace_steps=None, input_probe_steps=20):
+        """
+        Parameters
+        ----------
+        log_dir : str
+            Full path to the folder in which we will store the per step
+            timings, the summary and the profiler trace.
+
+        trace_steps : list
+            Optional [start, stop] global steps to capture with the
+            TensorFlow profiler, e.g. [10, 20]. Avoid the first steps, they
+            include the graph tracing.
+
+        input_probe_steps : int
+            Number of batches read from the dataset alone to measure the
+            input pipeline speed. Zero disables it.
+        """
+        super().__init__()
+        self.log_dir = log_dir
+        self.trace_steps = trace_steps
+        self.input_probe_steps = input_probe_steps
+        self.input_dataset = None
+        self.batch_size = None
+
+        self.steps = []
+        self.epoch = 0
+        self.global_step = 0
+        self.input_ms_per_step = None
+        self._probe_pending = False
+        self._tracing = False
+        self._step_start = None
+        self._epoch_start = None
+        self._epoch_times = []
+
+    def set_input_dataset(self, dataset, batch_size):
+        """
+        Sets the training dataset and its batch size, used to measure the
+        input pipeline and to compute examples/sec.
+        """
+        self.input_dataset = dataset
+        self.batch_size = batch_size
+
+    def probe_input_pipeline(self):
+        """
+        Reads `input_probe_steps` batches from the dataset, without running
+        the model.
+
+        Returns
+        -------
+        input_ms_per_step : float
+            Mean time to get a batch, in milliseconds.
+        """
+        iterator = iter(self.input_dataset)
+        # First batch includes the pipeline start up
+        next(iterator)
+        start = time.perf_counter()
+        num_batches = 0
+        for _ in range(self.input_probe_steps):
+            try:
+                next(iterator)
+            except StopIteration:
+                break
+            num_batches += 1
+
+        if not num_batches:
+            return None
+
+        return (time.perf_counter() - start) / num_batches * 1000
+
+    def on_train_begin(self, logs=None):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._probe_pending = self.input_dataset is not None and bool(
+            self.input_probe_steps
+        )
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._epoch_times.append(time.perf_counter() - self._epoch_start)
+        if self._probe_pending:
+            self.input_ms_per_step = self.probe_input_pipeline()
+            self._probe_pending = False
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and self.global_step == self.trace_steps[0]:
+            tf.profiler.experimental.start(os.path.join(self.log_dir, "trace"))
+            self._tracing = True
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        step_ms = (time.perf_counter() - self._step_start) * 1000
+        self.steps.append(
+            {
+                "epoch": self.epoch,
+                "step": batch,
+                "step_ms": step_ms,
+                "peak_memory_mb": get_peak_memory_mb(),
+            }
+        )
+        self.global_step += 1
+        if self._tracing and self.global_step >= self.trace_steps[1]:
+            self.stop_trace()
+
+    def stop_trace(self):
+        tf.profiler.experimental.stop()
+        self._tracing = False
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            self.stop_trace()
+
+        with open(os.path.join(self.log_dir, "steps.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=["epoch", "step", "step_ms", "peak_memory_mb"]
+            )
+            writer.writeheader()
+            writer.writerows(self.steps)
+
+        summary = self.summary()
+        with open(os.path.join(self.log_dir, "profile_summary.json"), "w") as f:
+            json.dump(summary, f, indent=4)
+
+        print(
+            "Step time: {:.1f} ms (p95 {:.1f} ms), {:.1f} examples/sec, "
+            "peak memory {:.0f} MB".format(
+                summary["step_ms_mean"],
+                summary["step_ms_p95"],
+                summary["examples_per_sec"] or 0,
+                summary["peak_memory_mb"],
+            )
+        )
+        if summary["input_wait_ratio"] is not None:
+            print(
+                "Input pipeline: {:.1f} ms per batch, {:.0%} of the step time"
+                " ({}).".format(
+                    summary["input_ms_per_step"],
+                    summary["input_wait_ratio"],
+                    "input-bound" if summary["input_bound"] else "compute-bound",
+                )
+            )
+
+    def summary(self):
+        """
+        Aggregates the recorded steps.
+
+        Returns
+        -------
+        summary : dict
+            Step time stats in milliseconds, `examples_per_sec`,
+            `peak_memory_mb`, the input pipeline time per step and which
+            fraction of the step time it represents (`input_wait_ratio`).
+            The first step is left out of the stats, it includes the graph
+            tracing, and reported as `first_step_ms`.
+        """
+        step_ms = np.array([s["step_ms"] for s in self.steps])
+        first_step_ms = float(step_ms[0]) if len(step_ms) else None
+        if len(step_ms) > 1:
+            step_ms = step_ms[1:]
+
+        summary = {
+            "steps": len(self.steps),
+            "epochs": len(self._epoch_times),
+            "epoch_seconds": self._epoch_times,
+            "first_step_ms": first_step_ms,
+            "step_ms_mean": float(step_ms.mean()) if len(step_ms) else 0.0,
+            "step_ms_p50": float(np.percentile(step_ms, 50)) if len(step_ms) else 0.0,
+            "step_ms_p95": float(np.percentile(step_ms, 95)) if len(step_ms) else 0.0,
+            "examples_per_sec": None,
+            "peak_memory_mb": get_peak_memory_mb(),
+            "input_ms_per_step": self.input_ms_per_step,
+            "input_wait_ratio": None,
+            "input_bound": None,
+        }
+        if self.batch_size and summary["step_ms_mean"]:
+            summary["examples_per_sec"] = (
+                self.batch_size / summary["step_ms_mean"] * 1000
+            )
+        if self.input_ms_per_step is not None and summary["step_ms_p50"]:
+            ratio = min(1.0, self.input_ms_per_step / summary["step_ms_p50"])
+            summary["input_wait_ratio"] = ratio
+            # With prefetching, input and compute overlap, so the step takes
+            # as long as the slowest of both
+            summary["input_bound"] = ratio > 0.9
+
+        return summary
+
+
+class TrainingCheckpoint(keras.callbacks.Callback):
+    """
+    Periodically saves the whole training state, model weights, optimizer
+    state and the current epoch and step, so a killed job can continue
+    where it stopped instead of starting over. See `restore()`.
+
+    On SIGTERM, e.g. when a preemptible machine is reclaimed, a final
+    checkpoint is written after the running step and training stops,
+    `interrupted` is then True.
+
+    The data position is restored too when the training dataset is built
+    with `data_epoch`, see `data_pipeline.build_dataset()`: the order of
+    each epoch is then derived from the experiment seed and the epoch
+    number, so a resumed epoch skips the batches already trained and reads
+    exactly the remaining ones. Random augmentations and Dropout masks are
+    not replayed. Single worker only, see
+    `keras.callbacks.BackupAndRestore` for distributed runs.
+    """
+
+    def __init__(self, directory, save_every_steps=None, max_to_keep=1):
+        """
+        Parameters
+        ----------
+        directory : str
+            Full path to the folder in which we will store the checkpoints.
+            It shouldn't be used for anything else.
+
+        save_every_steps : int
+            Number of training steps between checkpoints, besides the one
+            saved at the end of each epoch. None only saves at epoch end.
+
+        max_to_keep : int
+            Number of checkpoints kept on disk.
+        """
+        super().__init__()
+        self.directory = directory
+        self.save_every_steps = save_every_steps
+        self.max_to_keep = max_to_keep
+
+        self.interrupted = False
+        self.initial_epoch = 0
+        self.initial_step = 0
+        # Epoch being trained, read by the input pipeline
+        self.data_epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._current_epoch = 0
+        self._step_offset = 0
+        self._manager = None
+        self._previous_handler = None
+
+    def get_manager(self, model):
+        """
+        Returns the `tf.train.CheckpointManager` writing to `directory`.
+        """
+        if self._manager is None:
+            checkpoint = tf.train.Checkpoint(
+                model=model,
+                optimizer=model.optimizer,
+                epoch=self._epoch,
+                step=self._step,
+            )
+            self._manager = tf.train.CheckpointManager(
+                checkpoint, self.directory, max_to_keep=self.max_to_keep
+            )
+
+        return self._manager
+
+    def restore(self, model):
+        """
+        Loads the latest checkpoint in `directory`, if any, into a compiled
+        model. Optimizer variables not created yet are restored when they
+        are.
+
+        Returns
+        -------
+        initial_epoch, initial_step : tuple
+            Epoch to continue from and the number of its steps already done,
+            (0, 0) if there's no checkpoint.
+        """
+        checkpoint_path = tf.train.latest_checkpoint(self.directory)
+        if checkpoint_path is None:
+            return 0, 0
+
+        self.get_manager(model).checkpoint.restore(checkpoint_path)
+        self.initial_epoch = int(self._epoch.numpy())
+        self.initial_step = int(self._step.numpy())
+        self.data_epoch.assign(self.initial_epoch)
+        print(
+            "Restored {}, continuing from epoch {} step {}".format(
+                checkpoint_path, self.initial_epoch + 1, self.initial_step
+            )
+        )
+
+        return self.initial_epoch, self.initial_step
+
+    def save(self, epoch, step):
+        """
+        Saves a checkpoint after `step` steps of `epoch`. Once all the steps
+        of the epoch are done, it's saved as the start of the next one.
+        """
+        steps = (self.params or {}).get("steps")
+        if steps is not None and step >= self._step_offset + steps:
+            epoch, step = epoch + 1, 0
+        self._epoch.assign(epoch)
+        self._step.assign(step)
+        self.get_manager(self.model).save()
+
+    def handle_sigterm(self, signum, frame):
+        # Only flag it here, the checkpoint is saved between steps
+        self.interrupted = True
+
+    def on_train_begin(self, logs=None):
+        self._previous_handler = signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+    def on_train_end(self, logs=None):
+        signal.signal(signal.SIGTERM, self._previous_handler)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        # Steps done before a restart are not run again, see `restore()`.
+        # Iterators only read their first element after this
+        self.data_epoch.assign(epoch)
+        self._current_epoch = epoch
+        self._step_offset = self.initial_step if epoch == self.initial_epoch else 0
+        self.initial_step = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        step = self._step_offset + batch + 1
+        if self.interrupted:
+            self.save(self._current_epoch, step)
+            self.model.stop_training = True
+        elif self.save_every_steps and step % self.save_every_steps == 0:
+            self.save(self._current_epoch, step)
+
+    def on_epoch_end(self, epoch, logs=None):
+        # The epoch didn't finish if training was interrupted
+        if not self.interrupted:
+            self.save(epoch + 1, 0)
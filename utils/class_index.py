@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+# File stored next to the trained models, mapping model outputs to classes
+CLASS_INDEX_FILENAME = "class_index.json"
+
+# Format version of the class index file
+CLASS_INDEX_VERSION = 1
+
+
+def get_fingerprint(class_names):
+    """
+    Returns a hash identifying the class names and their order.
+    """
+    return hashlib.sha256("\n".join(class_names).encode()).hexdigest()
+
+
+def create_class_index(class_names, legacy_order=False):
+    """
+    Creates the class index for a model, classes are sorted so the order
+    never depends on the filesystem.
+
+    Parameters
+    ----------
+    class_names : list
+        List of classes as string.
+
+    legacy_order : bool
+        Keep `class_names` in the given order instead, for models trained
+        before the class index existed, see
+        `utils.utils.get_legacy_class_names()`.
+
+    Returns
+    -------
+    class_index : dict
+        Having the format `version`, the `class_names` in model output
+        order, their `fingerprint` and, for legacy models, `legacy_order`.
+    """
+    if not legacy_order:
+        class_names = sorted(class_names)
+
+    class_index = {
+        "version": CLASS_INDEX_VERSION,
+        "class_names": list(class_names),
+        "fingerprint": get_fingerprint(class_names),
+    }
+    if legacy_order:
+        class_index["legacy_order"] = True
+
+    return class_index
+
+
+def get_class_index_path(model_path):
+    """
+    Returns where the class index of a model is stored: inside the folder
+    for SavedModels and exported models, next to the file for `.h5` models.
+    A path to the class index file itself is returned as is.
+
+    Parameters
+    ----------
+    model_path : str
+        Full path to a model file or folder.
+    """
+    if os.path.basename(model_path) == CLASS_INDEX_FILENAME:
+        return model_path
+    if os.path.isdir(model_path):
+        return os.path.join(model_path, CLASS_INDEX_FILENAME)
+
+    return os.path.join(os.path.dirname(model_path), CLASS_INDEX_FILENAME)
+
+
+def save_class_index(model_path, class_names, legacy_order=False):
+    """
+    Writes the class index for a model. If the model folder already has a
+    different one, a ValueError is raised instead of overwriting it.
+
+    Parameters
+    ----------
+    model_path : str
+        Full path to the model file or folder, or to the folder where the
+        models will be saved.
+
+    class_names : list
+        List of classes as string, in model output order.
+
+    legacy_order : bool
+        Whether `class_names` are in the unsorted order of a model trained
+        before the class index existed, see `create_class_index()`.
+
+    Returns
+    -------
+    class_index : dict
+        Saved class index, see `create_class_index()`.
+    """
+    class_index = create_class_index(class_names, legacy_order)
+    if list(class_names) != class_index["class_names"]:
+        raise ValueError("Class names must be sorted, see `create_class_index()`")
+
+    path = get_class_index_path(model_path)
+    if os.path.exists(path):
+        if load_class_index(path)["fingerprint"] != class_index["fingerprint"]:
+            raise ValueError(
+                "A different class index already exists in {}".format(path)
+            )
+        return class_index
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(class_index, f, indent=4)
+
+    return class_index
+
+
+def load_class_index(model_path):
+    """
+    Reads the class index of a model and checks it wasn't modified.
+
+    Parameters
+    ----------
+    model_path : str
+        Full path to a model file or folder, or to the class index file.
+
+    Returns
+    -------
+    class_index : dict
+        See `create_class_index()`.
+    """
+    path = get_class_index_path(model_path)
+    with open(path) as f:
+        class_index = json.load(f)
+
+    if class_index.get("version") != CLASS_INDEX_VERSION:
+        raise ValueError(
+            "Unsupported class index version {} in {}".format(
+                class_index.get("version"), path
+            )
+        )
+    if get_fingerprint(class_index["class_names"]) != class_index["fingerprint"]:
+        raise ValueError("Class index fingerprint doesn't match in {}".format(path))
+
+    return class_index
+
+
+def load_class_names(model_path):
+    """
+    Returns the class names of a model, in model output order.
+    See `load_class_index()`.
+    """
+    return load_class_index(model_path)["class_names"]
@@ -1,7 +1,177 @@
+import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 
 
+def random_seeds(num_seeds, seed=None):
+    """
+    Returns `num_seeds` seeds for stateless random ops. A new base seed is
+    drawn on each call so every batch gets new values, and the seeds are
+    derived from it so each op gets values independent from the others.
+    """
+    base_seed = tf.random.uniform([2], 0, tf.int32.max, dtype=tf.int32, seed=seed)
+
+    return tf.unstack(tf.random.experimental.stateless_split(base_seed, num_seeds))
+
+
+@keras.utils.register_keras_serializable(package="data_aug")
+class RandomResizedCrop(layers.Layer):
+    """
+    Crops a random window of each image and resizes it back to the image
+    size. Each side of the window is between `min_scale` and 1 times the
+    image side. Does nothing outside training.
+    """
+
+    def __init__(self, min_scale=0.8, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.min_scale = min_scale
+        self.seed = seed
+
+    def call(self, images, training=True):
+        if not training:
+            return images
+
+        batch_size = tf.shape(images)[0]
+        seeds = random_seeds(4, self.seed)
+        height_scale = tf.random.stateless_uniform(
+            [batch_size], seeds[0], self.min_scale, 1.0
+        )
+        width_scale = tf.random.stateless_uniform(
+            [batch_size], seeds[1], self.min_scale, 1.0
+        )
+        y1 = tf.random.stateless_uniform([batch_size], seeds[2]) * (1 - height_scale)
+        x1 = tf.random.stateless_uniform([batch_size], seeds[3]) * (1 - width_scale)
+        # Normalized (y1, x1, y2, x2) boxes, all the crops in a single op
+        boxes = tf.stack([y1, x1, y1 + height_scale, x1 + width_scale], axis=1)
+
+        return tf.image.crop_and_resize(
+            images,
+            boxes,
+            tf.range(batch_size),
+            tf.shape(images)[1:3],
+        )
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({"min_scale": self.min_scale, "seed": self.seed})
+        return config
+
+
+@keras.utils.register_keras_serializable(package="data_aug")
+class ColorJitter(layers.Layer):
+    """
+    Randomly changes brightness, contrast, saturation and hue of each
+    image, for pixel values in [0, 255]. Each factor gives the max change,
+    e.g. `brightness=0.2` adds up to +-20% of the pixel range. Does nothing
+    outside training.
+    """
+
+    def __init__(
+        self, brightness=0.0, contrast=0.0, saturation=0.0, hue=0.0, seed=None, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.seed = seed
+
+    @staticmethod
+    def _factors(batch_size, max_change, seed):
+        # One random value per image, shaped to broadcast over pixels
+        return tf.random.stateless_uniform(
+            [batch_size, 1, 1, 1], seed, -max_change, max_change
+        )
+
+    def call(self, images, training=True):
+        if not training:
+            return images
+
+        batch_size = tf.shape(images)[0]
+        seeds = random_seeds(4, self.seed)
+        if self.brightness:
+            images = (
+                images + self._factors(batch_size, self.brightness, seeds[0]) * 255.0
+            )
+        if self.contrast:
+            mean = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+            images = (images - mean) * (
+                1 + self._factors(batch_size, self.contrast, seeds[1])
+            ) + mean
+        if self.saturation:
+            gray = tf.image.rgb_to_grayscale(images)
+            images = (images - gray) * (
+                1 + self._factors(batch_size, self.saturation, seeds[2])
+            ) + gray
+        if self.hue:
+            hsv = tf.image.rgb_to_hsv(tf.clip_by_value(images, 0.0, 255.0) / 255.0)
+            hue = tf.math.floormod(
+                hsv[..., :1] + self._factors(batch_size, self.hue, seeds[3]), 1.0
+            )
+            images = (
+                tf.image.hsv_to_rgb(tf.concat([hue, hsv[..., 1:]], axis=-1)) * 255.0
+            )
+
+        return tf.clip_by_value(images, 0.0, 255.0)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            {
+                "brightness": self.brightness,
+                "contrast": self.contrast,
+                "saturation": self.saturation,
+                "hue": self.hue,
+                "seed": self.seed,
+            }
+        )
+        return config
+
+
+@keras.utils.register_keras_serializable(package="data_aug")
+class Cutout(layers.Layer):
+    """
+    Fills a random rectangle of each image with `fill_value`. The rectangle
+    sides are `size` times the image sides. Does nothing outside training.
+    """
+
+    def __init__(self, size=0.25, fill_value=0.0, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self.fill_value = fill_value
+        self.seed = seed
+
+    def call(self, images, training=True):
+        if not training:
+            return images
+
+        shape = tf.shape(images)
+        batch_size = shape[0]
+        height = tf.cast(shape[1], tf.float32)
+        width = tf.cast(shape[2], tf.float32)
+        seeds = random_seeds(2, self.seed)
+        center_y = tf.random.stateless_uniform([batch_size, 1, 1], seeds[0], 0, height)
+        center_x = tf.random.stateless_uniform([batch_size, 1, 1], seeds[1], 0, width)
+
+        # Pixels inside the rectangle of each image, without any loop
+        rows = tf.range(height)[tf.newaxis, :, tf.newaxis]
+        cols = tf.range(width)[tf.newaxis, tf.newaxis, :]
+        inside = (tf.abs(rows - center_y) < height * self.size / 2) & (
+            tf.abs(cols - center_x) < width * self.size / 2
+        )
+
+        return tf.where(
+            inside[..., tf.newaxis], tf.cast(self.fill_value, images.dtype), images
+        )
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            {"size": self.size, "fill_value": self.fill_value, "seed": self.seed}
+        )
+        return config
+
+
 def create_data_aug_layer(data_aug_layer):
     """
     Use this function to parse the data augmentation methods for the
@@ -13,6 +183,15 @@ def create_data_aug_layer(data_aug_layer):
         - `random_rotation`: keras.layers.RandomRotation()
         - `random_zoom`: keras.layers.RandomZoom()
 
+    Also supported:
+        - `random_crop`: RandomResizedCrop()
+        - `color_jitter`: ColorJitter()
+        - `cutout`: Cutout()
+
+    The same layers can run inside the model or in the input pipeline,
+    over whole batches, see `data.pipeline.augment` in
+    `utils.data_pipeline`.
+
     See https://tensorflow.org/tutorials/images/data_augmentation.
 
     Parameters
@@ -46,6 +225,18 @@ def create_data_aug_layer(data_aug_layer):
             random_zoom = layers.RandomZoom(**data_aug_layer["random_zoom"])
             data_aug_layers.append(random_zoom)
 
+        if "random_crop" in data_aug_layer:
+            random_crop = RandomResizedCrop(**data_aug_layer["random_crop"])
+            data_aug_layers.append(random_crop)
+
+        if "color_jitter" in data_aug_layer:
+            color_jitter = ColorJitter(**data_aug_layer["color_jitter"])
+            data_aug_layers.append(color_jitter)
+
+        if "cutout" in data_aug_layer:
+            cutout = Cutout(**data_aug_layer["cutout"])
+            data_aug_layers.append(cutout)
+
     # Return a keras.Sequential model having the the new layers created
     # Assign to `data_augmentation` variable
     # TODO
@@ -0,0 +1,465 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from utils import tfrecords
+from utils.data_aug import create_data_aug_layer
+from utils.preprocess_cache import PreprocessCache
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Supported values for `data.format`: folders of image files, one per
+# class, or TFRecord shards created by `scripts/build_tfrecords.py`
+DATA_FORMATS = ("images", "tfrecord")
+
+# Number of channels used by keras for each `color_mode`
+NUM_CHANNELS = {"grayscale": 1, "rgb": 3, "rgba": 4}
+
+
+def parse_pipeline_config(pipeline_config):
+    """
+    Fills the `data.pipeline` section of the experiment config with the
+    default values.
+
+    Supported settings:
+        - `cache`: "memory" to keep decoded images in RAM, a folder path to
+          store them on disk, or null to decode them every epoch.
+        - `prefetch`: number of batches to prepare while the model is
+          training, or "autotune".
+        - `num_parallel_calls`: number of images decoded in parallel, or
+          "autotune".
+        - `deterministic`: if false, images may be yielded out of order
+          when it makes the pipeline faster.
+        - `shuffle_buffer`: number of images used for shuffling the
+          training data, defaults to 8 batches like Keras does.
+        - `num_parallel_reads`: number of TFRecord shards read at the same
+          time, or "autotune". Only used with `data.format: tfrecord`.
+        - `preprocess_cache`: folder of a `PreprocessCache`, images are
+          decoded and resized once and then read from it in every run.
+          Only used with `data.format: images`.
+        - `augment`: if true, the `model.data_aug_layer` augmentations run
+          here over whole training batches, in parallel with the training
+          step, instead of inside the model.
+
+    Parameters
+    ----------
+    pipeline_config : dict
+        Pipeline settings coming from the experiment YAML config file.
+
+    Returns
+    -------
+    pipeline_config : dict
+        Pipeline settings with all the keys present.
+    """
+    pipeline_config = dict(pipeline_config or {})
+    for name in ("prefetch", "num_parallel_calls", "num_parallel_reads"):
+        value = pipeline_config.get(name, "autotune")
+        pipeline_config[name] = AUTOTUNE if value == "autotune" else int(value)
+    pipeline_config.setdefault("cache", None)
+    pipeline_config.setdefault("deterministic", None)
+    pipeline_config.setdefault("shuffle_buffer", None)
+    pipeline_config.setdefault("preprocess_cache", None)
+    pipeline_config.setdefault("augment", False)
+
+    return pipeline_config
+
+
+def list_image_files(data_config, subset, class_names, seed):
+    """
+    Lists the image files and integer labels for a train/validation subset.
+    The split is delegated to Keras so it's exactly the same one
+    `image_dataset_from_directory()` would produce with the same seed.
+
+    Parameters
+    ----------
+    data_config : dict
+        `data` section from the experiment config.
+
+    subset : str
+        One of "training" or "validation".
+
+    class_names : list
+        List of classes as string, it defines the label for each folder.
+
+    seed : int
+        Seed used for the train/validation split.
+
+    Returns
+    -------
+    file_paths, labels : tuple
+        List of image paths and list of integer labels.
+    """
+    # Our own settings are not known by Keras
+    keras_args = {
+        k: v for k, v in data_config.items() if k not in ("format", "pipeline")
+    }
+    index_ds = keras.preprocessing.image_dataset_from_directory(
+        subset=subset,
+        class_names=class_names,
+        seed=seed,
+        **keras_args,
+    )
+    directory = data_config["directory"]
+    file_paths = list(index_ds.file_paths)
+    labels = [
+        class_names.index(os.path.relpath(path, directory).split(os.sep)[0])
+        for path in file_paths
+    ]
+
+    return file_paths, labels
+
+
+def get_data_format(data_config):
+    """
+    Returns the `data.format` of the experiment config, "images" by default.
+    """
+    data_format = data_config.get("format", "images")
+    if data_format not in DATA_FORMATS:
+        raise ValueError("Unknown data format: {}".format(data_format))
+
+    return data_format
+
+
+def list_tfrecord_shards(data_config, subset):
+    """
+    Lists the TFRecord shards for a train/validation subset. The last
+    `validation_split` fraction of the shards is used for validation, so
+    the split granularity is one shard.
+
+    Parameters
+    ----------
+    data_config : dict
+        `data` section from the experiment config.
+
+    subset : str
+        One of "training", "validation" or None for all the shards.
+
+    Returns
+    -------
+    shard_paths : list
+        Full path to the shard files.
+    """
+    shard_paths = tfrecords.list_shards(data_config["directory"])
+    if not shard_paths:
+        raise ValueError("No TFRecord shards in {}".format(data_config["directory"]))
+
+    validation_split = data_config.get("validation_split") or 0
+    num_validation = int(round(len(shard_paths) * validation_split))
+    if validation_split and not 0 < num_validation < len(shard_paths):
+        raise ValueError(
+            "Can't split {} shards with validation_split={}, write smaller "
+            "shards".format(len(shard_paths), validation_split)
+        )
+
+    if subset == "training":
+        return shard_paths[: len(shard_paths) - num_validation]
+    if subset == "validation":
+        return shard_paths[len(shard_paths) - num_validation :]
+
+    return shard_paths
+
+
+def count_examples(config, subset, class_names):
+    """
+    Returns the number of images in a train/validation subset, without
+    reading them.
+    """
+    data_config = config["data"]
+    if get_data_format(data_config) == "tfrecord":
+        num_examples = tfrecords.load_class_index(data_config["directory"])[
+            "num_examples"
+        ]
+        return sum(
+            num_examples[os.path.basename(path)]
+            for path in list_tfrecord_shards(data_config, subset)
+        )
+
+    file_paths, _ = list_image_files(data_config, subset, class_names, config["seed"])
+
+    return len(file_paths)
+
+
+def load_image(path, image_size, num_channels=3, interpolation="bilinear"):
+    """
+    Reads, decodes and resizes an image, same as Keras does it inside
+    `image_dataset_from_directory()`.
+    """
+    img = tf.io.read_file(path)
+
+    return decode_and_resize(img, image_size, num_channels, interpolation)
+
+
+def decode_and_resize(img, image_size, num_channels=3, interpolation="bilinear"):
+    """
+    Decodes and resizes an encoded image, see `load_image()`.
+    """
+    img = tf.image.decode_image(img, channels=num_channels, expand_animations=False)
+    img = tf.image.resize(img, image_size, method=interpolation)
+    img.set_shape((image_size[0], image_size[1], num_channels))
+
+    return img
+
+
+def encode_label(label, label_mode, num_classes):
+    """
+    Converts an integer label to the format given by `label_mode`.
+    """
+    if label_mode == "categorical":
+        return tf.one_hot(label, num_classes)
+    if label_mode == "binary":
+        return tf.expand_dims(tf.cast(label, "float32"), axis=-1)
+
+    return label
+
+
+def get_cache_path(cache, subset, image_size, settings=None):
+    """
+    Returns the argument for `tf.data.Dataset.cache()`, or None if caching
+    is disabled. On-disk caches get one file per subset and image size so
+    they never get mixed up between runs. The other `settings` the cached
+    images depend on, e.g. the data directory and the split seed, are
+    added as a short hash.
+    """
+    if not cache:
+        return None
+    if cache == "memory":
+        return ""
+
+    os.makedirs(cache, exist_ok=True)
+    settings_hash = hashlib.blake2b(
+        json.dumps(settings, sort_keys=True).encode(), digest_size=4
+    ).hexdigest()
+
+    return os.path.join(cache, "{}_{}x{}_{}".format(subset, *image_size, settings_hash))
+
+
+def shuffle_by_epoch(dataset, buffer_size, seed, epoch):
+    """
+    Shuffles `dataset` with a seed derived from `seed` and the value of the
+    `epoch` variable when each iteration starts. The order of an epoch then
+    only depends on its number, not on how many epochs the process already
+    ran, so a resumed training reads its epochs in the same order.
+
+    Parameters
+    ----------
+    dataset : tf.data.Dataset
+        Dataset to shuffle.
+
+    buffer_size : int
+        Number of elements used for shuffling.
+
+    seed : int
+        Experiment seed.
+
+    epoch : tf.Variable
+        int64 variable holding the epoch being read, it must be set before
+        the first element of each epoch is requested.
+
+    Returns
+    -------
+    dataset : tf.data.Dataset
+        Shuffled dataset, with the same cardinality.
+    """
+    cardinality = dataset.cardinality()
+
+    def shuffle(epoch_value):
+        epoch_seed = tf.random.stateless_uniform(
+            [],
+            seed=tf.stack([tf.constant(seed, tf.int64), epoch_value]),
+            minval=0,
+            maxval=2**62,
+            dtype=tf.int64,
+        )
+        return dataset.shuffle(
+            buffer_size, seed=epoch_seed, reshuffle_each_iteration=False
+        )
+
+    # Read once at the start of each iteration
+    epochs = tf.data.Dataset.from_tensors(0).map(lambda _: epoch.read_value())
+    dataset = epochs.flat_map(shuffle)
+    if cardinality >= 0:
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(cardinality))
+
+    return dataset
+
+
+def build_dataset(config, subset, class_names, input_context=None, epoch=None):
+    """
+    Creates the tf.data pipeline used for training or validation.
+
+    Images are decoded in parallel, optionally cached after decoding,
+    shuffled (training only), batched and prefetched, following the
+    `data.pipeline` section of the experiment config.
+    See `parse_pipeline_config()` for the supported settings.
+
+    With `data.format: tfrecord`, images are read from TFRecord shards
+    instead, several shards at a time with `interleave()`.
+
+    When training with a `tf.distribute` strategy, each worker only reads
+    its own share of the image files or shards, so images are never decoded
+    twice.
+
+    Parameters
+    ----------
+    config : dict
+        Experiment settings as Python dict.
+
+    subset : str
+        One of "training" or "validation".
+
+    class_names : list
+        List of classes as string, used to keep model outputs order.
+
+    input_context : tf.distribute.InputContext
+        Given by `strategy.distribute_datasets_from_function()`. When set,
+        `data.batch_size` is the global batch size and it's split between
+        the replicas.
+
+    epoch : tf.Variable
+        Epoch being trained, see `utils.callbacks.TrainingCheckpoint`. If
+        given, the training order of each epoch only depends on `seed` and
+        the epoch number, see `shuffle_by_epoch()`.
+
+    Returns
+    -------
+    dataset : tf.data.Dataset
+        Dataset yielding (images, labels) batches.
+    """
+    data_config = dict(config["data"])
+    pipeline_config = parse_pipeline_config(data_config.pop("pipeline", None))
+    data_format = get_data_format(data_config)
+
+    image_size = tuple(data_config.get("image_size", (256, 256)))
+    batch_size = data_config.get("batch_size", 32)
+    label_mode = data_config.get("label_mode", "int")
+    num_channels = NUM_CHANNELS[data_config.get("color_mode", "rgb")]
+    interpolation = data_config.get("interpolation", "bilinear")
+    num_classes = len(class_names)
+
+    if data_format == "tfrecord":
+        class_index = tfrecords.load_class_index(data_config["directory"])
+        if list(class_names) != class_index["class_names"]:
+            raise ValueError("Class names don't match the TFRecord class index")
+
+        def load_example(serialized):
+            img, label = tfrecords.parse_example(serialized)
+            img = decode_and_resize(img, image_size, num_channels, interpolation)
+            return img, encode_label(label, label_mode, num_classes)
+
+        shard_paths = list_tfrecord_shards(data_config, subset)
+        dataset = tf.data.Dataset.from_tensor_slices(shard_paths)
+        if input_context is not None:
+            dataset = dataset.shard(
+                input_context.num_input_pipelines, input_context.input_pipeline_id
+            )
+        if subset == "training":
+            dataset = dataset.shuffle(len(shard_paths), seed=config["seed"])
+        # Sequential reads inside each shard, many shards at a time
+        dataset = dataset.interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=pipeline_config["num_parallel_reads"],
+            num_parallel_calls=pipeline_config["num_parallel_reads"],
+            deterministic=pipeline_config["deterministic"],
+        )
+
+    elif pipeline_config["preprocess_cache"]:
+        file_paths, labels = list_image_files(
+            data_config, subset, class_names, config["seed"]
+        )
+        # Images are decoded only if they aren't in the cache yet
+        preprocess_cache = PreprocessCache(
+            pipeline_config["preprocess_cache"],
+            image_size,
+            num_channels,
+            interpolation,
+        )
+        rows = preprocess_cache.update(file_paths)
+        images = preprocess_cache.images
+        preprocess_cache.close()
+
+        def load_example(row, label):
+            img = tf.numpy_function(lambda r: np.asarray(images[r]), [row], tf.uint8)
+            img = tf.cast(img, tf.float32)
+            img.set_shape((image_size[0], image_size[1], num_channels))
+            return img, encode_label(label, label_mode, num_classes)
+
+        dataset = tf.data.Dataset.from_tensor_slices((rows, labels))
+        if input_context is not None:
+            dataset = dataset.shard(
+                input_context.num_input_pipelines, input_context.input_pipeline_id
+            )
+
+    else:
+
+        def load_example(path, label):
+            img = load_image(path, image_size, num_channels, interpolation)
+            return img, encode_label(label, label_mode, num_classes)
+
+        file_paths, labels = list_image_files(
+            data_config, subset, class_names, config["seed"]
+        )
+        dataset = tf.data.Dataset.from_tensor_slices((file_paths, labels))
+        if input_context is not None:
+            dataset = dataset.shard(
+                input_context.num_input_pipelines, input_context.input_pipeline_id
+            )
+
+    if input_context is not None:
+        batch_size = input_context.get_per_replica_batch_size(batch_size)
+    dataset = dataset.map(
+        load_example,
+        num_parallel_calls=pipeline_config["num_parallel_calls"],
+        deterministic=pipeline_config["deterministic"],
+    )
+
+    cache_path = get_cache_path(
+        pipeline_config["cache"],
+        subset,
+        image_size,
+        {
+            "directory": os.path.abspath(data_config["directory"]),
+            "format": data_format,
+            "validation_split": data_config.get("validation_split"),
+            "seed": config["seed"],
+            "class_names": list(class_names),
+            "label_mode": label_mode,
+            "color_mode": data_config.get("color_mode", "rgb"),
+            "interpolation": interpolation,
+        },
+    )
+    if cache_path and input_context is not None:
+        # Workers may share the disk, each one caches its own shard
+        cache_path += "_shard{}of{}".format(
+            input_context.input_pipeline_id, input_context.num_input_pipelines
+        )
+    if cache_path is not None:
+        dataset = dataset.cache(cache_path)
+
+    if subset == "training":
+        shuffle_buffer = pipeline_config["shuffle_buffer"] or batch_size * 8
+        if epoch is not None:
+            dataset = shuffle_by_epoch(dataset, shuffle_buffer, config["seed"], epoch)
+        else:
+            dataset = dataset.shuffle(shuffle_buffer, seed=config["seed"])
+
+    dataset = dataset.batch(batch_size)
+
+    if subset == "training" and pipeline_config["augment"]:
+        # Vectorized over the batch, after caching so every epoch gets new
+        # random augmentations
+        data_augmentation = create_data_aug_layer(
+            config.get("model", {}).get("data_aug_layer")
+        )
+        dataset = dataset.map(
+            lambda imgs, labels: (data_augmentation(imgs, training=True), labels),
+            num_parallel_calls=pipeline_config["num_parallel_calls"],
+            deterministic=pipeline_config["deterministic"],
+        )
+
+    dataset = dataset.prefetch(pipeline_config["prefetch"])
+
+    return dataset
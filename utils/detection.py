@@ -5,28 +5,263 @@
 # Detectron2 models
 # https://colab.research.google.com/drive/16jcaJoc6bCFAQ96jDe2HwtXj7BMD_-m5.
 
-# TODO
+# The detector is not loaded when importing this module, it's created on
+# first use by `get_detector()` and then shared by all the calls and
+# threads in the process. Use `configure_detector()` or the DETECTOR_*
+# environment variables to change its settings.
 
-from detectron2 import model_zoo
-from detectron2.engine import DefaultPredictor
-from detectron2.config import get_cfg
-from detectron2.data import MetadataCatalog
+import hashlib
+import os
+import threading
 
-cfg = get_cfg()
-cfg.MODEL.DEVICE = "cpu" 
-cfg.merge_from_file(
-    model_zoo.get_config_file("COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml")
-)
-cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5  # set threshold for this model
-# Find a model from detectron2's model zoo.
-cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(
-    "COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml"
-)
+try:
+    import torch
+except ImportError:
+    # Only needed to run the detector, like Detectron2, this module can be
+    # imported without it
+    torch = None
 
-# Assign the loaded detection model to global variable DET_MODEL
-DET_MODEL = DefaultPredictor(cfg)
+from utils.detection_cache import DetectionCache
 
-ALL_CLASS_NAMES = MetadataCatalog.get(cfg.DATASETS.TRAIN[0]).thing_classes
+# Detector settings, with the environment variable that can override each
+# one and its default value
+DETECTOR_SETTINGS = {
+    "config_file": (
+        "DETECTOR_CONFIG",
+        "COCO-Detection/faster_rcnn_R_101_FPN_3x.yaml",
+    ),
+    "weights": ("DETECTOR_WEIGHTS", None),
+    "device": ("DETECTOR_DEVICE", "cpu"),
+    "score_thresh": ("DETECTOR_SCORE_THRESH", 0.5),
+    "min_size": ("DETECTOR_MIN_SIZE", None),
+    "max_size": ("DETECTOR_MAX_SIZE", None),
+}
+
+# Detected classes we consider vehicles, see `set_vehicle_classes()`
+VEHICLE_CLASSES = ("car", "truck")
+
+# Optional persistent cache for detection results, see
+# `set_detection_cache()`
+DET_CACHE = None
+
+# Settings given to `configure_detector()`, they take precedence over the
+# environment variables
+_settings_overrides = {}
+
+# Loaded detectors, keyed by their settings
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+
+class Detector:
+    """
+    Detectron2 model together with its config and class names.
+    """
+
+    def __init__(self, settings):
+        """
+        Parameters
+        ----------
+        settings : dict
+            Detector settings, see `get_detector_settings()`.
+        """
+        from detectron2.data import MetadataCatalog
+        from detectron2.engine import DefaultPredictor
+
+        self.cfg = build_detector_cfg(settings)
+        self.predictor = DefaultPredictor(self.cfg)
+        metadata = MetadataCatalog.get(self.cfg.DATASETS.TRAIN[0])
+        self.class_names = metadata.thing_classes
+        self._class_ids = {}
+
+    def class_ids(self, class_names):
+        """
+        Returns a tensor with the ids of the given class names, computed only
+        once for each set of names.
+        """
+        class_names = tuple(class_names)
+        if class_names not in self._class_ids:
+            unknown = sorted(set(class_names) - set(self.class_names))
+            if unknown:
+                raise ValueError("Unknown detector classes: {}".format(unknown))
+            self._class_ids[class_names] = torch.tensor(
+                [self.class_names.index(c) for c in class_names]
+            )
+
+        return self._class_ids[class_names]
+
+
+def configure_detector(**settings):
+    """
+    Changes the detector settings. The next call to `get_detector()` will
+    load a detector using them.
+
+    Parameters
+    ----------
+    config_file : str
+        Detectron2 model zoo config name or full path to a config file.
+
+    weights : str
+        Path or URL to the model weights. Defaults to the model zoo
+        checkpoint for `config_file`.
+
+    device : str
+        Device used to run the model, e.g. "cpu" or "cuda".
+
+    score_thresh : float
+        Min score for a detection to be kept.
+
+    min_size, max_size : int
+        Input resolution, shortest and longest image side after resizing.
+    """
+    global _settings_overrides
+    unknown = set(settings) - set(DETECTOR_SETTINGS)
+    if unknown:
+        raise ValueError("Unknown detector settings: {}".format(sorted(unknown)))
+
+    _settings_overrides = dict(_settings_overrides, **settings)
+    # Cached boxes depend on the detector settings
+    if DET_CACHE is not None:
+        DET_CACHE.detector_key = detector_fingerprint()
+
+
+def get_detector_settings():
+    """
+    Resolves the detector settings from `configure_detector()`, the
+    environment variables and the defaults, in that order.
+
+    Returns
+    -------
+    settings : dict
+        Detector settings.
+    """
+    settings = {}
+    for name, (env_var, default) in DETECTOR_SETTINGS.items():
+        value = os.environ.get(env_var, default)
+        settings[name] = _settings_overrides.get(name, value)
+
+    if settings["score_thresh"] is not None:
+        settings["score_thresh"] = float(settings["score_thresh"])
+    for name in ("min_size", "max_size"):
+        if settings[name] is not None:
+            settings[name] = int(settings[name])
+
+    return settings
+
+
+def build_detector_cfg(settings):
+    """
+    Creates the Detectron2 config for the given settings. It's cheap, no
+    model weights are loaded here.
+    """
+    from detectron2 import model_zoo
+    from detectron2.config import get_cfg
+
+    config_file = settings["config_file"]
+    from_zoo = not os.path.isfile(config_file)
+
+    cfg = get_cfg()
+    cfg.MODEL.DEVICE = settings["device"]
+    cfg.merge_from_file(
+        model_zoo.get_config_file(config_file) if from_zoo else config_file
+    )
+    # set threshold for this model
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = settings["score_thresh"]
+    if settings["min_size"] is not None:
+        cfg.INPUT.MIN_SIZE_TEST = settings["min_size"]
+    if settings["max_size"] is not None:
+        cfg.INPUT.MAX_SIZE_TEST = settings["max_size"]
+    # Find a model from detectron2's model zoo.
+    if settings["weights"] is not None:
+        cfg.MODEL.WEIGHTS = settings["weights"]
+    elif from_zoo:
+        cfg.MODEL.WEIGHTS = model_zoo.get_checkpoint_url(config_file)
+
+    return cfg
+
+
+def get_detector():
+    """
+    Returns the detector for the current settings, loading it on first use.
+    It's safe to call it from many threads, the model is loaded only once.
+
+    Returns
+    -------
+    detector : Detector
+        Loaded detector.
+    """
+    settings = get_detector_settings()
+    key = tuple(sorted(settings.items()))
+    with _detectors_lock:
+        if key not in _detectors:
+            _detectors[key] = Detector(settings)
+
+        return _detectors[key]
+
+
+def __getattr__(name):
+    # Keep the old module level names working, they load the detector
+    if name == "DET_MODEL":
+        return get_detector().predictor
+    if name == "ALL_CLASS_NAMES":
+        return get_detector().class_names
+    if name == "cfg":
+        return get_detector().cfg
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def detector_fingerprint():
+    """
+    Returns a hash identifying the current detector settings: model config,
+    weights and score threshold are all part of the dumped config, plus the
+    classes considered vehicles.
+    """
+    cfg = build_detector_cfg(get_detector_settings())
+    settings = cfg.dump() + ",".join(sorted(VEHICLE_CLASSES))
+
+    return hashlib.sha1(settings.encode()).hexdigest()
+
+
+def set_vehicle_classes(class_names):
+    """
+    Sets which detected objects are considered vehicles, e.g.
+    ["car", "truck", "bus", "motorcycle"].
+
+    Parameters
+    ----------
+    class_names : list
+        Class names as found in the detector `class_names`, COCO ones by
+        default.
+    """
+    global VEHICLE_CLASSES
+    VEHICLE_CLASSES = tuple(class_names)
+    # Cached boxes depend on the vehicle classes too
+    if DET_CACHE is not None:
+        DET_CACHE.detector_key = detector_fingerprint()
+
+
+def set_detection_cache(path, store_raw_boxes=False):
+    """
+    Enables the on-disk detection cache. Once set, images already seen by
+    the current detector skip the model entirely.
+
+    Parameters
+    ----------
+    path : str
+        Full path to the cache database file. None disables the cache.
+
+    store_raw_boxes : bool
+        If True, every car/truck box found is also stored, not only the
+        selected one.
+    """
+    global DET_CACHE
+    if DET_CACHE is not None:
+        DET_CACHE.close()
+
+    DET_CACHE = None
+    if path is not None:
+        DET_CACHE = DetectionCache(path, detector_fingerprint(), store_raw_boxes)
 
 
 def get_vehicle_coordinates(img):
@@ -37,7 +272,8 @@ def get_vehicle_coordinates(img):
     Many things should be taken into account to make it work:
         1. Current model being used can detect up to 80 different objects,
            we're only looking for 'cars' or 'trucks', so you should ignore
-           other detected objects.
+           other detected objects. See `set_vehicle_classes()` to look for
+           other vehicles too.
         2. The object detector may find more than one vehicle in the picture,
            you must then, choose the one with the largest area in the image.
         3. The model can also fail and detect zero objects in the picture,
@@ -57,9 +293,89 @@ def get_vehicle_coordinates(img):
         Tuple having bounding box coordinates as (left, top, right, bottom).
         Also known as (x1, y1, x2, y2).
     """
-    # TODO
-    outputs = DET_MODEL(img)
+    box_coordinates = get_cached_coordinates(img)
+    if box_coordinates is not None:
+        return box_coordinates
+
+    outputs = get_detector().predictor(img)
+
+    return select_vehicle_coordinates(outputs, img)
+
+
+def get_vehicle_coordinates_batch(imgs, batch_size=4):
+    """
+    Batched version of `get_vehicle_coordinates()`. Images are sent to the
+    detector model in groups of `batch_size`, so the backbone runs a single
+    forward pass for the whole group.
+
+    Images are grouped by aspect ratio before batching. All the images in a
+    batch are padded to the same size by the model, so grouping similar
+    shapes together avoids wasting compute on padding.
+
+    Parameters
+    ----------
+    imgs : list
+        List of images as numpy.ndarray, in the same format expected by
+        `get_vehicle_coordinates()`.
+
+    batch_size : int
+        Max number of images sent to the model on each forward pass.
+
+    Returns
+    -------
+    boxes_coordinates : list
+        Bounding box coordinates for each image, in the same order as
+        `imgs`. See `get_vehicle_coordinates()`.
+    """
+    boxes_coordinates = [get_cached_coordinates(img) for img in imgs]
+    # Only run the model over cache misses, sorted by aspect ratio so
+    # similar sizes share a batch
+    order = sorted(
+        (i for i, box in enumerate(boxes_coordinates) if box is None),
+        key=lambda i: imgs[i].shape[0] / imgs[i].shape[1],
+    )
+
+    model = get_detector().predictor.model
+    try:
+        with torch.no_grad():
+            for start in range(0, len(order), batch_size):
+                batch_idxs = order[start : start + batch_size]
+                inputs = [prepare_model_input(imgs[i]) for i in batch_idxs]
+                outputs = model(inputs)
+                for i, img_outputs in zip(batch_idxs, outputs):
+                    box = select_vehicle_coordinates(img_outputs, imgs[i], commit=False)
+                    boxes_coordinates[i] = box
+    finally:
+        # One cache transaction for the whole call
+        if DET_CACHE is not None:
+            DET_CACHE.flush()
 
+    return boxes_coordinates
+
+
+def prepare_model_input(img):
+    """
+    Applies the same pre-processing `DefaultPredictor` does to a single
+    image and returns the input dict expected by the detector model.
+    """
+    predictor = get_detector().predictor
+    height, width = img.shape[:2]
+    if predictor.input_format == "RGB":
+        img = img[:, :, ::-1]
+    image = predictor.aug.get_transform(img).apply_image(img)
+    image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+
+    return {"image": image, "height": height, "width": width}
+
+
+def select_vehicle_coordinates(outputs, img, commit=True):
+    """
+    Picks the vehicle with the largest area from the detector outputs, or
+    the full image if no vehicle was found. The result is saved in the
+    detection cache when enabled, `commit=False` leaves it pending until
+    the cache is flushed.
+    See `get_vehicle_coordinates()`.
+    """
     # get the valid boxes
     valid_boxes = get_valid_boxes(outputs)
 
@@ -69,37 +385,57 @@ def get_vehicle_coordinates(img):
     if select_box is not None:
         # get the coordinates of the box
         x1, y1, x2, y2 = select_box.tensor.cpu().numpy()[0][:4]
-        box_coordinates = (int(x1), int(y1), int(x2), int(y2))
-    else:
-        # if is not box return the complete image
-        h, w = img.shape[:2]
-        box_coordinates = [0, 0, w, h]
+        select_box = (int(x1), int(y1), int(x2), int(y2))
+
+    if DET_CACHE is not None:
+        raw_boxes = valid_boxes.tensor.cpu().numpy().tolist()
+        DET_CACHE.put(img, select_box, raw_boxes, commit=commit)
+
+    return to_box_coordinates(select_box, img)
+
+
+def get_cached_coordinates(img):
+    """
+    Returns the box coordinates for the image from the detection cache, or
+    None if the cache is disabled or the image was never seen.
+    """
+    if DET_CACHE is None:
+        return None
+
+    entry = DET_CACHE.get(img)
+    if entry is None:
+        return None
+
+    return to_box_coordinates(entry["box"], img)
+
+
+def to_box_coordinates(select_box, img):
+    """
+    Returns the selected box, or the full image if no vehicle was found.
+    """
+    if select_box is not None:
+        return select_box
 
-    return box_coordinates
+    # if is not box return the complete image
+    h, w = img.shape[:2]
+    return [0, 0, w, h]
 
 
 def get_valid_boxes(outputs):
-    # get the boxes detected
-    pred_boxes = outputs["instances"].pred_boxes
+    instances = outputs["instances"]
     # get the clases detected
-    pred_classes = outputs["instances"].pred_classes
-    boxes = []
-    for i, class_number in enumerate(pred_classes):
-        # only valid class
-        if valid_class(ALL_CLASS_NAMES[class_number]):
-            boxes.append(pred_boxes[i])
-    return boxes
+    pred_classes = instances.pred_classes
+    # only valid classes, compared against all the vehicle ids at once
+    vehicle_class_ids = get_detector().class_ids(VEHICLE_CLASSES)
+    valid_mask = (
+        pred_classes[:, None] == vehicle_class_ids.to(pred_classes.device)
+    ).any(dim=1)
+    # get the boxes detected
+    return instances.pred_boxes[valid_mask]
 
 
 def box_with_largest_area(boxes):
-    if not boxes:
+    if len(boxes) == 0:
         return None
-    # create a list with the area each box
-    list_area_box = list(map(lambda x: x.area(), boxes))
     # return the box with the largest area
-    return boxes[list_area_box.index(max(list_area_box))]
-
-
-def valid_class(class_name):
-    # only cars or trucks
-    return class_name == "car" or class_name == "truck"
+    return boxes[int(boxes.area().argmax())]
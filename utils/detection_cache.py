@@ -0,0 +1,151 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class DetectionCache:
+    """
+    On-disk store for vehicle detection results, so the detector doesn't
+    need to run again over images it has already seen.
+
+    Entries are keyed by a hash of the decoded image pixels together with a
+    detector fingerprint (model config, weights and score threshold), so
+    changing any of those never returns stale boxes. The same image stored
+    under a different file name or output folder is still a hit.
+
+    It uses SQLite so it can be shared between threads and between the
+    detector worker processes. Writes are committed one by one by default;
+    batch callers can pass `commit=False` to `put()` and call `flush()`
+    once, so a batch costs a single transaction.
+    """
+
+    def __init__(self, path, detector_key, store_raw_boxes=False):
+        """
+        Parameters
+        ----------
+        path : str
+            Full path to the cache database file, created if missing.
+
+        detector_key : str
+            Fingerprint of the detector settings, see
+            `utils.detection.detector_fingerprint()`.
+
+        store_raw_boxes : bool
+            If True, also keep every vehicle box found and not only the
+            selected one.
+        """
+        self.path = path
+        self.detector_key = detector_key
+        self.store_raw_boxes = store_raw_boxes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS boxes "
+            "(key TEXT PRIMARY KEY, box TEXT, raw_boxes TEXT)"
+        )
+        self._conn.commit()
+
+    def image_key(self, img):
+        """
+        Hashes the image content together with the detector fingerprint.
+
+        Parameters
+        ----------
+        img : numpy.ndarray
+            Image as loaded for the detector.
+
+        Returns
+        -------
+        key : str
+            Hex digest identifying the image for this detector.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(self.detector_key.encode())
+        digest.update(str((img.shape, img.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(img))
+
+        return digest.hexdigest()
+
+    def get(self, img):
+        """
+        Looks for the detection results of an image.
+
+        Parameters
+        ----------
+        img : numpy.ndarray
+            Image as loaded for the detector.
+
+        Returns
+        -------
+        entry : dict
+            None if the image is not in the cache. Otherwise a dict with
+            the selected `box` as (x1, y1, x2, y2), or None if no vehicle
+            was found, and `raw_boxes`, the list of all vehicle boxes if
+            they were stored.
+        """
+        key = self.image_key(img)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT box, raw_boxes FROM boxes WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        box = json.loads(row[0])
+        return {
+            "box": tuple(box) if box is not None else None,
+            "raw_boxes": json.loads(row[1]) if row[1] is not None else None,
+        }
+
+    def put(self, img, box, raw_boxes=None, commit=True):
+        """
+        Stores the detection results of an image.
+
+        Parameters
+        ----------
+        img : numpy.ndarray
+            Image as loaded for the detector.
+
+        box : tuple
+            Selected vehicle box as (x1, y1, x2, y2), or None if no vehicle
+            was found.
+
+        raw_boxes : list
+            All the vehicle boxes found, only saved when the cache was
+            created with `store_raw_boxes=True`.
+
+        commit : bool
+            If False, the entry is only written to disk, and visible to
+            other processes, on the next `flush()` or `close()`.
+        """
+        key = self.image_key(img)
+        raw_boxes = raw_boxes if self.store_raw_boxes else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO boxes VALUES (?, ?, ?)",
+                (
+                    key,
+                    json.dumps(list(box) if box is not None else None),
+                    json.dumps(raw_boxes) if raw_boxes is not None else None,
+                ),
+            )
+            if commit:
+                self._conn.commit()
+
+    def flush(self):
+        """
+        Commits the entries stored with `put(..., commit=False)`.
+        """
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,210 @@
+import json
+import os
+
+import tensorflow as tf
+
+from utils import data_pipeline
+
+# Supported distribution strategies
+STRATEGIES = ("default", "mirrored", "multi_worker_mirrored")
+
+# Collective communication used by MultiWorkerMirroredStrategy
+COMMUNICATIONS = {
+    "auto": tf.distribute.experimental.CommunicationImplementation.AUTO,
+    "ring": tf.distribute.experimental.CommunicationImplementation.RING,
+    "nccl": tf.distribute.experimental.CommunicationImplementation.NCCL,
+}
+
+
+def parse_distribute_config(distribute_config):
+    """
+    Fills the `distribute` section of the experiment config with the
+    default values.
+
+    Supported settings:
+        - `strategy`: one of "default" (single device), "mirrored" (all
+          the local devices) or "multi_worker_mirrored" (many processes or
+          machines, the cluster is read from the TF_CONFIG environment
+          variable).
+        - `devices`: devices used by "mirrored", all the GPUs by default.
+        - `num_cpu_devices`: splits the host CPU into this many logical
+          devices, so "mirrored" can run one replica per CPU socket.
+        - `communication`: "auto", "ring" or "nccl", used by
+          "multi_worker_mirrored".
+        - `scale_batch_size`: if true, `data.batch_size` is the batch size
+          of each replica and the global batch size grows with the number
+          of replicas. If false, `data.batch_size` is the global one.
+
+    Parameters
+    ----------
+    distribute_config : dict
+        Distribution settings coming from the experiment YAML config file.
+
+    Returns
+    -------
+    distribute_config : dict
+        Distribution settings with all the keys present.
+    """
+    distribute_config = dict(distribute_config or {})
+    distribute_config.setdefault("strategy", "default")
+    distribute_config.setdefault("devices", None)
+    distribute_config.setdefault("num_cpu_devices", None)
+    distribute_config.setdefault("communication", "auto")
+    distribute_config.setdefault("scale_batch_size", True)
+
+    if distribute_config["strategy"] not in STRATEGIES:
+        raise ValueError(
+            "Unknown distribution strategy: {}".format(distribute_config["strategy"])
+        )
+    if distribute_config["communication"] not in COMMUNICATIONS:
+        raise ValueError(
+            "Unknown communication: {}".format(distribute_config["communication"])
+        )
+
+    return distribute_config
+
+
+def split_cpu(num_devices):
+    """
+    Splits the host CPU into `num_devices` logical devices. It must be
+    called before TensorFlow initializes its devices.
+    """
+    cpu = tf.config.list_physical_devices("CPU")[0]
+    tf.config.set_logical_device_configuration(
+        cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(num_devices)]
+    )
+
+
+def create_strategy(distribute_config):
+    """
+    Creates the `tf.distribute` strategy given by the experiment config.
+    See `parse_distribute_config()` for the supported settings.
+
+    Parameters
+    ----------
+    distribute_config : dict
+        `distribute` section of the experiment config, it can be None.
+
+    Returns
+    -------
+    strategy : tf.distribute.Strategy
+        Strategy to build, compile and fit the model with.
+    """
+    distribute_config = parse_distribute_config(distribute_config)
+    name = distribute_config["strategy"]
+
+    if distribute_config["num_cpu_devices"]:
+        split_cpu(distribute_config["num_cpu_devices"])
+
+    if name == "mirrored":
+        devices = distribute_config["devices"]
+        if devices is None and distribute_config["num_cpu_devices"]:
+            devices = [d.name for d in tf.config.list_logical_devices("CPU")]
+        return tf.distribute.MirroredStrategy(devices=devices)
+
+    if name == "multi_worker_mirrored":
+        options = tf.distribute.experimental.CommunicationOptions(
+            implementation=COMMUNICATIONS[distribute_config["communication"]]
+        )
+        return tf.distribute.MultiWorkerMirroredStrategy(communication_options=options)
+
+    return tf.distribute.get_strategy()
+
+
+def get_task():
+    """
+    Returns the (task_type, task_id) of this process from TF_CONFIG, or
+    (None, 0) when it's not part of a cluster.
+    """
+    tf_config = json.loads(os.environ.get("TF_CONFIG", "{}"))
+    task = tf_config.get("task", {})
+
+    return task.get("type"), int(task.get("index", 0))
+
+
+def is_chief():
+    """
+    Returns True if this process should write the outputs shared by the
+    whole cluster, e.g. the final model. That's the "chief" task, or the
+    first worker when the cluster has no chief.
+    """
+    task_type, task_id = get_task()
+    if task_type is None or task_type == "chief":
+        return True
+    tf_config = json.loads(os.environ["TF_CONFIG"])
+
+    return (
+        task_type == "worker"
+        and task_id == 0
+        and "chief" not in tf_config.get("cluster", {})
+    )
+
+
+def get_worker_dir(directory):
+    """
+    Returns a per worker subfolder of `directory` for processes other than
+    the chief, so workers on the same host never write the same files.
+    """
+    if is_chief():
+        return directory
+    task_type, task_id = get_task()
+
+    return os.path.join(directory, "{}_{}".format(task_type, task_id))
+
+
+def get_global_batch_size(batch_size, strategy, scale_batch_size=True):
+    """
+    Returns the batch size of a whole training step, across all the
+    replicas.
+    """
+    if scale_batch_size:
+        return batch_size * strategy.num_replicas_in_sync
+
+    return batch_size
+
+
+def distribute_dataset(strategy, config, subset, class_names, global_batch_size):
+    """
+    Builds the dataset for `subset` on each worker, see
+    `data_pipeline.build_dataset()`.
+
+    Workers can end up with shards of different size. The dataset repeats
+    forever and the number of steps per epoch is fixed for all of them,
+    otherwise some workers would wait forever for the others to join the
+    last step.
+
+    Parameters
+    ----------
+    strategy : tf.distribute.Strategy
+        Strategy used for training.
+
+    config : dict
+        Experiment settings as Python dict.
+
+    subset : str
+        One of "training" or "validation".
+
+    class_names : list
+        List of classes as string.
+
+    global_batch_size : int
+        Batch size of a training step, across all the replicas.
+
+    Returns
+    -------
+    dataset, steps : tuple
+        Distributed dataset and the number of steps to cover `subset` once.
+    """
+    config = dict(config, data=dict(config["data"], batch_size=global_batch_size))
+    num_examples = data_pipeline.count_examples(config, subset, class_names)
+    steps = max(1, num_examples // global_batch_size)
+
+    def dataset_fn(input_context):
+        dataset = data_pipeline.build_dataset(
+            config, subset, class_names, input_context=input_context
+        )
+        return dataset.repeat()
+
+    dataset = strategy.distribute_datasets_from_function(dataset_fn)
+
+    return dataset, steps
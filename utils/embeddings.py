@@ -0,0 +1,215 @@
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from utils import data_pipeline
+from utils.data_aug import create_data_aug_layer
+
+# File describing the content of an embeddings store
+META_FILENAME = "meta.json"
+
+
+def get_store_meta(config, class_names):
+    """
+    Describes the embeddings a store must have for the experiment, used to
+    detect stores created with different settings.
+
+    Parameters
+    ----------
+    config : dict
+        Experiment settings as Python dict.
+
+    class_names : list
+        List of classes as string.
+
+    Returns
+    -------
+    meta : dict
+        Store description.
+    """
+    input_shape = config["model"].get("input_shape")
+
+    return {
+        "class_names": list(class_names),
+        "directory": os.path.abspath(config["data"]["directory"]),
+        "image_size": list(config["data"]["image_size"]),
+        "input_shape": list(input_shape) if input_shape is not None else None,
+        "validation_split": config["data"].get("validation_split"),
+        "seed": config["seed"],
+        "augmented_copies": config["features"].get("augmented_copies", 0),
+        "data_aug_layer": config["model"].get("data_aug_layer"),
+    }
+
+
+def store_exists(directory, meta):
+    """
+    Checks if a complete store with the given description exists.
+
+    Raises
+    ------
+    ValueError
+        If the store exists but was created with different settings.
+    """
+    meta_path = os.path.join(directory, META_FILENAME)
+    if not os.path.exists(meta_path):
+        return False
+
+    with open(meta_path, "r") as meta_f:
+        store_meta = json.load(meta_f)
+    if store_meta != meta:
+        raise ValueError(
+            "Embeddings store at {} was created with different settings, "
+            "remove it or use a new directory.".format(directory)
+        )
+
+    return True
+
+
+def extract_features(config, class_names, feature_extractor):
+    """
+    Runs the frozen Resnet50 base once over the training and validation
+    data and stores the pooled embeddings and labels as memory-mapped
+    `.npy` files inside `features.directory`.
+
+    When `features.augmented_copies` is set, the training subset is stored
+    that many extra times, each copy passed through the data augmentation
+    layers from `model.data_aug_layer`.
+
+    Parameters
+    ----------
+    config : dict
+        Experiment settings as Python dict.
+
+    class_names : list
+        List of classes as string.
+
+    feature_extractor : keras.Model
+        Model mapping images to embeddings, see
+        `models.resnet_50.create_feature_extractor()`.
+    """
+    directory = config["features"]["directory"]
+    meta = get_store_meta(config, class_names)
+    os.makedirs(directory, exist_ok=True)
+
+    data_augmentation = create_data_aug_layer(config["model"].get("data_aug_layer"))
+
+    for subset in ("training", "validation"):
+        num_examples = data_pipeline.count_examples(config, subset, class_names)
+        copies = 1
+        if subset == "training":
+            copies += meta["augmented_copies"]
+
+        total = num_examples * copies
+        features = np.lib.format.open_memmap(
+            os.path.join(directory, "{}_features.npy".format(subset)),
+            mode="w+",
+            dtype=np.float32,
+            shape=(total, feature_extractor.output_shape[-1]),
+        )
+        labels = np.lib.format.open_memmap(
+            os.path.join(directory, "{}_labels.npy".format(subset)),
+            mode="w+",
+            dtype=np.int32,
+            shape=(total,),
+        )
+
+        dataset = build_extraction_dataset(config, subset, class_names)
+        position = 0
+        for copy in range(copies):
+            for imgs, img_labels in dataset:
+                if copy > 0:
+                    imgs = data_augmentation(imgs, training=True)
+                batch_features = feature_extractor(imgs, training=False)
+                size = len(img_labels)
+                features[position : position + size] = batch_features.numpy()
+                labels[position : position + size] = img_labels.numpy()
+                position += size
+
+        features.flush()
+        labels.flush()
+        del features, labels
+
+    # Written last, so an interrupted extraction is never used
+    with open(os.path.join(directory, META_FILENAME), "w") as meta_f:
+        json.dump(meta, meta_f)
+
+
+def build_extraction_dataset(config, subset, class_names):
+    """
+    Same images as `data_pipeline.build_dataset()` but with integer labels
+    and without caching, they are only read once per copy. Images are never
+    augmented by the pipeline, `extract_features()` only augments the extra
+    copies.
+    """
+    data_config = dict(config["data"], label_mode="int")
+    data_config["pipeline"] = dict(
+        data_config.get("pipeline") or {}, cache=None, augment=False
+    )
+
+    return data_pipeline.build_dataset(
+        dict(config, data=data_config), subset, class_names
+    )
+
+
+def load_features_dataset(config, subset, class_names, shuffle=False):
+    """
+    Creates a dataset reading embeddings and labels from the store. Batches
+    are sliced straight from the memory-mapped files, so the store doesn't
+    need to fit in memory.
+
+    Parameters
+    ----------
+    config : dict
+        Experiment settings as Python dict.
+
+    subset : str
+        One of "training" or "validation".
+
+    class_names : list
+        List of classes as string.
+
+    shuffle : bool
+        Whether to shuffle the embeddings on each epoch.
+
+    Returns
+    -------
+    dataset : tf.data.Dataset
+        Dataset yielding (features, labels) batches, labels encoded
+        following `data.label_mode`.
+    """
+    directory = config["features"]["directory"]
+    batch_size = config["data"].get("batch_size", 32)
+    label_mode = config["data"].get("label_mode", "int")
+    features = np.load(
+        os.path.join(directory, "{}_features.npy".format(subset)), mmap_mode="r"
+    )
+    labels = np.load(
+        os.path.join(directory, "{}_labels.npy".format(subset)), mmap_mode="r"
+    )
+    rng = np.random.default_rng(config["seed"])
+
+    def generator():
+        order = rng.permutation(len(labels)) if shuffle else np.arange(len(labels))
+        for start in range(0, len(order), batch_size):
+            # Sorted indexes give sequential reads from the files
+            idxs = np.sort(order[start : start + batch_size])
+            yield features[idxs], labels[idxs]
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec(shape=(None, features.shape[1]), dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        ),
+    )
+    dataset = dataset.map(
+        lambda x, y: (
+            x,
+            data_pipeline.encode_label(y, label_mode, len(class_names)),
+        ),
+        num_parallel_calls=data_pipeline.AUTOTUNE,
+    )
+
+    return dataset.prefetch(data_pipeline.AUTOTUNE)
@@ -0,0 +1,292 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from utils import detection, utils
+
+# Marks the end of the work on the pipeline queues
+STOP = None
+
+
+class StageError:
+    """
+    Wraps an exception raised inside a stage, so it can be raised again by
+    the caller.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+def get_item(q, stop_event):
+    """
+    Gets the next item of a pipeline queue, or STOP if the pipeline is
+    stopping.
+    """
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+    return STOP
+
+
+def put_item(q, item, stop_event):
+    """
+    Puts an item in a pipeline queue, unless the pipeline is stopping.
+    """
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def crop_and_resize(img, box_coordinates, input_size):
+    """
+    Crops the vehicle from a BGR image and resizes it for the classifier,
+    same as loading the cropped picture with `utils.load_image_array()`
+    would do but without writing it to disk.
+
+    Parameters
+    ----------
+    img : numpy.ndarray
+        BGR image, as loaded by `cv2.imread()`.
+
+    box_coordinates : tuple
+        Vehicle box as (x1, y1, x2, y2).
+
+    input_size : tuple
+        Classifier input size as (height, width).
+
+    Returns
+    -------
+    img_array : numpy.ndarray
+        float32 RGB image.
+    """
+    x1, y1, x2, y2 = box_coordinates
+    crop = np.ascontiguousarray(img[y1:y2, x1:x2, ::-1])
+    crop = Image.fromarray(crop).resize((input_size[1], input_size[0]), Image.NEAREST)
+
+    return np.asarray(crop, dtype=np.float32)
+
+
+class DetectClassifyPipeline:
+    """
+    Runs the vehicle detector and the classifier as two concurrent stages
+    connected by bounded queues. While the classifier works on a batch of
+    crops, the detector is already processing the next images, and crops
+    are passed in memory as arrays.
+
+    Latency of each stage is recorded per image, see `latency_report()`.
+
+    If a stage fails, or the caller stops reading the predictions, both
+    stages are stopped, so none of them waits forever on a queue nobody
+    reads.
+    """
+
+    def __init__(
+        self,
+        model,
+        class_names,
+        input_size,
+        detect_batch_size=4,
+        classify_batch_size=32,
+        max_wait_ms=5.0,
+        queue_size=64,
+    ):
+        """
+        Parameters
+        ----------
+        model : keras.Model
+            Loaded keras model, or any callable receiving an image batch
+            and returning scores.
+
+        class_names : list
+            List of classes as string, same order used for training.
+
+        input_size : tuple
+            Classifier input size as (height, width).
+
+        detect_batch_size : int
+            Number of images sent to the detector at once.
+
+        classify_batch_size : int
+            Max number of crops sent to the classifier at once.
+
+        max_wait_ms : float
+            Max time the classifier waits for more crops to fill a batch.
+
+        queue_size : int
+            Max number of images waiting between two stages.
+        """
+        self.class_names = class_names
+        self.input_size = input_size
+        self.detect_batch_size = detect_batch_size
+        self.classify_batch_size = classify_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue_size = queue_size
+        self.predict_step = model
+        if isinstance(model, tf.keras.Model):
+            self.predict_step = utils.make_predict_step(model)
+        self.latencies = {"detection": [], "classification": [], "end_to_end": []}
+
+    def _detect(self, imgs, crops_q, stop_event):
+        """
+        Detection stage, finds the vehicles and crops them.
+        """
+        try:
+            batch = []
+            for img in imgs:
+                if stop_event.is_set():
+                    return
+                batch.append((time.time(), img))
+                if len(batch) == self.detect_batch_size:
+                    self._detect_batch(batch, crops_q, stop_event)
+                    batch = []
+            if batch:
+                self._detect_batch(batch, crops_q, stop_event)
+            put_item(crops_q, STOP, stop_event)
+        except Exception as e:
+            put_item(crops_q, StageError(e), stop_event)
+
+    def _detect_batch(self, batch, crops_q, stop_event):
+        start = time.time()
+        boxes = detection.get_vehicle_coordinates_batch(
+            [img for _, img in batch], batch_size=len(batch)
+        )
+        crops = [
+            crop_and_resize(img, box, self.input_size)
+            for (_, img), box in zip(batch, boxes)
+        ]
+        elapsed = (time.time() - start) / len(batch)
+        for (arrival, _), box, crop in zip(batch, boxes, crops):
+            self.latencies["detection"].append(elapsed)
+            put_item(crops_q, (arrival, box, crop), stop_event)
+
+    def _classify(self, crops_q, results_q, stop_event):
+        """
+        Classification stage, groups crops in batches and runs the model.
+        """
+        done = False
+        while not done:
+            item = get_item(crops_q, stop_event)
+            if item is STOP or isinstance(item, StageError):
+                put_item(results_q, item, stop_event)
+                return
+
+            # Wait a little for more crops to fill the batch
+            batch = [item]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.classify_batch_size:
+                try:
+                    item = crops_q.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is STOP or isinstance(item, StageError):
+                    done = True
+                    break
+                batch.append(item)
+
+            try:
+                start = time.time()
+                scores = np.asarray(
+                    self.predict_step(np.stack([crop for _, _, crop in batch]))
+                )
+                elapsed = (time.time() - start) / len(batch)
+            except Exception as e:
+                put_item(results_q, StageError(e), stop_event)
+                return
+
+            for (arrival, box, _), img_scores in zip(batch, scores):
+                self.latencies["classification"].append(elapsed)
+                put_item(results_q, (arrival, box, img_scores), stop_event)
+
+        put_item(results_q, item, stop_event)
+
+    def predict(self, imgs):
+        """
+        Detects and classifies the vehicle in each image.
+
+        Parameters
+        ----------
+        imgs : iterable
+            BGR images as numpy.ndarray, it can be a lazy generator.
+
+        Returns
+        -------
+            For each image, in the same order, yields a dict having the
+            vehicle `box` as (x1, y1, x2, y2), the predicted `class_name`
+            and its `score`.
+        """
+        crops_q = queue.Queue(maxsize=self.queue_size)
+        results_q = queue.Queue(maxsize=self.queue_size)
+        stop_event = threading.Event()
+        stages = [
+            threading.Thread(
+                target=self._detect, args=(imgs, crops_q, stop_event), daemon=True
+            ),
+            threading.Thread(
+                target=self._classify,
+                args=(crops_q, results_q, stop_event),
+                daemon=True,
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+
+        try:
+            while True:
+                try:
+                    item = results_q.get(timeout=0.1)
+                except queue.Empty:
+                    if not stages[1].is_alive() and results_q.empty():
+                        raise RuntimeError(
+                            "The classification stage stopped before finishing"
+                        )
+                    continue
+                if item is STOP:
+                    break
+                if isinstance(item, StageError):
+                    raise item.error
+
+                arrival, box, scores = item
+                self.latencies["end_to_end"].append(time.time() - arrival)
+                max_idx = int(np.argmax(scores))
+                yield {
+                    "box": box,
+                    "class_name": self.class_names[max_idx],
+                    "score": float(scores[max_idx]),
+                }
+        finally:
+            stop_event.set()
+            for stage in stages:
+                stage.join()
+
+    def latency_report(self):
+        """
+        Summarizes the latency per image of each stage.
+
+        Returns
+        -------
+        report : dict
+            For each stage, mean, p50 and p95 latency in milliseconds.
+        """
+        report = {}
+        for stage, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies_ms = np.array(latencies) * 1000
+            report[stage] = {
+                "mean_ms": float(latencies_ms.mean()),
+                "p50_ms": float(np.percentile(latencies_ms, 50)),
+                "p95_ms": float(np.percentile(latencies_ms, 95)),
+            }
+
+        return report
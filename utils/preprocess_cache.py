@@ -0,0 +1,356 @@
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+# Marks images without a crop box in the decoding pipeline
+NO_BOX = (-1, -1, -1, -1)
+
+# Libraries images can be decoded and resized with, their results differ
+DECODERS = ("tf", "pil")
+
+# `keras.utils.load_img()` color modes for each number of channels
+PIL_COLOR_MODES = {1: "grayscale", 3: "rgb", 4: "rgba"}
+
+
+def decode_image_file(path, box, image_size, num_channels=3, interpolation="bilinear"):
+    """
+    Reads and decodes an image, optionally crops it to `box` as
+    (x1, y1, x2, y2), and resizes it to uint8 pixels.
+    """
+    img = tf.io.read_file(path)
+    img = tf.image.decode_image(img, channels=num_channels, expand_animations=False)
+    if box[0] >= 0:
+        img = tf.image.crop_to_bounding_box(
+            img, box[1], box[0], box[3] - box[1], box[2] - box[0]
+        )
+    img = tf.image.resize(img, image_size, method=interpolation)
+    img = tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+    img.set_shape((image_size[0], image_size[1], num_channels))
+
+    return img
+
+
+def load_pil_image(path, box, image_size, num_channels=3, interpolation="nearest"):
+    """
+    Same as `decode_image_file()` but decoding and resizing with PIL, like
+    `keras.utils.load_img()` and `utils.utils.load_image_array()` do.
+    """
+    img = tf.keras.utils.load_img(path, color_mode=PIL_COLOR_MODES[num_channels])
+    if box is not None:
+        img = img.crop(tuple(box))
+    size = (image_size[1], image_size[0])
+    if img.size != size:
+        img = img.resize(size, Image.Resampling[interpolation.upper()])
+
+    return np.asarray(img, dtype=np.uint8).reshape(size[::-1] + (num_channels,))
+
+
+class PreprocessCache:
+    """
+    On-disk store of decoded and resized images, so repeated experiments at
+    the same resolution skip JPEG decoding entirely.
+
+    Images are appended as uint8 rows to a single array file read through a
+    memory map, see `images`. An SQLite index maps each entry to its row.
+    Entries are keyed by a hash of the source file content together with
+    the crop box, so changed images get a new entry and renamed or copied
+    images are still a hit. File size and modification time are kept for
+    each path, unchanged files are not hashed again.
+
+    Images are decoded with TensorFlow, like `utils.data_pipeline`, or with
+    PIL, like `utils.utils.predict_from_folder()`. Both resize differently,
+    so a cache only matches the one it was created for. There's one array
+    file for each image size, interpolation method and decoder.
+    """
+
+    def __init__(
+        self,
+        directory,
+        image_size,
+        num_channels=3,
+        interpolation="bilinear",
+        decoder="tf",
+    ):
+        """
+        Parameters
+        ----------
+        directory : str
+            Full path to the cache folder, created if missing.
+
+        image_size : tuple
+            Stored image size as (height, width).
+
+        num_channels : int
+            Number of channels of the stored images.
+
+        interpolation : str
+            Resizing method, see `tf.image.resize()` and
+            `keras.utils.load_img()`.
+
+        decoder : str
+            "tf" to decode images like `utils.data_pipeline.load_image()`,
+            "pil" like `utils.utils.load_image_array()`.
+        """
+        if decoder not in DECODERS:
+            raise ValueError(
+                "Unknown decoder {}, expected one of {}".format(
+                    decoder, ", ".join(DECODERS)
+                )
+            )
+        self.image_size = tuple(image_size)
+        self.num_channels = num_channels
+        self.interpolation = interpolation
+        self.decoder = decoder
+        self.row_shape = self.image_size + (num_channels,)
+        self.row_bytes = int(np.prod(self.row_shape))
+
+        folder_name = "{}x{}x{}_{}".format(
+            *self.image_size, num_channels, interpolation
+        )
+        if decoder != "tf":
+            folder_name += "_" + decoder
+        self.folder = os.path.join(directory, folder_name)
+        os.makedirs(self.folder, exist_ok=True)
+        self.data_path = os.path.join(self.folder, "images.u8")
+        open(self.data_path, "ab").close()
+
+        self._lock = threading.Lock()
+        self._images = None
+        self._conn = sqlite3.connect(
+            os.path.join(self.folder, "index.sqlite"),
+            timeout=60,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources "
+            "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+        )
+        self._conn.commit()
+
+    def __len__(self):
+        return os.path.getsize(self.data_path) // self.row_bytes
+
+    @property
+    def images(self):
+        """
+        Read-only memory map over all the stored images, with shape
+        (rows, height, width, channels).
+        """
+        num_rows = len(self)
+        if self._images is None or len(self._images) != num_rows:
+            if num_rows == 0:
+                return np.zeros((0,) + self.row_shape, dtype=np.uint8)
+            self._images = np.memmap(
+                self.data_path,
+                dtype=np.uint8,
+                mode="r",
+                shape=(num_rows,) + self.row_shape,
+            )
+
+        return self._images
+
+    def source_digests(self, paths):
+        """
+        Returns the hash of each source file content, only reading the
+        files that are new or changed since they were last hashed.
+        """
+        with self._lock:
+            known = {
+                path: (size, mtime_ns, digest)
+                for path, size, mtime_ns, digest in self._conn.execute(
+                    "SELECT path, size, mtime_ns, digest FROM sources"
+                )
+            }
+
+        digests = []
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = known.get(path)
+            if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                digests.append(entry[2])
+                continue
+
+            with open(path, "rb") as f:
+                digest = hashlib.blake2b(f.read(), digest_size=20).hexdigest()
+            digests.append(digest)
+            changed.append((path, stat.st_size, stat.st_mtime_ns, digest))
+
+        if changed:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)", changed
+                )
+                self._conn.commit()
+
+        return digests
+
+    @staticmethod
+    def entry_key(digest, box=None):
+        if box is None:
+            return digest
+
+        return "{}:{},{},{},{}".format(digest, *box)
+
+    def update(self, paths, boxes=None, batch_size=64):
+        """
+        Makes sure every image is in the cache, decoding only the missing
+        ones, and returns their rows in `images`.
+
+        Parameters
+        ----------
+        paths : list
+            Full path to the source image files.
+
+        boxes : list
+            Optional crop box for each image as (x1, y1, x2, y2), or None to
+            keep the full image.
+
+        batch_size : int
+            Number of images decoded before writing them to disk.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Row of each image in `images`, in the same order as `paths`.
+        """
+        paths = [os.fspath(path) for path in paths]
+        boxes = boxes if boxes is not None else [None] * len(paths)
+        keys = [
+            self.entry_key(digest, box)
+            for digest, box in zip(self.source_digests(paths), boxes)
+        ]
+
+        # Only one process appends at a time
+        with open(os.path.join(self.folder, "lock"), "w") as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            rows = self._lookup(keys)
+            missing = {}
+            for path, box, key in zip(paths, boxes, keys):
+                if key not in rows and key not in missing:
+                    missing[key] = (path, box)
+            if missing:
+                rows.update(self._append(missing, batch_size))
+
+        return np.array([rows[key] for key in keys], dtype=np.int64)
+
+    def _lookup(self, keys):
+        rows = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                chunk = unique_keys[start : start + 500]
+                rows.update(
+                    self._conn.execute(
+                        "SELECT key, row FROM entries WHERE key IN ({})".format(
+                            ",".join("?" * len(chunk))
+                        ),
+                        chunk,
+                    ).fetchall()
+                )
+
+        return rows
+
+    def _decode_batches(self, paths, boxes, batch_size):
+        """
+        Decodes the images in parallel, yields uint8 batches of them.
+        """
+        if self.decoder == "pil":
+            with ThreadPoolExecutor() as executor:
+                for start in range(0, len(paths), batch_size):
+                    yield np.stack(
+                        list(
+                            executor.map(
+                                lambda path, box: load_pil_image(
+                                    path,
+                                    box,
+                                    self.image_size,
+                                    self.num_channels,
+                                    self.interpolation,
+                                ),
+                                paths[start : start + batch_size],
+                                boxes[start : start + batch_size],
+                            )
+                        )
+                    )
+            return
+
+        boxes = [box or NO_BOX for box in boxes]
+        dataset = tf.data.Dataset.from_tensor_slices((paths, boxes))
+        dataset = dataset.map(
+            lambda path, box: decode_image_file(
+                path, box, self.image_size, self.num_channels, self.interpolation
+            ),
+            num_parallel_calls=tf.data.AUTOTUNE,
+        )
+        dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        for batch in dataset:
+            yield batch.numpy()
+
+    def _append(self, missing, batch_size):
+        """
+        Decodes the missing images in parallel and appends them to the
+        array file.
+        """
+        keys = list(missing)
+        paths = [missing[key][0] for key in keys]
+        boxes = [missing[key][1] for key in keys]
+
+        rows = {}
+        next_row = len(self)
+        with open(self.data_path, "r+b") as data_f:
+            # Drop any partial row left by an interrupted run
+            data_f.truncate(next_row * self.row_bytes)
+            data_f.seek(0, os.SEEK_END)
+            position = 0
+            for batch in self._decode_batches(paths, boxes, batch_size):
+                data_f.write(batch.tobytes())
+                data_f.flush()
+                batch_keys = keys[position : position + len(batch)]
+                batch_rows = range(next_row, next_row + len(batch))
+                with self._lock:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                        zip(batch_keys, batch_rows),
+                    )
+                    self._conn.commit()
+                rows.update(zip(batch_keys, batch_rows))
+                position += len(batch)
+                next_row += len(batch)
+
+        return rows
+
+    def iter_batches(self, paths, batch_size=32):
+        """
+        Same as `utils.iter_image_batches()` but reading the images from the
+        cache, missing ones are added first. Each batch is copied out of
+        the memory map.
+
+        Returns
+        -------
+            For each batch, yields a tuple having the list of image paths and a
+            float32 numpy.ndarray with shape (batch, height, width, channels).
+        """
+        paths = list(paths)
+        rows = self.update(paths)
+        images = self.images
+        for start in range(0, len(paths), batch_size):
+            batch_rows = rows[start : start + batch_size]
+            yield paths[start : start + batch_size], images[batch_rows].astype(
+                np.float32
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,177 @@
+import copy
+
+# Settings each stage of `fit.schedule` can change, besides `epochs`
+STAGE_KEYS = ("image_size", "batch_size", "data_aug_layer", "trainable_from")
+
+
+def parse_schedule(fit_config):
+    """
+    Splits training in stages following `fit.schedule` in the experiment
+    config, e.g. progressive resizing with a few epochs at low resolution
+    before the final `data.image_size`:
+
+        fit:
+            epochs: 30
+            schedule:
+                - {epochs: 10, image_size: [128, 128]}
+                - {epochs: 10, image_size: [176, 176]}
+                - {image_size: [224, 224]}
+
+    Each stage runs for its `epochs`, the last one can leave it out to run
+    until `fit.epochs`. Supported stage settings are in `STAGE_KEYS`,
+    settings not given keep the experiment value. A stage `data_aug_layer`
+    only applies when augmentation runs in the input pipeline, see
+    `data.pipeline.augment`. A stage `trainable_from` unfreezes the model
+    from that layer on, it holds for the next stages until one changes it,
+    e.g. training the head alone before finetuning the last Resnet50 stage:
+
+        fit:
+            epochs: 30
+            schedule:
+                - {epochs: 3, trainable_from: "head"}
+                - {epochs: 10, trainable_from: "conv5_block1"}
+                - {trainable_from: "all"}
+
+    Without a schedule, training is a single stage.
+
+    Parameters
+    ----------
+    fit_config : dict
+        `fit` section of the experiment config.
+
+    Returns
+    -------
+    stages : list
+        One dict for each stage with its `initial_epoch`, last `epochs` (as
+        `keras.Model.fit()` expects them) and the settings it changes.
+    """
+    total_epochs = fit_config.get("epochs", 1)
+    schedule = fit_config.get("schedule") or [{}]
+
+    stages = []
+    initial_epoch = fit_config.get("initial_epoch", 0)
+    for i, stage_config in enumerate(schedule):
+        unknown = set(stage_config) - set(STAGE_KEYS) - {"epochs"}
+        if unknown:
+            raise ValueError(
+                "Unknown settings in schedule stage {}: {}".format(
+                    i, ", ".join(sorted(unknown))
+                )
+            )
+        if "epochs" not in stage_config and i != len(schedule) - 1:
+            raise ValueError(
+                "Only the last schedule stage can leave out `epochs`, "
+                "stage {} doesn't have it".format(i)
+            )
+
+        if "epochs" in stage_config:
+            epochs = initial_epoch + stage_config["epochs"]
+        else:
+            epochs = total_epochs
+        if epochs > total_epochs:
+            raise ValueError(
+                "Schedule stages run for {} epochs, more than `fit.epochs` "
+                "({})".format(epochs, total_epochs)
+            )
+
+        stage = {k: stage_config[k] for k in STAGE_KEYS if k in stage_config}
+        stage.update(initial_epoch=initial_epoch, epochs=epochs)
+        stages.append(stage)
+        initial_epoch = epochs
+
+    return stages
+
+
+def has_variable_image_size(stages, image_size):
+    """
+    Returns True if the image size changes between stages, the model input
+    must then accept any height and width. `image_size` is the one used by
+    stages that don't set it.
+    """
+    image_sizes = {tuple(stage.get("image_size", image_size)) for stage in stages}
+
+    return len(image_sizes) > 1
+
+
+def get_stage_config(config, stage):
+    """
+    Returns a copy of the experiment config with the `data` and `model`
+    settings of a stage applied. Datasets for the stage are built from it.
+    """
+    config = dict(config)
+    config["data"] = copy.deepcopy(config["data"])
+    config["model"] = copy.deepcopy(config.get("model", {}))
+
+    if "image_size" in stage:
+        config["data"]["image_size"] = list(stage["image_size"])
+    if "batch_size" in stage:
+        config["data"]["batch_size"] = stage["batch_size"]
+    if "data_aug_layer" in stage:
+        config["model"]["data_aug_layer"] = stage["data_aug_layer"]
+
+    return config
+
+
+def get_fit_args(fit_config, stage):
+    """
+    Returns the `keras.Model.fit()` arguments for a stage.
+    """
+    fit_args = {k: v for k, v in fit_config.items() if k != "schedule"}
+    fit_args.update(initial_epoch=stage["initial_epoch"], epochs=stage["epochs"])
+
+    return fit_args
+
+
+def fit_stage(model, train_ds, val_ds, callbacks, fit_args, initial_step=0):
+    """
+    Runs `model.fit()` for a stage. When resuming in the middle of an
+    epoch, its first `initial_step` batches are skipped and training
+    continues from the next one. Build `train_ds` with the `data_epoch` of
+    `TrainingCheckpoint` so the epoch is read in the same order as before
+    the restart, see `data_pipeline.build_dataset()`. If all the batches of that epoch were
+    done, e.g. the job was killed during validation, training continues
+    from the next epoch.
+
+    Parameters
+    ----------
+    model : keras.Model
+        Compiled model.
+
+    train_ds, val_ds : tf.data.Dataset
+        Training and validation datasets.
+
+    callbacks : list
+        Keras callbacks.
+
+    fit_args : dict
+        Other `fit()` arguments, see `get_fit_args()`.
+
+    initial_step : int
+        Number of steps of the first epoch already done.
+    """
+    if initial_step:
+        num_steps = fit_args.get("steps_per_epoch")
+        if num_steps is None:
+            num_steps = int(train_ds.cardinality())
+        if 0 <= num_steps <= initial_step:
+            initial_step = 0
+            fit_args = dict(fit_args, initial_epoch=fit_args["initial_epoch"] + 1)
+            if fit_args["initial_epoch"] >= fit_args["epochs"]:
+                return
+
+    if initial_step:
+        epoch = fit_args["initial_epoch"]
+        partial_args = dict(fit_args, epochs=epoch + 1)
+        if "steps_per_epoch" in fit_args:
+            partial_args["steps_per_epoch"] = fit_args["steps_per_epoch"] - initial_step
+        model.fit(
+            train_ds.skip(initial_step),
+            validation_data=val_ds,
+            callbacks=callbacks,
+            **partial_args,
+        )
+        if model.stop_training or epoch + 1 >= fit_args["epochs"]:
+            return
+        fit_args = dict(fit_args, initial_epoch=epoch + 1)
+
+    model.fit(train_ds, validation_data=val_ds, callbacks=callbacks, **fit_args)
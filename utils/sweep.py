@@ -0,0 +1,319 @@
+import copy
+import csv
+import math
+import os
+
+# Supported distributions for the sweep search space
+DISTRIBUTIONS = ("uniform", "loguniform", "randint", "choice")
+
+
+def parse_sweep_config(sweep_config):
+    """
+    Fills the sweep settings with the default values.
+
+    Supported settings:
+        - `space`: parameters to search, keyed by their dotted path in the
+          experiment config, e.g. `model.dropout_rate: {uniform: [0, 0.5]}`.
+          See `DISTRIBUTIONS`.
+        - `num_trials`: number of sampled configurations.
+        - `metric` and `mode`: value logged by Keras used to rank trials,
+          "max" or "min" is better.
+        - `min_epochs` and `reduction_factor`: trials run for `min_epochs`
+          first, only the best 1 / `reduction_factor` of them get
+          `reduction_factor` times more epochs, and so on until `fit.epochs`.
+          See `AsyncSuccessiveHalving`.
+        - `seed`: seed used to sample the trials.
+
+    Parameters
+    ----------
+    sweep_config : dict
+        Sweep settings coming from the sweep YAML config file.
+
+    Returns
+    -------
+    sweep_config : dict
+        Sweep settings with all the keys present.
+    """
+    sweep_config = dict(sweep_config)
+    sweep_config.setdefault("num_trials", 10)
+    sweep_config.setdefault("metric", "val_accuracy")
+    sweep_config.setdefault("mode", "max")
+    sweep_config.setdefault("min_epochs", 1)
+    sweep_config.setdefault("reduction_factor", 3)
+    sweep_config.setdefault("seed", 123)
+
+    if not sweep_config.get("space"):
+        raise ValueError("The sweep config must have a `space` to search")
+    for name, distribution in sweep_config["space"].items():
+        if len(distribution) != 1 or next(iter(distribution)) not in DISTRIBUTIONS:
+            raise ValueError(
+                "Invalid distribution for {}: {}".format(name, distribution)
+            )
+    if sweep_config["mode"] not in ("max", "min"):
+        raise ValueError("Unknown mode: {}".format(sweep_config["mode"]))
+    if sweep_config["min_epochs"] < 1:
+        raise ValueError("`min_epochs` must be at least 1")
+    if sweep_config["reduction_factor"] < 2:
+        raise ValueError("`reduction_factor` must be at least 2")
+
+    return sweep_config
+
+
+def sample_params(space, rng):
+    """
+    Samples a value for each parameter of the search space.
+
+    Parameters
+    ----------
+    space : dict
+        Search space, see `parse_sweep_config()`.
+
+    rng : random.Random
+        Random number generator.
+
+    Returns
+    -------
+    params : dict
+        Sampled value of each parameter, keyed by its dotted path.
+    """
+    params = {}
+    for name, distribution in space.items():
+        kind, args = next(iter(distribution.items()))
+        if kind == "uniform":
+            params[name] = rng.uniform(*args)
+        elif kind == "loguniform":
+            params[name] = math.exp(rng.uniform(math.log(args[0]), math.log(args[1])))
+        elif kind == "randint":
+            params[name] = rng.randint(*args)
+        else:
+            params[name] = rng.choice(args)
+
+    return params
+
+
+def set_param(config, name, value):
+    """
+    Sets a value in the experiment config from its dotted path, e.g.
+    "compile.optimizer.adam.learning_rate". Missing sections are created.
+    """
+    keys = name.split(".")
+    for key in keys[:-1]:
+        config = config.setdefault(key, {})
+    config[keys[-1]] = value
+
+
+def truncate_schedule(schedule, epochs):
+    """
+    Keeps the `fit.schedule` stages starting before `epochs`, the last one
+    runs until `fit.epochs`. Shorter trials then follow the same stages as
+    the full run and can be continued later.
+    """
+    truncated = []
+    initial_epoch = 0
+    for stage in schedule:
+        if initial_epoch >= epochs:
+            break
+        truncated.append(dict(stage))
+        initial_epoch += stage.get("epochs", epochs)
+
+    if truncated and initial_epoch >= epochs:
+        truncated[-1].pop("epochs", None)
+
+    return truncated
+
+
+def create_trial_config(base_config, params, trial_dir, epochs):
+    """
+    Creates the experiment config of a trial. Every output is written
+    inside `trial_dir`: the training state is checkpointed so the trial can
+    continue for more epochs, and the metrics of each epoch go to
+    `history.csv`.
+
+    Parameters
+    ----------
+    base_config : dict
+        Experiment settings shared by all the trials.
+
+    params : dict
+        Trial parameters, see `sample_params()`.
+
+    trial_dir : str
+        Full path to the trial folder.
+
+    epochs : int
+        Number of epochs to train the trial for.
+
+    Returns
+    -------
+    config : dict
+        Trial experiment settings.
+    """
+    config = copy.deepcopy(base_config)
+    for name, value in params.items():
+        set_param(config, name, value)
+
+    fit_config = config.setdefault("fit", {})
+    fit_config["epochs"] = epochs
+    if fit_config.get("schedule"):
+        fit_config["schedule"] = truncate_schedule(fit_config["schedule"], epochs)
+
+    callbacks = fit_config.get("callbacks") or {}
+    if "model_checkpoint" in callbacks:
+        callbacks["model_checkpoint"]["filepath"] = os.path.join(
+            trial_dir,
+            "models",
+            os.path.basename(callbacks["model_checkpoint"]["filepath"]),
+        )
+    if "tensor_board" in callbacks:
+        callbacks["tensor_board"]["log_dir"] = os.path.join(trial_dir, "logs")
+    if "profiler" in callbacks:
+        callbacks["profiler"]["log_dir"] = os.path.join(trial_dir, "profile")
+    callbacks["training_checkpoint"] = dict(
+        callbacks.get("training_checkpoint") or {},
+        directory=os.path.join(trial_dir, "checkpoints"),
+    )
+    callbacks["csv_logger"] = {
+        "filename": os.path.join(trial_dir, "history.csv"),
+        "append": True,
+    }
+    fit_config["callbacks"] = callbacks
+
+    return config
+
+
+def read_metric(history_path, metric):
+    """
+    Returns the value of `metric` for the last epoch logged in a Keras
+    `CSVLogger` file.
+    """
+    with open(history_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError("No epochs logged in {}".format(history_path))
+
+    last_row = max(rows, key=lambda row: int(row["epoch"]))
+    if metric not in last_row:
+        raise ValueError("Metric {} not logged in {}".format(metric, history_path))
+
+    return float(last_row[metric])
+
+
+def get_rungs(min_epochs, max_epochs, reduction_factor=3):
+    """
+    Returns the number of epochs trials are trained for at each rung of
+    successive halving, e.g. [1, 3, 9, 20] up to `max_epochs`.
+    """
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= reduction_factor
+
+    return rungs + [max_epochs]
+
+
+class AsyncSuccessiveHalving:
+    """
+    Asynchronous successive halving (ASHA) scheduler. Every trial starts at
+    the first rung. Whenever a worker is free, the best trial of the
+    highest rung that is in the top 1 / `reduction_factor` of its rung and
+    wasn't promoted yet continues to the next rung. If there's none, a new
+    trial starts. Trials that are never promoted are stopped early.
+
+    Promotions don't wait for a rung to be complete, so workers are never
+    idle waiting for slow trials.
+    """
+
+    def __init__(self, rungs, reduction_factor=3, mode="max"):
+        """
+        Parameters
+        ----------
+        rungs : list
+            Number of epochs of each rung, see `get_rungs()`.
+
+        reduction_factor : int
+            Only the best 1 / `reduction_factor` trials of a rung are
+            promoted.
+
+        mode : str
+            "max" if higher metric values are better, "min" otherwise.
+        """
+        self.rungs = rungs
+        self.reduction_factor = reduction_factor
+        self.mode = mode
+        self.results = [{} for _ in rungs]
+        self.promoted = [set() for _ in rungs]
+
+    def report(self, trial_id, rung, value):
+        """
+        Records the metric of a trial that finished training up to `rung`.
+        """
+        self.results[rung][trial_id] = value
+
+    def get_promotion(self):
+        """
+        Returns (trial_id, rung) for the next trial to continue training,
+        or None if no trial can be promoted yet.
+        """
+        for rung in reversed(range(len(self.rungs) - 1)):
+            results = self.results[rung]
+            ranked = sorted(results, key=results.get, reverse=self.mode == "max")
+            for trial_id in ranked[: len(ranked) // self.reduction_factor]:
+                if trial_id not in self.promoted[rung]:
+                    self.promoted[rung].add(trial_id)
+                    return trial_id, rung + 1
+
+        return None
+
+
+def write_leaderboard(path, trials, mode="max"):
+    """
+    Writes the trials ranked by their metric, best first. Trials trained
+    for more epochs come first, as their metric is more reliable. Failed
+    trials go last.
+
+    Parameters
+    ----------
+    path : str
+        Full path to the CSV file.
+
+    trials : list
+        Trials as dicts with `trial`, `status`, `epochs`, `metric` and
+        `params`.
+
+    mode : str
+        "max" if higher metric values are better, "min" otherwise.
+
+    Returns
+    -------
+    leaderboard : list
+        Rows written, as dicts.
+    """
+    sign = -1 if mode == "max" else 1
+
+    def sort_key(trial):
+        if trial["metric"] is None:
+            return (1, 0, 0)
+        return (0, -trial["epochs"], sign * trial["metric"])
+
+    param_names = sorted({name for trial in trials for name in trial["params"]})
+    leaderboard = []
+    for rank, trial in enumerate(sorted(trials, key=sort_key), start=1):
+        row = {
+            "rank": rank,
+            "trial": trial["trial"],
+            "status": trial["status"],
+            "epochs": trial["epochs"],
+            "metric": trial["metric"],
+        }
+        row.update({name: trial["params"].get(name) for name in param_names})
+        leaderboard.append(row)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=["rank", "trial", "status", "epochs", "metric"] + param_names
+        )
+        writer.writeheader()
+        writer.writerows(leaderboard)
+
+    return leaderboard
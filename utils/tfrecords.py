@@ -0,0 +1,129 @@
+import glob
+import json
+import os
+
+import tensorflow as tf
+
+# Sidecar file stored next to the shards, with the class names in label
+# order and the number of examples in each shard
+CLASS_INDEX_FILENAME = "classes.json"
+
+SHARD_PATTERN = "{subset}-{index:05d}-of-{total:05d}.tfrecord"
+
+# Features stored for each image
+FEATURES = {
+    "image/encoded": tf.io.FixedLenFeature([], tf.string),
+    "image/label": tf.io.FixedLenFeature([], tf.int64),
+    "image/filename": tf.io.FixedLenFeature([], tf.string, default_value=""),
+}
+
+
+def image_example(image_bytes, label, filename):
+    """
+    Creates the `tf.train.Example` stored for an image.
+
+    Parameters
+    ----------
+    image_bytes : bytes
+        Encoded image file content, e.g. JPEG.
+
+    label : int
+        Index of the image class in the class index.
+
+    filename : str
+        Original image file name.
+
+    Returns
+    -------
+    example : tf.train.Example
+        Example ready to be serialized.
+    """
+    feature = {
+        "image/encoded": tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[image_bytes])
+        ),
+        "image/label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+        "image/filename": tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[filename.encode()])
+        ),
+    }
+
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def parse_example(serialized):
+    """
+    Parses a serialized example, returns the encoded image and its label.
+    """
+    example = tf.io.parse_single_example(serialized, FEATURES)
+
+    return example["image/encoded"], tf.cast(example["image/label"], tf.int32)
+
+
+def write_shard(path, examples):
+    """
+    Writes a TFRecord file.
+
+    Parameters
+    ----------
+    path : str
+        Full path to the shard file.
+
+    examples : iterable
+        Tuples having the encoded image, label and file name.
+
+    Returns
+    -------
+    num_examples : int
+        Number of examples written.
+    """
+    num_examples = 0
+    with tf.io.TFRecordWriter(path) as writer:
+        for image_bytes, label, filename in examples:
+            example = image_example(image_bytes, label, filename)
+            writer.write(example.SerializeToString())
+            num_examples += 1
+
+    return num_examples
+
+
+def save_class_index(directory, class_names, num_examples):
+    """
+    Writes the class index sidecar file.
+
+    Parameters
+    ----------
+    directory : str
+        Folder having the shards.
+
+    class_names : list
+        List of classes as string, in label order.
+
+    num_examples : dict
+        Number of examples in each shard, keyed by the shard file name.
+    """
+    with open(os.path.join(directory, CLASS_INDEX_FILENAME), "w") as f:
+        json.dump(
+            {"class_names": class_names, "num_examples": num_examples}, f, indent=4
+        )
+
+
+def load_class_index(directory):
+    """
+    Reads the class index sidecar file, see `save_class_index()`.
+    """
+    with open(os.path.join(directory, CLASS_INDEX_FILENAME)) as f:
+        return json.load(f)
+
+
+def list_shards(directory):
+    """
+    Returns the full path to every shard in `directory`, sorted. Shards
+    are listed from the class index when there is one, so files left by
+    an earlier build are ignored.
+    """
+    if os.path.exists(os.path.join(directory, CLASS_INDEX_FILENAME)):
+        num_examples = load_class_index(directory)["num_examples"]
+        return sorted(os.path.join(directory, filename) for filename in num_examples)
+
+    return sorted(glob.glob(os.path.join(directory, "*.tfrecord")))
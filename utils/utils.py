@@ -1,8 +1,14 @@
+import collections
+import itertools
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import yaml
 import tensorflow as tf
 import numpy as np
 
+from utils import class_index, tfrecords
+
 
 def validate_config(config):
     """
@@ -60,7 +66,9 @@ def get_class_names(config):
     scores for each class. The challenge is, how to map our class names to
     each score in the output vector.
     We will use this function to provide a class order to Keras and keep
-    consistency between training and evaluation.
+    consistency between training and evaluation. Classes are sorted, so
+    the order never depends on the filesystem. Trained models keep their
+    own copy of this list, see `get_model_class_names()`.
 
     Parameters
     ----------
@@ -75,7 +83,105 @@ def get_class_names(config):
                 'FIAT 500 Abarth 2012', 'Jeep Patriot SUV 2012',
                 'Acura Integra Type R 2001', ...]
     """
-    return os.listdir(os.path.join(config["data"]["directory"]))
+    if config["data"].get("format") == "tfrecord":
+        # TFRecord shards store the labels, so the order is already fixed
+        return tfrecords.load_class_index(config["data"]["directory"])["class_names"]
+
+    directory = config["data"]["directory"]
+
+    return sorted(
+        name
+        for name in os.listdir(directory)
+        if os.path.isdir(os.path.join(directory, name))
+    )
+
+
+def get_model_class_names(model_path, config=None):
+    """
+    Returns the classes of a trained model, in model output order, from
+    the class index stored with it. See `utils.class_index`.
+
+    Models trained before the class index existed don't have one, for
+    them the classes are listed from the experiment data as a fallback,
+    in the same unsorted `os.listdir()` order they were trained with.
+
+    Parameters
+    ----------
+    model_path : str
+        Full path to the model file or folder.
+
+    config : dict
+        Experiment settings as Python dict, only used by the fallback.
+
+    Returns
+    -------
+    classes : list
+        List of classes as string.
+    """
+    try:
+        return class_index.load_class_names(model_path)
+    except FileNotFoundError:
+        if config is None:
+            raise
+        print(
+            "No {} found for {}, listing the classes from {}".format(
+                class_index.CLASS_INDEX_FILENAME,
+                model_path,
+                config["data"]["directory"],
+            )
+        )
+        return get_legacy_class_names(config)
+
+
+def get_legacy_class_names(config):
+    """
+    Returns the classes in the order models trained before the class index
+    existed used, see `get_model_class_names()`. Folders were listed with
+    `os.listdir()` without sorting, so this order must be kept to map their
+    outputs to the right classes.
+    """
+    if config["data"].get("format") == "tfrecord":
+        return get_class_names(config)
+
+    return os.listdir(config["data"]["directory"])
+
+
+def copy_class_index(model_path, folders, config=None):
+    """
+    Saves the class index of a trained model in the folders of the models
+    built from it, e.g. exported or quantized ones. For models without a
+    class index, the classes listed by `get_model_class_names()` are saved
+    with `legacy_order` so their outputs keep mapping to the same classes.
+
+    Parameters
+    ----------
+    model_path : str
+        Full path to the trained model file or folder.
+
+    folders : list
+        Full paths to the folders where the class index is saved.
+
+    config : dict
+        Experiment settings as Python dict, only used for models without a
+        class index.
+
+    Returns
+    -------
+    classes : list
+        List of classes as string, in model output order.
+    """
+    try:
+        index = class_index.load_class_index(model_path)
+        class_names = index["class_names"]
+        legacy_order = index.get("legacy_order", False)
+    except FileNotFoundError:
+        class_names = get_model_class_names(model_path, config)
+        legacy_order = True
+
+    for folder in folders:
+        class_index.save_class_index(folder, class_names, legacy_order)
+
+    return class_names
 
 
 def walkdir(folder):
@@ -97,7 +203,137 @@ def walkdir(folder):
             yield (dirpath, filename)
 
 
-def predict_from_folder(folder, model, input_size, class_names):
+def _chunks(iterable, size):
+    """
+    Splits an iterable into consecutive lists of at most `size` elements.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_image_array(img_path, input_size, interpolation="nearest"):
+    """
+    Loads a single image from disk and returns it as a float32 array ready
+    to be stacked into a model input batch.
+
+    Parameters
+    ----------
+    img_path : str
+        Full path to the image file.
+
+    input_size : tuple
+        Target image size as (height, width).
+
+    interpolation : str
+        Resizing method, see `keras.utils.load_img()`.
+
+    Returns
+    -------
+    img_array : numpy.ndarray
+        Image array with shape (height, width, channels).
+    """
+    img = tf.keras.utils.load_img(
+        img_path, target_size=(input_size), interpolation=interpolation
+    )
+
+    return tf.keras.utils.img_to_array(img)
+
+
+def iter_image_batches(
+    img_paths, input_size, batch_size=32, num_workers=None, interpolation="nearest"
+):
+    """
+    Decodes and resizes images on a thread pool and groups them into
+    fixed-size batches. The next batch is decoded while the current one is
+    being consumed, so the caller never waits on disk I/O when the model
+    is slower than decoding.
+
+    Parameters
+    ----------
+    img_paths : iterable
+        Paths to the image files, it can be a lazy generator.
+
+    input_size : tuple
+        Target image size as (height, width).
+
+    batch_size : int
+        Number of images per batch. The last batch may be smaller.
+
+    num_workers : int
+        Number of decoding threads. Defaults to ThreadPoolExecutor's own
+        default.
+
+    interpolation : str
+        Resizing method, see `load_image_array()`.
+
+    Returns
+    -------
+        For each batch, yields a tuple having the list of image paths and a
+        numpy.ndarray with shape (batch, height, width, channels).
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = collections.deque()
+        for chunk in _chunks(img_paths, batch_size):
+            pending.append(
+                (
+                    chunk,
+                    [
+                        executor.submit(load_image_array, p, input_size, interpolation)
+                        for p in chunk
+                    ],
+                )
+            )
+            # Keep one batch being decoded in background
+            if len(pending) > 1:
+                paths, futures = pending.popleft()
+                yield paths, np.stack([f.result() for f in futures])
+
+        while pending:
+            paths, futures = pending.popleft()
+            yield paths, np.stack([f.result() for f in futures])
+
+
+def make_predict_step(model):
+    """
+    Wraps a Keras model into a single compiled predict function. The batch
+    dimension is left unknown so the last, smaller batch doesn't trigger a
+    new trace.
+
+    Parameters
+    ----------
+    model : keras.Model
+        Loaded keras model.
+
+    Returns
+    -------
+    predict_step : tf.function
+        Function receiving an image batch and returning model scores.
+    """
+    input_spec = tf.TensorSpec(
+        shape=[None] + list(model.input_shape[1:]), dtype=tf.float32
+    )
+
+    @tf.function(input_signature=[input_spec])
+    def predict_step(img_batch):
+        return model(img_batch, training=False)
+
+    return predict_step
+
+
+def predict_from_folder(
+    folder,
+    model,
+    input_size,
+    class_names,
+    batch_size=32,
+    num_workers=None,
+    preprocess_cache=None,
+    interpolation="nearest",
+):
     """
     Walk through all the image files in a directory, loads them, applies
     the corresponding pre-processing and sends to the model to get
@@ -108,21 +344,43 @@ def predict_from_folder(folder, model, input_size, class_names):
     category are grouped into a folder with the corresponding class
     name. This is the same data structure as we used for training our model.
 
+    Images are decoded in parallel and sent to the model in batches of
+    `batch_size`, results are returned in the same order as `walkdir()`
+    yields the files.
+
     Parameters
     ----------
     folder : str
         Path to the folder you want to process.
 
     model : keras.Model
-        Loaded keras model.
+        Loaded keras model. Any other callable receiving an image batch and
+        returning scores can be used too, e.g. `models.export.TFLiteModel`.
 
     input_size : tuple
         Keras model input size, we must resize the image to math these
         dimensions.
 
-    class_names : list
+    class_names : list or str
         List of classes as string. It allow us to map model output IDs to the
         corresponding class name, e.g. 'Jeep Patriot SUV 2012'.
+        It can also be the full path to the model, then the class names are
+        read from its class index, see `get_model_class_names()`.
+
+    batch_size : int
+        Number of images sent to the model on each predict step.
+
+    num_workers : int
+        Number of threads used to decode images.
+
+    preprocess_cache : utils.preprocess_cache.PreprocessCache
+        If given, images are read from this cache instead of being decoded
+        every time. It must decode with PIL, `decoder="pil"`, like images
+        loaded here, and have the same image size as `input_size` and the
+        same `interpolation`.
+
+    interpolation : str
+        Resizing method, "nearest" by default as `keras.utils.load_img()`.
 
     Returns
     -------
@@ -132,41 +390,50 @@ def predict_from_folder(folder, model, input_size, class_names):
             - labels: is the list of the true labels, we will use them to
                       compare against model predictions.
     """
-    # Use keras.utils.load_img() to correctly load the image and
-    # keras.utils.img_to_array() to convert it to the format needed
-    # before sending it to our model.
-    # You can use os.walk() or walkdir() to iterate over the files in the
-    # folder.
-    # Don't forget you must not return the raw model prediction. Model
-    # prediction will be a vector assigning probability scores to each
-    # class. You must take the position of the element in the vector with
-    # the highest probability and use that to get the corresponding class
-    # name from `class_names` list.
+    if isinstance(class_names, str):
+        class_names = get_model_class_names(class_names)
+
     predictions = []
     labels = []
 
-    for dirpath, filename in walkdir(folder):
-
-        # image path
-        img_path = os.path.join(dirpath, filename)
-
-        # get label name
-        label_name = os.path.basename(os.path.dirname(img_path))
-
-        img = tf.keras.utils.load_img(img_path, target_size=(input_size))
-
-        img_array = tf.keras.utils.img_to_array(img)
-        img_array = tf.expand_dims(img_array, 0)
-
-        pred = model.predict(img_array)
+    img_paths = (
+        os.path.join(dirpath, filename) for dirpath, filename in walkdir(folder)
+    )
+    predict_step = model
+    if isinstance(model, tf.keras.Model):
+        predict_step = make_predict_step(model)
+
+    if preprocess_cache is not None:
+        if preprocess_cache.decoder != "pil":
+            raise ValueError(
+                "The preprocess cache decodes with {}, not PIL".format(
+                    preprocess_cache.decoder
+                )
+            )
+        if preprocess_cache.image_size != tuple(input_size):
+            raise ValueError("The preprocess cache has a different image size")
+        if preprocess_cache.interpolation != interpolation:
+            raise ValueError(
+                "The preprocess cache resizes with {}, not {}".format(
+                    preprocess_cache.interpolation, interpolation
+                )
+            )
+        batches = preprocess_cache.iter_batches(img_paths, batch_size)
+    else:
+        batches = iter_image_batches(
+            img_paths, input_size, batch_size, num_workers, interpolation
+        )
+
+    for paths, img_batch in batches:
+        pred = np.asarray(predict_step(img_batch))
 
         # Get the position with highest score in output predictions
-        max_idx = np.argmax(pred)
-
-        # Get the class name
-        predicted_class = class_names[max_idx]
+        max_idxs = np.argmax(pred, axis=-1)
 
-        predictions.append(predicted_class)
-        labels.append(label_name)
+        for img_path, max_idx in zip(paths, max_idxs):
+            # Get the class name
+            predictions.append(class_names[max_idx])
+            # get label name
+            labels.append(os.path.basename(os.path.dirname(img_path)))
 
     return predictions, labels